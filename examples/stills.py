@@ -73,7 +73,12 @@ def connected():
             name = Path(args.file).stem
         connection.upload(0, slot_index, frame_atem, name=name, compress=True)
     elif args.action == "download":
-        connection.download(0, slot_index)
+        if args.raw:
+            # Write the frame to the file while it's being received
+            logging.info(f'Saving raw data to {args.file}')
+            connection.download(0, slot_index, output=open(args.file, 'wb'))
+        else:
+            connection.download(0, slot_index)
 
 
 def uploaded(store, slot):
@@ -82,12 +87,10 @@ def uploaded(store, slot):
 
 
 def downloaded(store, slot, data):
-    logging.info(f'Download complete, received {len(data)} bytes')
-    if args.raw:
-        logging.info(f'Saving raw data to {args.file}')
-        with open(args.file, 'wb') as handle:
-            handle.write(data)
+    if data is None:
+        logging.info('Download complete')
     else:
+        logging.info(f'Download complete, received {len(data)} bytes')
         mode = connection.mixerstate['video-mode']
         image = pyatem.media.atem_to_image(data, *mode.get_resolution())
         save_image(args.file, mode.get_resolution(), image)
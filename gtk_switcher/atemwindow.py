@@ -28,6 +28,8 @@ from gtk_switcher.connectionwindow import ConnectionWindow
 from gtk_switcher.switcher import SwitcherPage
 from pyatem.command import ProgramInputCommand, PreviewInputCommand, AutoCommand, TransitionPositionCommand, \
     InputPropertiesCommand
+from pyatem.mediacache import MediaCache
+from pyatem.meters import MeterAggregator
 from pyatem.protocol import AtemProtocol
 import pyatem.field as fieldmodule
 
@@ -52,6 +54,10 @@ class AtemConnection(threading.Thread):
         self.upload_progress = upload_progress
         self.atem = None
         self.ip = None
+        self.media_cache_size = 0
+        self.suppress_unchanged = False
+        self.bulk_meters = False
+        self.meters = None
         self.stop = False
         self.connected = False
         self.log = logging.getLogger('AtemConnection')
@@ -74,7 +80,14 @@ class AtemConnection(threading.Thread):
         else:
             self.log.info(f'Connect to {self.ip}')
             self.mixer = AtemProtocol(self.ip)
+        self.mixer.bulk_meters = self.bulk_meters
+        self.mixer.suppress_unchanged = self.suppress_unchanged
+        if self.media_cache_size > 0:
+            xdg_cache_home = os.path.expanduser(os.environ.get('XDG_CACHE_HOME', '~/.cache'))
+            path = os.path.join(xdg_cache_home, 'openswitcher', 'media')
+            self.mixer.media_cache = MediaCache(path, max_size=self.media_cache_size * 1024 * 1024)
         self.mixer.on('change', self.do_callback)
+        self.meters = MeterAggregator(self.mixer, self.do_meters_updated, rate=25)
         self.mixer.on('connected', self.do_connected)
         self.mixer.on('disconnected', self.do_disconnected)
         self.mixer.on('transfer-progress', self.do_transfer_progress)
@@ -96,6 +109,9 @@ class AtemConnection(threading.Thread):
     def do_callback(self, *args, **kwargs):
         GLib.idle_add(self.callback, *args, **kwargs)
 
+    def do_meters_updated(self, levels):
+        GLib.idle_add(self.callback, 'meters-updated', levels)
+
     def do_disconnected(self):
         self.connected = False
         GLib.idle_add(self.disconnected, "disconnected")
@@ -205,6 +221,9 @@ class AtemWindow(SwitcherPage, MediaPage, AudioPage, CameraPage):
         self.connection = AtemConnection(self.on_change, self.on_disconnect, self.on_transfer_progress,
                                          self.on_download_done, self.on_connect, self.on_upload_done,
                                          self.on_upload_progress)
+        self.connection.media_cache_size = self.settings.get_int('media-cache-size')
+        self.connection.suppress_unchanged = self.settings.get_boolean('suppress-unchanged')
+        self.connection.bulk_meters = self.settings.get_boolean('bulk-meters')
         self.routing = Routing(self.connection)
 
         if args.ip:
@@ -279,6 +298,7 @@ class AtemWindow(SwitcherPage, MediaPage, AudioPage, CameraPage):
         self.application.add_action(action)
 
         GLib.timeout_add_seconds(1, self.on_clock)
+        GLib.timeout_add(1000 // 25, self.on_meters_tick)
 
         Gtk.main()
 
@@ -424,6 +444,9 @@ class AtemWindow(SwitcherPage, MediaPage, AudioPage, CameraPage):
                                          self.on_upload_progress)
         self.connection.daemon = True
         self.connection.ip = self.settings.get_string('switcher-ip')
+        self.connection.media_cache_size = self.settings.get_int('media-cache-size')
+        self.connection.suppress_unchanged = self.settings.get_boolean('suppress-unchanged')
+        self.connection.bulk_meters = self.settings.get_boolean('bulk-meters')
         self.connection.start()
 
     def on_reconnect_clicked(self, widget, *args):
@@ -620,6 +643,8 @@ class AtemWindow(SwitcherPage, MediaPage, AudioPage, CameraPage):
                 self.on_fairlight_meter_levels_change(data)
             elif field == 'fairlight-master-levels':
                 self.on_fairlight_master_levels_change(data)
+            elif field == 'meters-updated':
+                self.on_meters_updated(data)
 
             else:
                 if field == 'time':
@@ -656,6 +681,12 @@ class AtemWindow(SwitcherPage, MediaPage, AudioPage, CameraPage):
         self.on_clock_stream_live()
         return True
 
+    def on_meters_tick(self):
+        # The aggregator only gets new data when the levels change, flush the pending levels and the decaying peaks
+        if self.connection.meters is not None:
+            self.connection.meters.tick()
+        return True
+
     def on_transfer_progress(self, store, slot, progress):
         if store == 0:
             # Media transfer
@@ -665,5 +665,12 @@ class AudioPage:
         self.vu['master'][0].set_fraction((data.level[0] + 60) / 60)
         self.vu['master'][1].set_fraction((data.level[1] + 60) / 60)
 
+    def on_meters_updated(self, levels):
+        for strip_id in levels:
+            if strip_id not in self.vu:
+                continue
+            self.vu[strip_id][0].set_fraction((levels[strip_id][0] + 60) / 60)
+            self.vu[strip_id][1].set_fraction((levels[strip_id][1] + 60) / 60)
+
     def on_open_eq_overlay(self, widget, *args):
         EqWindow(widget.strip_id, self.window, self.connection, self.provider)
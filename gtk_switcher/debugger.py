@@ -126,7 +126,7 @@ class DebuggerWindow:
             grid = Gtk.Grid(column_spacing=10, row_spacing=3)
             grid.set_margin_bottom(10)
             i = 0
-            for key in field.__dict__:
+            for key in field.get_attributes():
                 if key == "raw":
                     continue
                 keylabel = Gtk.Label(key, xalign=1.0)
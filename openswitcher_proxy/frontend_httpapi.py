@@ -14,7 +14,7 @@ import pyatem.command as commandmodule
 class FieldEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, FieldBase):
-            temp = obj.__dict__
+            temp = obj.get_attributes()
             result = {}
             for key in temp:
                 if key == 'raw':
@@ -61,12 +61,12 @@ class ApiRequestHandler(AuthRequestHandler):
         path = parts.path[1:]
         part = path.split('/')
         args = parts.query
-        if len(part) < 2:
-            return self.response({}, 400)
         if part[0] not in allowed_hw:
             return self.response({'error': 'unknown device specified'}, 404)
 
         hw = part[0]
+        if len(part) < 2 or part[1] == '':
+            return self.changes(hw, dict(parse_qsl(args)))
         fieldname = part[1]
         if fieldname in self.threadpool['hardware'][hw].switcher.mixerstate:
             field = self.threadpool['hardware'][hw].switcher.mixerstate[fieldname]
@@ -74,6 +74,23 @@ class ApiRequestHandler(AuthRequestHandler):
         else:
             return self.response({'error': 'unknown field'}, 404)
 
+    def changes(self, hw, arguments):
+        try:
+            since = int(arguments.get('since', 0))
+        except ValueError:
+            return self.response({'error': 'invalid sequence number'}, 400)
+
+        seq, snapshot, changes = self.threadpool['hardware'][hw].switcher.changes_since(since)
+        result = []
+        for path, version, value in changes:
+            result.append({
+                'field': path[0],
+                'index': list(path[1:]),
+                'version': version,
+                'value': value,
+            })
+        return self.response({'seq': seq, 'snapshot': snapshot, 'changes': result})
+
     def do_POST(self):
         if not self.verify_auth():
             return
@@ -1,5 +1,6 @@
 import re
 import threading
+import time
 import logging
 import json
 from functools import partial
@@ -8,6 +9,8 @@ from json import JSONDecodeError
 from .error import DependencyError
 from .frontend_httpapi import FieldEncoder
 import pyatem.command as commandmodule
+from pyatem.dispatcher import EventDispatcher
+from pyatem.meters import MeterAggregator
 
 try:
     import paho.mqtt.client as mqtt
@@ -17,6 +20,8 @@ except ModuleNotFoundError:
 
 
 class MqttFrontendThread(threading.Thread):
+    METER_FIELDS = {'audio-meter-levels', 'fairlight-meter-levels', 'fairlight-master-levels'}
+
     def __init__(self, config, threadlist):
         threading.Thread.__init__(self)
         if mqtt is None:
@@ -31,6 +36,11 @@ class MqttFrontendThread(threading.Thread):
         self.error = None
         self.readonly = not self.config.get('allow-writes', False)
         self.subscribe = self.config['topic-subscribe'] if 'topic-subscribe' in self.config else self.topic
+        self.meter_rate = self.config.get('meter-rate', None)
+        self.meters = []
+
+        # Publish from a separate thread so a slow broker doesn't stall the connection to the hardware
+        self.dispatcher = EventDispatcher(workers=1, name=self.name)
 
         regex = self.subscribe.replace('{hardware}', r'(?P<hardware>[^/]+)')
         regex = regex.replace('{field}', r'(?P<field>.+)')
@@ -58,19 +68,45 @@ class MqttFrontendThread(threading.Thread):
             # Hook into the events for the registered switchers and update the mqtt topic
             sw.on('connected', partial(self.on_switcher_connected, hw))
             sw.on('disconnected', partial(self.on_switcher_disconnected, hw))
-            sw.on('change', partial(self.on_switcher_changed, hw))
+            sw.on('change', self.dispatcher.wrap(partial(self.on_switcher_changed, hw),
+                                                 policy=EventDispatcher.COALESCE_LATEST))
+            if self.meter_rate is not None:
+                # Only the latest levels of a strip are published if the broker can't keep up with the meter rate
+                publish = self.dispatcher.wrap(self.on_strip_levels, policy=EventDispatcher.COALESCE_LATEST,
+                                               key=lambda hw, strip_id, levels: (hw, strip_id))
+                self.meters.append(MeterAggregator(sw, partial(self.on_meters, hw, publish), rate=self.meter_rate))
 
             if self.threadlist['hardware'][hw].status == 'connected':
                 # Hardware is already connected at this point, re-generate the initial data
                 self.on_switcher_connected(hw)
 
-        self.client.loop_forever()
+        if len(self.meters) == 0:
+            self.client.loop_forever()
+            return
+
+        # The aggregators only get new data when the levels change, flush the pending levels and decaying peaks
+        # at the meter rate
+        self.client.loop_start()
+        while True:
+            time.sleep(1 / self.meter_rate)
+            for meters in self.meters:
+                meters.tick()
 
     def on_switcher_changed(self, hw, field, value):
+        if self.meter_rate is not None and field in self.METER_FIELDS:
+            # Sent at a lower rate by on_meters instead
+            return
         raw = json.dumps(value, cls=FieldEncoder)
         topic = self.topic.format(hardware=hw, field=field)
         self.client.publish(topic, raw)
 
+    def on_meters(self, hw, publish, levels):
+        for strip_id in levels:
+            publish(hw, strip_id, levels[strip_id])
+
+    def on_strip_levels(self, hw, strip_id, levels):
+        self.on_switcher_changed(hw, f'meters/{strip_id}', levels)
+
     def on_switcher_connected(self, hw):
         self.on_switcher_changed(hw, 'status', {'upstream': True})
         sw = self.threadlist['hardware'][hw].switcher
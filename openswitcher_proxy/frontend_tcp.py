@@ -6,6 +6,7 @@ import socketserver
 from functools import partial
 
 from pyatem.command import TransferCompleteCommand
+from pyatem.dispatcher import EventDispatcher
 from pyatem.field import InitCompleteField
 from pyatem.transfer import TransferTask
 
@@ -16,7 +17,8 @@ class TCPHandler(socketserver.BaseRequestHandler):
         self.threadpool = threadpool
         self.device = None
         self.callback_id = None
-        self.callback_uploaded = None
+        self.callback_upload = None
+        self.dispatcher = None
         self.transfer_buffer = {}
         super().__init__(*args, **kwargs)
 
@@ -164,10 +166,14 @@ class TCPHandler(socketserver.BaseRequestHandler):
             # Initial sync
             self.send_initial_sync()
 
-            # Register events
-            self.callback_id = self.threadpool['hardware'][self.device].switcher.on('change', self.proxy_change)
-            self.callback_upload = self.threadpool['hardware'][self.device].switcher.on('upload-done',
-                                                                                        self.proxy_uploaded)
+            # Register events, these are sent from a separate thread so a slow client can't stall the connection
+            # to the hardware. If the client falls behind only the latest state of every field is sent.
+            self.dispatcher = EventDispatcher(workers=1, name=t.name)
+            switcher = self.threadpool['hardware'][self.device].switcher
+            proxy_change = self.dispatcher.wrap(self.proxy_change, policy=EventDispatcher.COALESCE_LATEST)
+            proxy_uploaded = self.dispatcher.wrap(self.proxy_uploaded)
+            self.callback_id = switcher.on('change', proxy_change)
+            self.callback_upload = switcher.on('upload-done', proxy_uploaded)
 
             # Proxying
             while True:
@@ -209,6 +215,8 @@ class TCPHandler(socketserver.BaseRequestHandler):
             self.threadpool['hardware'][self.device].switcher.off('change', self.callback_id)
         if self.callback_upload is not None:
             self.threadpool['hardware'][self.device].switcher.off('upload-done', self.callback_upload)
+        if self.dispatcher is not None:
+            self.dispatcher.close()
         self.server.numclients -= 1
 
     def proxy_change(self, key, val):
@@ -1,6 +1,7 @@
 import threading
 import logging
 
+from pyatem.mediacache import MediaCache
 from pyatem.protocol import AtemProtocol
 
 
@@ -20,7 +21,15 @@ class HardwareThread(threading.Thread):
             self.switcher = AtemProtocol(usb='auto')
         else:
             self.switcher = AtemProtocol(ip=self.config['address'])
+        self.switcher.fast_reconnect = self.config.get('fast-reconnect', False)
+        self.switcher.suppress_unchanged = self.config.get('suppress-unchanged', False)
+        self.switcher.command_window = self.config.get('command-window', 0)
+        self.switcher.lazy_decode = self.config.get('lazy-decode', False)
+        if 'media-cache' in self.config:
+            size = self.config.get('media-cache-size', 1024) * 1024 * 1024
+            self.switcher.media_cache = MediaCache(self.config['media-cache'], max_size=size)
         self.switcher.on('connected', self.on_connected)
+        self.switcher.on('resynced', self.on_resynced)
         self.switcher.on('change', self.on_change)
         self.switcher.on('disconnected', self.on_disconnected)
         self.switcher.connect()
@@ -38,6 +47,9 @@ class HardwareThread(threading.Thread):
         self.status = 'connected'
         logging.info('Initial state sync complete')
 
+    def on_resynced(self):
+        logging.info('State resynced after reconnect')
+
     def on_disconnected(self):
         self.status = 'lost connection'
         logging.error('Lost connection with the hardware')
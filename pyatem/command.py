@@ -9,6 +9,22 @@ class Command:
     def get_command(self):
         pass
 
+    def coalesce_key(self):
+        """
+        Key of the target this command sets a value on. When a newer command with the same key is sent before this
+        one has been sent to the hardware only the newer one is sent. Commands that return None are always sent.
+        """
+        return None
+
+    def expect(self):
+        """
+        The field the hardware sends back when this command has taken effect, used by
+        AtemProtocol.send_command_confirmed()
+
+        :return: Tuple of (field key, index, dict of attribute values) or None if it's not known
+        """
+        return None
+
     def _make_command(self, name, data):
         header = struct.pack('>H 2x 4s', len(data) + 8, name.encode())
         return header + data
@@ -85,6 +101,9 @@ class ProgramInputCommand(Command):
         self.index = index
         self.source = source
 
+    def expect(self):
+        return 'program-bus-input', self.index, {'source': self.source}
+
     def get_command(self):
         data = struct.pack('>B x H', self.index, self.source)
         return self._make_command('CPgI', data)
@@ -113,6 +132,9 @@ class PreviewInputCommand(Command):
         self.index = index
         self.source = source
 
+    def expect(self):
+        return 'preview-bus-input', self.index, {'source': self.source}
+
     def get_command(self):
         data = struct.pack('>B x H', self.index, self.source)
         return self._make_command('CPvI', data)
@@ -140,6 +162,9 @@ class AuxSourceCommand(Command):
         self.index = index
         self.source = source
 
+    def expect(self):
+        return 'aux-output-source', self.index, {'source': self.source}
+
     def get_command(self):
         data = struct.pack('>BBH', 1, self.index, self.source)
         return self._make_command('CAuS', data)
@@ -167,6 +192,9 @@ class TransitionPositionCommand(Command):
         self.index = index
         self.position = position
 
+    def coalesce_key(self):
+        return 'CTPs', self.index
+
     def get_command(self):
         position = self.position
         data = struct.pack('>BxH', self.index, position)
@@ -1043,6 +1071,9 @@ class AudioMasterPropertiesCommand(Command):
         self.volume = volume
         self.afv = afv
 
+    def coalesce_key(self):
+        return 'CAMM', self.volume is None, self.afv is None
+
     def get_command(self):
         mask = 0
         if self.volume is not None:
@@ -1173,6 +1204,9 @@ class AudioInputCommand(Command):
         self.on = on
         self.afv = afv
 
+    def coalesce_key(self):
+        return 'CAMI', self.source, self.balance is None, self.volume is None, self.on is None, self.afv is None
+
     def get_command(self):
         mask = 0
         if self.on is not None or self.afv is not None:
@@ -1242,6 +1276,10 @@ class FairlightMasterPropertiesCommand(Command):
         self.afv = afv
         self.eq_enable = eq_enable
 
+    def coalesce_key(self):
+        return ('CFMP', self.eq_gain is None, self.dynamics_gain is None, self.volume is None, self.afv is None,
+                self.eq_enable is None)
+
     def get_command(self):
         mask = 0
         if self.eq_enable is not None:
@@ -1332,6 +1370,11 @@ class FairlightStripPropertiesCommand(Command):
         self.volume = volume
         self.state = state
 
+    def coalesce_key(self):
+        fields = (self.delay, self.gain, self.eq_gain, self.eq_enable, self.dynamics_gain, self.balance, self.volume,
+                  self.state)
+        return ('CFSP', self.source, self.channel) + tuple(value is None for value in fields)
+
     def get_command(self):
         mask = 0
         if self.delay is not None:
@@ -1479,6 +1522,9 @@ class KeyOnAirCommand(Command):
         self.keyer = keyer
         self.enabled = enabled
 
+    def expect(self):
+        return 'key-on-air', self.index, {'keyer': self.keyer, 'enabled': self.enabled}
+
     def get_command(self):
         data = struct.pack('>BB?x', self.index, self.keyer, self.enabled)
         return self._make_command('CKOn', data)
@@ -2417,6 +2463,9 @@ class MultiviewInputCommand(Command):
         self.window = window
         self.source = source
 
+    def expect(self):
+        return 'multiviewer-input', self.index, {'window': self.window, 'source': self.source}
+
     def get_command(self):
         data = struct.pack('>BBH', self.index, self.window, self.source)
         return self._make_command('CMvI', data)
@@ -2738,6 +2787,12 @@ class CameraControlCommand(Command):
         self.datatype = datatype if datatype is not None else 0
         self.data = data
 
+    def coalesce_key(self):
+        # Relative adjustments add up so these can't be replaced by a newer one
+        if self.relative:
+            return None
+        return 'CCmd', self.destination, self.category, self.parameter
+
     def get_command(self):
         count = 0
         if self.data is not None:
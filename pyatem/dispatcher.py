@@ -0,0 +1,182 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import collections
+import logging
+import queue
+import threading
+
+from pyatem.field import LazyField
+from pyatem.protocol import AtemProtocol
+
+
+class Subscriber:
+    """
+    Queue of pending events for a single event handler. The overflow policy decides which events are lost.
+
+    :ivar callback: The event handler
+    :ivar policy: Overflow policy, one of the EventDispatcher.DROP_OLDEST or EventDispatcher.COALESCE_LATEST
+    :ivar maxsize: Maximum number of pending events for DROP_OLDEST
+    :ivar dropped: Number of events that were dropped because the queue was full
+    :ivar coalesced: Number of events that were replaced by a newer event with the same key
+    """
+
+    def __init__(self, dispatcher, callback, policy, maxsize, key):
+        self.dispatcher = dispatcher
+        self.callback = callback
+        self.policy = policy
+        self.maxsize = maxsize
+        self.key = key
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.dropped = 0
+        self.coalesced = 0
+        if policy == EventDispatcher.COALESCE_LATEST:
+            self.pending = collections.OrderedDict()
+        else:
+            self.pending = collections.deque()
+
+    def __call__(self, *args):
+        with self.lock:
+            if self.policy == EventDispatcher.COALESCE_LATEST:
+                # Events are never dropped here, a lost field update would leave a mirror of the state out of sync.
+                # The pending events are bounded by the number of distinct keys.
+                key = self._key(args)
+                if key in self.pending:
+                    # Replace the older event, the new one goes to the end to keep the order of the changes
+                    del self.pending[key]
+                    self.coalesced += 1
+                self.pending[key] = args
+            else:
+                if len(self.pending) >= self.maxsize:
+                    self.pending.popleft()
+                    self.dropped += 1
+                self.pending.append(args)
+
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.dispatcher.ready.put(self)
+
+    def _key(self, args):
+        try:
+            return self.key(*args)
+        except Exception as e:
+            # Deliver the event without coalescing instead of failing on the protocol thread
+            self.dispatcher.log.exception(f'Exception in coalescing key for {self.callback}: {e}')
+            return object()
+
+    def _pop(self):
+        if self.policy == EventDispatcher.COALESCE_LATEST:
+            return self.pending.popitem(last=False)[1]
+        return self.pending.popleft()
+
+    def run(self, limit):
+        """
+        Deliver pending events, this only runs on a single worker at a time so the events for a subscriber are
+        delivered in order.
+
+        :param limit: Maximum number of events to deliver before giving other subscribers a turn
+        """
+        for i in range(limit):
+            with self.lock:
+                if len(self.pending) == 0:
+                    self.scheduled = False
+                    return
+                args = self._pop()
+            try:
+                self.callback(*args)
+            except Exception as e:
+                self.dispatcher.log.exception(f'Exception in event handler {self.callback}: {e}')
+
+        with self.lock:
+            if len(self.pending) == 0:
+                self.scheduled = False
+                return
+        self.dispatcher.ready.put(self)
+
+    def __repr__(self):
+        return f'<Subscriber {self.callback} pending={len(self.pending)} dropped={self.dropped}>'
+
+
+class EventDispatcher:
+    """
+    Runs event handlers on a pool of worker threads instead of on the thread that receives the data from the
+    switcher. Every handler wrapped by the dispatcher gets its own bounded queue, so a slow handler only delays
+    its own events and never the protocol handling.
+
+    .. code-block:: python
+
+       dispatcher = EventDispatcher(workers=2)
+       switcher.on('change', dispatcher.wrap(on_change, policy=EventDispatcher.COALESCE_LATEST))
+
+    With DROP_OLDEST the oldest pending event is dropped when the queue of a handler is full. With
+    COALESCE_LATEST a pending event is replaced by a newer event with the same key, by default this is the field
+    and index for `change` events so only the latest state of every field is delivered. Events with different keys
+    are never dropped with COALESCE_LATEST.
+
+    :ivar subscribers: List of the wrapped handlers
+    """
+
+    DROP_OLDEST = 'drop-oldest'
+    COALESCE_LATEST = 'coalesce-latest'
+
+    # Number of events delivered to a handler before the worker moves on to the next handler
+    BATCH_SIZE = 64
+
+    def __init__(self, workers=4, name='dispatcher'):
+        self.log = logging.getLogger('EventDispatcher')
+        self.ready = queue.Queue()
+        self.subscribers = []
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f'{name}.{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def wrap(self, callback, policy=DROP_OLDEST, maxsize=1024, key=None):
+        """
+        Wrap an event handler so it runs on the dispatcher
+
+        :param callback: Event handler
+        :param policy: Overflow policy, DROP_OLDEST or COALESCE_LATEST
+        :param maxsize: Maximum number of pending events for this handler with DROP_OLDEST
+        :param key: Function that gets the event arguments and returns the key for COALESCE_LATEST
+        :return: Function to register with AtemProtocol.on()
+        """
+        if policy not in (self.DROP_OLDEST, self.COALESCE_LATEST):
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        subscriber = Subscriber(self, callback, policy, maxsize, key or change_key)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def close(self):
+        """
+        Stop the worker threads, pending events are not delivered
+        """
+        for thread in self.threads:
+            self.ready.put(None)
+        self.threads = []
+
+    def _worker(self):
+        while True:
+            subscriber = self.ready.get()
+            if subscriber is None:
+                return
+            subscriber.run(self.BATCH_SIZE)
+
+
+def change_key(*args):
+    """
+    Coalescing key for the `change` event, this is the field key and the index of the field. Fields that have an
+    index have the index bytes at the start of the raw field data, see AtemProtocol.FIELDNAME_UNIQUE. Fields without
+    a decoder class are passed as the raw bytes.
+    """
+    if len(args) != 2:
+        return args
+    key, contents = args
+    if key not in AtemProtocol.FIELDNAME_UNIQUE:
+        return key
+    if not isinstance(contents, LazyField) and hasattr(contents, 'strip_id'):
+        return key, contents.strip_id
+    raw = getattr(contents, 'raw', contents)
+    return key, AtemProtocol.FIELDNAME_UNIQUE[key].unpack_from(raw, 0)
@@ -10,6 +10,12 @@ from pyatem.hexdump import hexdump
 
 
 class FieldBase:
+    __slots__ = ('raw',)
+
+    # Fields that read their index in the state from the decoded data, like the Fairlight strip_id, can't be decoded
+    # lazily
+    LAZY = True
+
     def _get_string(self, raw):
         return raw.split(b'\x00')[0].decode()
 
@@ -17,6 +23,20 @@ class FieldBase:
         header = struct.pack('!H2x 4s', len(self.raw) + 8, self.__class__.CODE.encode())
         return header + self.raw
 
+    def get_attributes(self):
+        """
+        Get all the attributes that are set on this field, the field classes use __slots__ so they don't have a
+        __dict__ to get these from.
+
+        :return: dict of attribute names and values
+        """
+        result = {}
+        for cls in reversed(type(self).__mro__):
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    result[name] = getattr(self, name)
+        return result
+
     def serialize(self):
         return None
 
@@ -25,6 +45,54 @@ class FieldBase:
         return
 
 
+class LazyField:
+    """
+    Placeholder for a field that hasn't been decoded yet. The field is decoded on the first attribute access and
+    the placeholder then behaves like the decoded field, isinstance() checks against the field class also work.
+
+    :ivar raw: The raw field data
+    """
+    __slots__ = ('_decoder', '_field', 'raw')
+
+    def __init__(self, decoder, raw):
+        object.__setattr__(self, '_decoder', decoder)
+        object.__setattr__(self, '_field', None)
+        object.__setattr__(self, 'raw', raw)
+
+    def decode(self):
+        """
+        Get the decoded field
+
+        :return: Instance of the field class
+        """
+        field = self._field
+        if field is None:
+            field = self._decoder(self.raw)
+            object.__setattr__(self, '_field', field)
+        return field
+
+    @property
+    def __class__(self):
+        return self._decoder
+
+    @property
+    def decoded(self):
+        return self._field is not None
+
+    def make_packet(self):
+        header = struct.pack('!H2x 4s', len(self.raw) + 8, self._decoder.CODE.encode())
+        return header + self.raw
+
+    def __getattr__(self, name):
+        return getattr(self.decode(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.decode(), name, value)
+
+    def __repr__(self):
+        return repr(self.decode())
+
+
 class FirmwareVersionField(FieldBase):
     """
     Data from the `_ver` field. This stores the major/minor firmware version numbers
@@ -43,6 +111,7 @@ class FirmwareVersionField(FieldBase):
     """
 
     CODE = "_ver"
+    __slots__ = ('major', 'minor', 'version')
 
     def __init__(self, raw):
         """
@@ -80,6 +149,7 @@ class TimeField(FieldBase):
     :ivar dropframe: Is dropframe
     """
     CODE = "Time"
+    __slots__ = ('hours', 'minutes', 'seconds', 'frames', 'dropframe')
 
     def __init__(self, raw):
         self.raw = raw
@@ -108,6 +178,7 @@ class TimeConfigField(FieldBase):
     :ivar mode: Timecode mode
     """
     CODE = "TCCc"
+    __slots__ = ('mode',)
 
     def __init__(self, raw):
         self.raw = raw
@@ -135,6 +206,7 @@ class ProductNameField(FieldBase):
     """
 
     CODE = "_pin"
+    __slots__ = ('model', 'name')
 
     def __init__(self, raw):
         self.raw = raw
@@ -166,6 +238,7 @@ class MixerEffectConfigField(FieldBase):
     """
 
     CODE = "_MeC"
+    __slots__ = ('index', 'keyers')
 
     def __init__(self, raw):
         self.raw = raw
@@ -194,6 +267,7 @@ class MediaplayerSlotsField(FieldBase):
     """
 
     CODE = "_mpl"
+    __slots__ = ('stills', 'clips')
 
     def __init__(self, raw):
         self.raw = raw
@@ -225,6 +299,7 @@ class MediaplayerSelectedField(FieldBase):
     """
 
     CODE = "MPCE"
+    __slots__ = ('index', 'source_type', 'slot')
 
     def __init__(self, raw):
         self.raw = raw
@@ -291,6 +366,7 @@ class VideoModeField(FieldBase):
     """
 
     CODE = "VidM"
+    __slots__ = ('mode', 'resolution', 'interlaced', 'rate', 'widescreen')
 
     def __init__(self, raw):
         self.raw = raw
@@ -441,6 +517,7 @@ class VideoModeCapabilityField(FieldBase):
     """
 
     CODE = "_VMC"
+    __slots__ = ('modes',)
 
     def __init__(self, raw):
         self.raw = raw
@@ -565,6 +642,10 @@ class InputPropertiesField(FieldBase):
     PORT_KEY_MASK = 130
     PORT_MULTIVIEW_OUTPUT = 131
     CODE = "InPr"
+    __slots__ = ('index', 'name', 'short_name', 'source_category', 'port_type', 'source_ports', 'available_aux',
+                 'available_multiview', 'available_supersource_art', 'available_supersource_box',
+                 'available_key_source', 'available_aux1', 'available_aux2', 'available_usb', 'available_me1',
+                 'available_me2')
 
     def __init__(self, raw):
         self.raw = raw
@@ -613,6 +694,7 @@ class ProgramBusInputField(FieldBase):
     """
 
     CODE = "PrgI"
+    __slots__ = ('index', 'source')
 
     def __init__(self, raw):
         self.raw = raw
@@ -646,6 +728,7 @@ class PreviewBusInputField(FieldBase):
     """
 
     CODE = "PrvI"
+    __slots__ = ('index', 'source', 'in_program')
 
     def __init__(self, raw):
         self.raw = raw
@@ -705,6 +788,10 @@ class TransitionSettingsField(FieldBase):
     STYLE_DVE = 3
     STYLE_STING = 4
     CODE = "TrSS"
+    __slots__ = ('index', 'style', 'style_next', 'next_transition_bkgd', 'next_transition_key1', 'next_transition_key2',
+                 'next_transition_key3', 'next_transition_key4', 'next_transition_bkgd_next',
+                 'next_transition_key1_next', 'next_transition_key2_next', 'next_transition_key3_next',
+                 'next_transition_key4_next')
 
     def __init__(self, raw):
         self.raw = raw
@@ -747,6 +834,7 @@ class TransitionPreviewField(FieldBase):
     """
 
     CODE = "TsPr"
+    __slots__ = ('index', 'enabled')
 
     def __init__(self, raw):
         self.raw = raw
@@ -782,6 +870,7 @@ class TransitionPositionField(FieldBase):
     """
 
     CODE = "TrPs"
+    __slots__ = ('index', 'in_transition', 'frames_remaining', 'position')
 
     def __init__(self, raw):
         self.raw = raw
@@ -812,6 +901,7 @@ class TallyIndexField(FieldBase):
     """
 
     CODE = "TlIn"
+    __slots__ = ('num', 'tally')
 
     def __init__(self, raw):
         self.raw = raw
@@ -847,6 +937,7 @@ class TallySourceField(FieldBase):
     """
 
     CODE = "TlSr"
+    __slots__ = ('num', 'tally')
 
     def __init__(self, raw):
         self.raw = raw
@@ -884,6 +975,7 @@ class KeyOnAirField(FieldBase):
     """
 
     CODE = "KeOn"
+    __slots__ = ('index', 'keyer', 'enabled')
 
     def __init__(self, raw):
         self.raw = raw
@@ -915,6 +1007,7 @@ class ColorGeneratorField(FieldBase):
     """
 
     CODE = "ColV"
+    __slots__ = ('index', 'hue', 'saturation', 'luma')
 
     def __init__(self, raw):
         self.raw = raw
@@ -965,6 +1058,7 @@ class AuxOutputSourceField(FieldBase):
     """
 
     CODE = "AuxS"
+    __slots__ = ('index', 'source')
 
     def __init__(self, raw):
         self.raw = raw
@@ -996,6 +1090,7 @@ class FadeToBlackStateField(FieldBase):
     """
 
     CODE = "FtbS"
+    __slots__ = ('index', 'done', 'transitioning', 'frames_remaining')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1034,6 +1129,7 @@ class MediaplayerFileInfoField(FieldBase):
     """
 
     CODE = "MPfe"
+    __slots__ = ('type', 'index', 'is_used', 'hash', 'name')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1114,6 +1210,8 @@ class TopologyField(FieldBase):
     """
 
     CODE = "_top"
+    __slots__ = ('me_units', 'sources', 'downstream_keyers', 'aux_outputs', 'mixminus_outputs', 'mediaplayers',
+                 'multiviewers', 'rs485', 'hyperdecks', 'dve', 'stingers', 'supersources', 'multiviewer_routable')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1159,6 +1257,7 @@ class DkeyPropertiesBaseField(FieldBase):
     """
 
     CODE = "DskB"
+    __slots__ = ('index', 'fill_source', 'key_source')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1216,6 +1315,8 @@ class DkeyPropertiesField(FieldBase):
     """
 
     CODE = "DskP"
+    __slots__ = ('index', 'tie', 'rate', 'premultiplied', 'clip', 'gain', 'invert_key', 'masked', 'top', 'bottom',
+                 'left', 'right')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1293,6 +1394,7 @@ class DkeyStateField(FieldBase):
     """
 
     CODE = "DskS"
+    __slots__ = ('index', 'on_air', 'is_transitioning', 'is_autotransitioning', 'frames_remaining')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1330,6 +1432,7 @@ class TransitionMixField(FieldBase):
     """
 
     CODE = "TMxP"
+    __slots__ = ('index', 'rate')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1358,6 +1461,7 @@ class FadeToBlackField(FieldBase):
     """
 
     CODE = "FtbP"
+    __slots__ = ('index', 'rate')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1387,6 +1491,7 @@ class TransitionDipField(FieldBase):
     """
 
     CODE = "TDpP"
+    __slots__ = ('index', 'rate', 'source')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1425,6 +1530,8 @@ class TransitionWipeField(FieldBase):
     """
 
     CODE = "TWpP"
+    __slots__ = ('index', 'rate', 'pattern', 'width', 'source', 'symmetry', 'softness', 'positionx', 'positiony',
+                 'reverse', 'flipflop')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1484,6 +1591,8 @@ class TransitionDveField(FieldBase):
     """
 
     CODE = "TDvP"
+    __slots__ = ('index', 'rate', 'style', 'fill_source', 'key_source', 'key_enable', 'key_premultiplied', 'key_clip',
+                 'key_gain', 'key_invert', 'reverse', 'flipflop')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1542,6 +1651,8 @@ class TransitionStingerField(FieldBase):
     """
 
     CODE = "TStP"
+    __slots__ = ('index', 'mediaplayer', 'key_premultiplied', 'key_clip', 'key_gain', 'key_invert', 'preroll',
+                 'duration', 'triggerpoint', 'rate')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1580,6 +1691,7 @@ class AudioMixerMasterPropertiesField(FieldBase):
     """
 
     CODE = "AMMO"
+    __slots__ = ('volume', 'afv')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1613,6 +1725,7 @@ class AudioMixerMonitorPropertiesField(FieldBase):
     """
 
     CODE = "AMmO"
+    __slots__ = ('enabled', 'volume', 'mute', 'solo', 'solo_source', 'dim', 'dim_volume')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1654,6 +1767,8 @@ class AudioMixerInputPropertiesField(FieldBase):
     """
 
     CODE = "AMIP"
+    LAZY = False
+    __slots__ = ('index', 'type', 'is_media_player', 'number', 'mix_option', 'volume', 'balance', 'strip_id')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1687,6 +1802,7 @@ class AudioMixerTallyField(FieldBase):
     """
 
     CODE = "AMTl"
+    __slots__ = ('num', 'tally')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1731,6 +1847,7 @@ class FairlightMasterPropertiesField(FieldBase):
     """
 
     CODE = "FAMP"
+    __slots__ = ('eq_enable', 'eq_gain', 'dynamics_gain', 'volume', 'afv')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1778,6 +1895,9 @@ class FairlightStripPropertiesField(FieldBase):
     """
 
     CODE = "FASP"
+    LAZY = False
+    __slots__ = ('index', 'is_split', 'subchannel', 'delay', 'gain', 'eq_enable', 'eq_gain', 'dynamics_gain', 'pan',
+                 'volume', 'state', 'strip_id')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1821,6 +1941,7 @@ class FairlightStripDeleteField(FieldBase):
     """
 
     CODE = "FASD"
+    __slots__ = ()
 
     def __init__(self, raw):
         self.raw = raw
@@ -1857,6 +1978,7 @@ class FairlightAudioInputField(FieldBase):
     """
 
     CODE = "FAIP"
+    __slots__ = ('index', 'type', 'number', 'split', 'level')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1894,6 +2016,7 @@ class FairlightTallyField(FieldBase):
     """
 
     CODE = "FMTl"
+    __slots__ = ('num', 'tally')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1929,6 +2052,7 @@ class FairlightHeadphonesField(FieldBase):
     """
 
     CODE = "FMHP"
+    __slots__ = ('volume', 'unmuted')
 
     def __init__(self, raw):
         self.raw = raw
@@ -1956,6 +2080,7 @@ class FairlightSoloField(FieldBase):
     """
 
     CODE = "FAMS"
+    __slots__ = ('solo', 'channel', 'is_split_lr', 'subchannel')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2009,6 +2134,9 @@ class AtemEqBandPropertiesField(FieldBase):
     """
 
     CODE = "AEBP"
+    LAZY = False
+    __slots__ = ('index', 'is_split', 'subchannel', 'band_index', 'band_enabled', 'band_possible_filters',
+                 'band_filter', 'band_freq_range', 'band_frequency', 'band_gain', 'band_q', 'strip_id')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2101,6 +2229,8 @@ class AudioInputField(FieldBase):
     """
 
     CODE = "AMIP"
+    LAZY = False
+    __slots__ = ('index', 'type', 'number', 'plug', 'state', 'volume', 'balance', 'strip_id')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2136,6 +2266,8 @@ class KeyPropertiesBaseField(FieldBase):
     """
 
     CODE = "KeBP"
+    __slots__ = ('index', 'keyer', 'type', 'enabled', 'fly_enabled', 'fill_source', 'key_source', 'mask_enabled',
+                 'mask_top', 'mask_bottom', 'mask_left', 'mask_right')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2164,6 +2296,11 @@ class KeyPropertiesDveField(FieldBase):
     """
 
     CODE = "KeDV"
+    __slots__ = ('index', 'keyer', 'size_x', 'size_y', 'pos_x', 'pos_y', 'rotation', 'border_enabled', 'shadow_enabled',
+                 'border_bevel', 'border_outer_width', 'border_inner_width', 'border_outer_softness',
+                 'border_inner_softness', 'border_bevel_softness', 'border_bevel_position', 'border_opacity',
+                 'border_hue', 'border_saturation', 'border_luma', 'light_angle', 'light_altitude', 'mask_enabled',
+                 'mask_top', 'mask_bottom', 'mask_left', 'mask_right', 'rate')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2216,6 +2353,7 @@ class KeyPropertiesLumaField(FieldBase):
     """
 
     CODE = "KeLm"
+    __slots__ = ('index', 'keyer', 'premultiplied', 'clip', 'gain', 'key_inverted')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2238,6 +2376,8 @@ class KeyPropertiesAdvancedChromaField(FieldBase):
     """
 
     CODE = "KACk"
+    __slots__ = ('index', 'keyer', 'foreground', 'background', 'key_edge', 'spill_suppress', 'flare_suppress',
+                 'brightness', 'contrast', 'saturation', 'red', 'green', 'blue')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2269,6 +2409,7 @@ class KeyPropertiesAdvancedChromaColorpickerField(FieldBase):
     """
 
     CODE = "KACC"
+    __slots__ = ('index', 'keyer', 'cursor', 'preview', 'x', 'y', 'size', 'Y', 'Cb', 'Cr')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2326,6 +2467,8 @@ class RecordingDiskField(FieldBase):
     """
 
     CODE = "RTMD"
+    __slots__ = ('index', 'time_available', 'status', 'volumename', 'is_attached', 'is_ready', 'is_recording',
+                 'is_deleted')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2365,6 +2508,7 @@ class RecordingSettingsField(FieldBase):
     """
 
     CODE = "RMSu"
+    __slots__ = ('filename', 'disk1', 'disk2', 'record_in_cameras')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2407,6 +2551,8 @@ class RecordingStatusField(FieldBase):
     """
 
     CODE = "RMTS"
+    __slots__ = ('status', 'time_available', 'is_recording', 'is_stopping', 'disk_full', 'disk_error',
+                 'disk_unformatted', 'has_dropped')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2445,6 +2591,7 @@ class RecordingDurationField(FieldBase):
     """
 
     CODE = "RTMR"
+    __slots__ = ('hours', 'minutes', 'seconds', 'frames', 'has_dropped_frames')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2496,6 +2643,8 @@ class MultiviewerPropertiesField(FieldBase):
     """
 
     CODE = "MvPr"
+    __slots__ = ('index', 'layout', 'flip', 'u1', 'top_left_small', 'top_right_small', 'bottom_left_small',
+                 'bottom_right_small')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2571,6 +2720,7 @@ class MultiviewerInputField(FieldBase):
     """
 
     CODE = "MvIn"
+    __slots__ = ('index', 'window', 'source', 'vu', 'safearea')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2600,6 +2750,7 @@ class MultiviewerVuField(FieldBase):
     """
 
     CODE = "VuMC"
+    __slots__ = ('index', 'window', 'enabled')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2630,6 +2781,7 @@ class MultiviewerSafeAreaField(FieldBase):
     """
 
     CODE = "SaMw"
+    __slots__ = ('index', 'window', 'enabled')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2656,6 +2808,7 @@ class LockObtainedField(FieldBase):
 =    """
 
     CODE = "LKOB"
+    __slots__ = ('store',)
 
     def __init__(self, raw):
         self.raw = raw
@@ -2683,6 +2836,7 @@ class LockStateField(FieldBase):
     """
 
     CODE = "LKST"
+    __slots__ = ('store', 'state', 'u1')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2712,6 +2866,7 @@ class FileTransferDataField(FieldBase):
     """
 
     CODE = "FTDa"
+    __slots__ = ('transfer', 'size', 'data')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2748,6 +2903,7 @@ class FileTransferErrorField(FieldBase):
     """
 
     CODE = "FTDE"
+    __slots__ = ('transfer', 'status')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2784,6 +2940,7 @@ class FileTransferDataCompleteField(FieldBase):
     """
 
     CODE = "FTDC"
+    __slots__ = ('transfer', 'u1', 'u2')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2815,6 +2972,7 @@ class FileTransferContinueDataField(FieldBase):
     """
 
     CODE = "FTCD"
+    __slots__ = ('transfer', 'size', 'count')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2850,6 +3008,7 @@ class MacroPropertiesField(FieldBase):
     """
 
     CODE = "MPrp"
+    __slots__ = ('index', 'is_used', 'is_invalid', 'name', 'description')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2885,6 +3044,7 @@ class MacroRecordStatusField(FieldBase):
     """
 
     CODE = "MRcS"
+    __slots__ = ('is_recording', 'index')
 
     def __init__(self, raw):
         self.raw = raw
@@ -2929,6 +3089,7 @@ class AudioMeterLevelsField(FieldBase):
     """
 
     CODE = "AMLv"
+    __slots__ = ('count', 'master', 'monitor', 'input')
 
     def __init__(self, raw):
         self.raw = raw
@@ -3013,6 +3174,9 @@ class FairlightMeterLevelsField(FieldBase):
     """
 
     CODE = "FMLv"
+    LAZY = False
+    __slots__ = ('index', 'is_split', 'subchannel', 'strip_id', 'input', 'expander_gr', 'compressor_gr', 'limiter_gr',
+                 'output', 'level')
     COEFF = 10 ** (40 / 20)
 
     def __init__(self, raw):
@@ -3098,6 +3262,7 @@ class FairlightMasterLevelsField(FieldBase):
     """
 
     CODE = "FDLv"
+    __slots__ = ('input', 'compressor_gr', 'limiter_gr', 'output', 'level')
     COEFF = 10 ** (40 / 20)
 
     def __init__(self, raw):
@@ -3254,6 +3419,7 @@ class CameraControlDataPacketFieldDisabled(FieldBase):
     """
 
     CODE = "CCdP"
+    __slots__ = ('destination', 'category', 'parameter', 'datatype', 'length', 'data')
 
     def __init__(self, raw):
         self.raw = raw
@@ -3323,6 +3489,7 @@ class StreamingAudioBitrateField(FieldBase):
     """
 
     CODE = "STAB"
+    __slots__ = ('min', 'max')
 
     def __init__(self, raw):
         self.raw = raw
@@ -3353,6 +3520,7 @@ class StreamingServiceField(FieldBase):
     """
 
     CODE = "SRSU"
+    __slots__ = ('name', 'url', 'key', 'min', 'max')
 
     def __init__(self, raw):
         self.raw = raw
@@ -3393,6 +3561,7 @@ class StreamingStatusField(FieldBase):
     """
 
     CODE = "StRS"
+    __slots__ = ('status',)
 
     def __init__(self, raw):
         self.raw = raw
@@ -3416,6 +3585,7 @@ class StreamingStatsField(FieldBase):
     """
 
     CODE = "SRSS"
+    __slots__ = ('bitrate', 'cache')
 
     def __init__(self, raw):
         self.raw = raw
@@ -3445,6 +3615,7 @@ class AutoInputVideoModeField(FieldBase):
     """
 
     CODE = "AiVM"
+    __slots__ = ('enabled', 'detected')
 
     def __init__(self, raw):
         self.raw = raw
@@ -3466,6 +3637,7 @@ class InitCompleteField(FieldBase):
     """
 
     CODE = "InCm"
+    __slots__ = ()
 
     def __init__(self, raw):
         self.raw = raw
@@ -3497,6 +3669,7 @@ class TransferCompleteField(FieldBase):
     """
 
     CODE = "*XFC"
+    __slots__ = ('store', 'slot', 'upload')
 
     def __init__(self, raw):
         self.raw = raw
@@ -3512,6 +3685,8 @@ class SupersourceBoxPropertiesField(FieldBase):
     """
 
     CODE = "SSBP"
+    __slots__ = ('index', 'box', 'enabled', 'source', 'x', 'y', 'size', 'masked', 'mask_top', 'mask_bottom',
+                 'mask_left', 'mask_right')
 
     def __init__(self, raw):
         self.raw = raw
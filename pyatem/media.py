@@ -3,6 +3,9 @@
 import struct
 import pyatem.mediaconvert as mc
 
+# A block of 8 0xfe bytes starts an RLE sequence of 24 bytes: marker, repeat count and the repeated block
+RLE_MARKER = b'\xfe\xfe\xfe\xfe\xfe\xfe\xfe\xfe'
+
 
 def atem_to_image(data, width, height):
     """Decompress and decode an atem frame to RGBA8888"""
@@ -67,7 +70,7 @@ def rle_encode(data):
     return mc.rle_encode(data)
 
 
-def rle_decode(data):
+def rle_decode(data, output=None):
     """
     ATEM frames are compressed with a custom RLE encoding. Data in the frame is grouped in 8 byte chunks since
     that is exactly 2 pixels in the 10-bit YCbCr 4:2:2 data. Most of the data is sent without compression but
@@ -76,6 +79,16 @@ def rle_decode(data):
     An RLE compressed part is an 64 bit integer setting the repeat count following the 8-byte block of data
     to be repeated. This seems mainly useful to compress solid colors.
 
+    :param data: Compressed data, any bytes-like object
+    :param output: Writable buffer like a bytearray to decode into instead of allocating a new one
+    :return: The decoded data, or the number of bytes written when output is set
+    """
+    return mc.rle_decode(data, output)
+
+
+def rle_decode_slow(data):
+    """
+    Python implementation of rle_decode
     :param data:
     :return:
     """
@@ -107,6 +120,71 @@ def rle_decode(data):
     return result
 
 
+def rle_sequences(data):
+    """
+    Find the RLE sequences in compressed data. Transfers can't be split into chunks inside these sequences.
+
+    :param data: RLE compressed data
+    :return: Sorted list of the offsets of the RLE sequences
+    """
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    result = []
+    offset = data.find(RLE_MARKER)
+    while offset != -1:
+        if offset % 8 != 0:
+            offset = data.find(RLE_MARKER, offset + 1)
+            continue
+        result.append(offset)
+        offset = data.find(RLE_MARKER, offset + 24)
+    return result
+
+
+class RleDecoder:
+    """
+    Incremental version of rle_decode for data that arrives in chunks. The chunks don't have to end on a block
+    boundary, the data of an incomplete block or RLE sequence at the end of a chunk is kept until the next chunk.
+
+    :ivar write: Function that is called with every decoded part, the part is only valid during the call
+    :ivar pending: Data from the previous chunks that could not be decoded yet
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self.pending = b''
+
+    def feed(self, data):
+        data = self.pending + data if self.pending else bytes(data)
+        view = memoryview(data)
+        end = len(data) - len(data) % 8
+        offset = 0
+        while offset < end:
+            marker = data.find(RLE_MARKER, offset, end)
+            while marker != -1 and marker % 8 != 0:
+                marker = data.find(RLE_MARKER, marker + 1, end)
+            if marker == -1:
+                self.write(view[offset:end])
+                offset = end
+                break
+            if marker > offset:
+                self.write(view[offset:marker])
+            offset = marker
+            if marker + 24 > len(data):
+                break
+            count, = struct.unpack_from('>Q', data, marker + 8)
+            self.write(data[marker + 16:marker + 24] * count)
+            offset = marker + 24
+        self.pending = data[offset:]
+
+    def finish(self):
+        """
+        Write the data that is left over at the end of the transfer
+        """
+        if self.pending:
+            self.write(self.pending)
+            self.pending = b''
+
+
 if __name__ == '__main__':
     with open('/workspace/test.bin', 'wb') as handle:
         handle.write(
@@ -0,0 +1,212 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+
+
+class MediaCache:
+    """
+    Content-addressed cache for media pool stills on disk. Frames are stored under the MD5 hash of the uncompressed
+    frame in the ATEM format, which is the same hash the switcher reports for every slot in the
+    mediaplayer-file-info field. The RLE compressed payload is stored next to the frame so uploading the same
+    content again doesn't have to compress it again. The least recently used frames are removed when the cache
+    grows over max_size.
+
+    .. code-block:: python
+
+       switcher.media_cache = MediaCache('/home/user/.cache/openswitcher/media', max_size=2 * 1024 ** 3)
+
+    :ivar path: Directory with the cache files
+    :ivar max_size: Maximum size of the cache files in bytes
+    :ivar size: Current size of the cache files in bytes
+    :ivar hits: Number of lookups that were served from the cache
+    :ivar misses: Number of lookups for content that was not in the cache
+    """
+
+    KINDS = ('frame', 'rle')
+
+    def __init__(self, path, max_size=1024 ** 3):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.log = logging.getLogger('MediaCache')
+        self.lock = threading.Lock()
+        self.executor = None
+
+        # Hex hash to dict of kind to file size, in least recently used order
+        self.entries = collections.OrderedDict()
+
+        os.makedirs(path, exist_ok=True)
+        found = []
+        for name in os.listdir(path):
+            key, _, kind = name.partition('.')
+            if kind not in self.KINDS:
+                continue
+            stat = os.stat(os.path.join(path, name))
+            found.append((stat.st_mtime, key, kind, stat.st_size))
+        for mtime, key, kind, size in sorted(found):
+            self.entries.setdefault(key, {})[kind] = size
+            self.entries.move_to_end(key)
+            self.size += size
+        self._evict()
+
+    def _file(self, key, kind):
+        return os.path.join(self.path, f'{key}.{kind}')
+
+    def _get(self, digest, kind):
+        key = digest.hex()
+        with self.lock:
+            if kind not in self.entries.get(key, {}):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._file(key, kind), 'rb') as handle:
+                data = handle.read()
+            os.utime(self._file(key, kind))
+        except OSError as e:
+            self.log.warning(f'Could not read {key}.{kind} from the cache: {e}')
+            with self.lock:
+                self._remove(key)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def get(self, digest):
+        """
+        Get an uncompressed frame
+
+        :param digest: 16 byte MD5 hash of the frame
+        :return: The frame or None if it's not in the cache
+        """
+        return self._get(digest, 'frame')
+
+    def get_compressed(self, digest):
+        """
+        Get the RLE compressed payload of a frame
+
+        :param digest: 16 byte MD5 hash of the uncompressed frame
+        :return: The compressed frame or None if it's not in the cache
+        """
+        return self._get(digest, 'rle')
+
+    def get_background(self, digest):
+        """
+        Get an uncompressed frame, the file is read from a background thread
+
+        :param digest: 16 byte MD5 hash of the frame
+        :return: concurrent.futures.Future with the frame or None if it's not in the cache
+        """
+        return self._submit(self.get, digest)
+
+    def get_compressed_background(self, digest):
+        """
+        Get the RLE compressed payload of a frame, the file is read from a background thread
+
+        :param digest: 16 byte MD5 hash of the uncompressed frame
+        :return: concurrent.futures.Future with the compressed frame or None if it's not in the cache
+        """
+        return self._submit(self.get_compressed, digest)
+
+    def has_compressed(self, digest):
+        """
+        Check if the compressed payload of a frame is in the cache without reading it
+
+        :param digest: 16 byte MD5 hash of the uncompressed frame
+        :return: True if the compressed frame is in the cache
+        """
+        with self.lock:
+            return 'rle' in self.entries.get(digest.hex(), {})
+
+    def __contains__(self, digest):
+        with self.lock:
+            return 'frame' in self.entries.get(digest.hex(), {})
+
+    def put(self, frame=None, compressed=None, digest=None):
+        """
+        Store a frame, the uncompressed frame and the compressed payload can be added separately
+
+        :param frame: The uncompressed frame in the ATEM format
+        :param compressed: The RLE compressed frame
+        :param digest: MD5 hash of the uncompressed frame, calculated from the frame if not set
+        :return: The hash of the frame
+        """
+        if digest is None:
+            digest = hashlib.md5(frame).digest()
+        key = digest.hex()
+        for kind, data in (('frame', frame), ('rle', compressed)):
+            if data is None:
+                continue
+            with self.lock:
+                if kind in self.entries.get(key, {}):
+                    continue
+            if len(data) > self.max_size:
+                continue
+            # Write to a temporary file first so a crash never leaves a partial frame under the final name
+            temp = self._file(key, kind) + '.tmp'
+            try:
+                with open(temp, 'wb') as handle:
+                    handle.write(data)
+                os.replace(temp, self._file(key, kind))
+            except OSError as e:
+                self.log.warning(f'Could not write {key}.{kind} to the cache: {e}')
+                continue
+            with self.lock:
+                self.entries.setdefault(key, {})[kind] = len(data)
+                self.entries.move_to_end(key)
+                self.size += len(data)
+        with self.lock:
+            self._evict()
+        return digest
+
+    def put_background(self, frame=None, compressed=None, digest=None):
+        """
+        Store a frame like put() but write the files from a background thread, so the caller doesn't wait for the
+        disk. The writes are done in the order they were added. Mutable data is copied first so the caller can
+        keep using it.
+
+        :param frame: The uncompressed frame in the ATEM format
+        :param compressed: The RLE compressed frame
+        :param digest: MD5 hash of the uncompressed frame, calculated from the frame if not set
+        :return: concurrent.futures.Future with the hash of the frame
+        """
+        if frame is not None:
+            frame = bytes(frame)
+        if compressed is not None:
+            compressed = bytes(compressed)
+        return self._submit(self.put, frame, compressed, digest)
+
+    def _submit(self, function, *args):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='MediaCache')
+        return self.executor.submit(function, *args)
+
+    def flush(self):
+        """
+        Wait until the background reads and writes that were started before are done
+        """
+        if self.executor is not None:
+            self.executor.submit(lambda: None).result()
+
+    def _remove(self, key):
+        for kind, size in self.entries.pop(key, {}).items():
+            self.size -= size
+            try:
+                os.unlink(self._file(key, kind))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self.size > self.max_size and len(self.entries) > 0:
+            key = next(iter(self.entries))
+            self.log.debug(f'Evicting {key} from the cache')
+            self._remove(key)
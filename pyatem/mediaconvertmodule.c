@@ -31,6 +31,14 @@ beputu64(uint64_t *dest, uint64_t v)
     for (int i = 0; i < 8; i++) buf[i] = (v >> ((7 - i) * 8)) & 0xff;
 }
 
+uint64_t
+begetu64(const uint8_t *buf)
+{
+    uint64_t v = 0;
+    for (int i = 0; i < 8; i++) v = (v << 8) | buf[i];
+    return v;
+}
+
 unsigned short
 clamp(unsigned short v, unsigned short min, unsigned short max)
 {
@@ -56,6 +64,7 @@ method_atem_to_rgb(PyObject *self, PyObject *args)
     char *resbuffer = (char *) malloc(data_length);
 
     if (resbuffer == NULL) {
+        PyBuffer_Release(&input_buffer);
         return PyErr_NoMemory();
     }
 
@@ -97,6 +106,7 @@ method_atem_to_rgb(PyObject *self, PyObject *args)
         buffer += pixel_size;
     }
 
+    PyBuffer_Release(&input_buffer);
     res = Py_BuildValue("y#", resbuffer, data_length);
     free(resbuffer);
     return res;
@@ -121,6 +131,7 @@ method_rgb_to_atem(PyObject *self, PyObject *args)
 
     char *outbuffer = (char *) malloc(data_length);
     if (outbuffer == NULL) {
+        PyBuffer_Release(&input_buffer);
         return PyErr_NoMemory();
     }
 
@@ -172,6 +183,7 @@ method_rgb_to_atem(PyObject *self, PyObject *args)
         buffer += pixel_size;
     }
 
+    PyBuffer_Release(&input_buffer);
     res = Py_BuildValue("y#", outbuffer, data_length);
     free(outbuffer);
     return res;
@@ -192,6 +204,10 @@ method_rle_encode(PyObject *self, PyObject *args)
     Py_ssize_t c = 0, i, w;
     uint64_t *data = input_buffer.buf;
     uint64_t *buf = malloc(input_buffer.len);
+    if (buf == NULL) {
+        PyBuffer_Release(&input_buffer);
+        return PyErr_NoMemory();
+    }
     for (i = 0, w = 0, c = 0; i < input_buffer.len / 8; ++i) {
         assert(data[i] != RLE_HEADER);
         if (i != 0 && data[i - 1] == data[i]) {
@@ -224,15 +240,111 @@ method_rle_encode(PyObject *self, PyObject *args)
         buf[0] = data[0];
     }
 
+    PyBuffer_Release(&input_buffer);
     res = Py_BuildValue("y#", buf, w * 8);
     free(buf);
     return res;
 }
 
+/* Walk the RLE sequences in the input, writes the decoded data to output if it's not NULL. Returns the decoded
+ * size or -1 with an exception set when the input ends inside an RLE sequence. */
+static Py_ssize_t
+rle_decode_into(const uint8_t *data, Py_ssize_t len, uint8_t *output)
+{
+    const uint64_t header = RLE_HEADER;
+    Py_ssize_t i = 0, w = 0;
+
+    while (i < len) {
+        if (len - i < 8 || memcmp(data + i, &header, 8) != 0) {
+            /* Raw block, copy all raw blocks up to the next RLE sequence at once */
+            Py_ssize_t start = i;
+            while (i + 8 <= len && memcmp(data + i, &header, 8) != 0) {
+                i += 8;
+            }
+            if (i + 8 > len) {
+                i = len;
+            }
+            if (output != NULL) {
+                memcpy(output + w, data + start, i - start);
+            }
+            w += i - start;
+            continue;
+        }
+
+        if (len - i < 24) {
+            PyErr_SetString(PyExc_ValueError, "Data ends inside an RLE sequence");
+            return -1;
+        }
+        uint64_t count = begetu64(data + i + 8);
+        if (count > (uint64_t)(PY_SSIZE_T_MAX - w) / 8) {
+            PyErr_SetString(PyExc_ValueError, "RLE repeat count is too large");
+            return -1;
+        }
+        Py_ssize_t size = (Py_ssize_t)count * 8;
+        if (output != NULL && size > 0) {
+            /* Repeat the block by doubling the copied area */
+            memcpy(output + w, data + i + 16, 8);
+            for (Py_ssize_t done = 8; done < size; done *= 2) {
+                memcpy(output + w + done, output + w, done < size - done ? done : size - done);
+            }
+        }
+        w += size;
+        i += 24;
+    }
+    return w;
+}
+
+static PyObject *
+method_rle_decode(PyObject *self, PyObject *args)
+{
+    Py_buffer input_buffer;
+    Py_buffer output_buffer;
+    PyObject *output = Py_None;
+    PyObject *res;
+    Py_ssize_t size;
+
+    /* Parse arguments */
+    if (!PyArg_ParseTuple(args, "y*|O", &input_buffer, &output)) {
+        return NULL;
+    }
+
+    size = rle_decode_into(input_buffer.buf, input_buffer.len, NULL);
+    if (size < 0) {
+        PyBuffer_Release(&input_buffer);
+        return NULL;
+    }
+
+    if (output == Py_None) {
+        res = PyBytes_FromStringAndSize(NULL, size);
+        if (res != NULL) {
+            rle_decode_into(input_buffer.buf, input_buffer.len, (uint8_t *)PyBytes_AS_STRING(res));
+        }
+        PyBuffer_Release(&input_buffer);
+        return res;
+    }
+
+    if (PyObject_GetBuffer(output, &output_buffer, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS) < 0) {
+        PyBuffer_Release(&input_buffer);
+        return NULL;
+    }
+    if (output_buffer.len < size) {
+        PyErr_Format(PyExc_ValueError, "Output buffer is %zd bytes, the decoded data is %zd bytes",
+                     output_buffer.len, size);
+        res = NULL;
+    } else {
+        rle_decode_into(input_buffer.buf, input_buffer.len, output_buffer.buf);
+        res = PyLong_FromSsize_t(size);
+    }
+    PyBuffer_Release(&output_buffer);
+    PyBuffer_Release(&input_buffer);
+    return res;
+}
+
 static PyMethodDef MediaConvertMethods[] = {
     {"atem_to_rgb", method_atem_to_rgb, METH_VARARGS, "Convert an Atem YCbCrA frame to RGB8888"},
     {"rgb_to_atem", method_rgb_to_atem, METH_VARARGS, "Convert an RGB8888 frame to Atem YCbCrA"},
     {"rle_encode",  method_rle_encode,  METH_VARARGS, "Compress data using the custom Atem RLE encoding"},
+    {"rle_decode",  method_rle_decode,  METH_VARARGS, "Decompress data in the custom Atem RLE encoding"},
     {NULL,          NULL,               0,            NULL},
 };
 
@@ -0,0 +1,336 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import math
+import struct
+import threading
+import time
+from array import array
+
+try:
+    import numpy
+except ModuleNotFoundError:
+    numpy = None
+
+
+def _fairlight_level(value):
+    # Same curve as FairlightMeterLevelsField._level()
+    coeff = 10 ** (40 / 20)
+    value = (value + 10000) / 10000
+    return (math.exp((math.log(coeff + 1) * value)) - 1) / coeff * 60 - 60
+
+
+class MeterMatrix:
+    """
+    Storage for the audio meter levels of a switcher. Instead of decoding every meter field into a field object
+    all meter fields in a packet are decoded in one go into a preallocated matrix with a row per strip. The levels
+    are stored in dB, NumPy is used for the conversion when available, otherwise the matrix is a flat array.
+
+    The classic audio mixer only has the LEVEL columns, the Fairlight master doesn't have an expander.
+
+    :ivar strips: Dict of strip id to row index in the matrix
+    :ivar updated: List of strip ids that were updated in the last packet
+    :ivar levels: The matrix with the levels, a 2D NumPy array or a flat array with COLUMNS values per strip
+    """
+
+    INPUT = 0
+    EXPANDER_GR = 4
+    COMPRESSOR_GR = 5
+    LIMITER_GR = 6
+    OUTPUT = 7
+    LEVEL = 11
+    COLUMNS = 15
+
+    # dB value for every possible Fairlight meter value, indexed by the value + 10000
+    FAIRLIGHT_TABLE = array('d', [_fairlight_level(v) for v in range(-10000, 1)])
+
+    # Column of each value in the FDLv field
+    MASTER_COLUMNS = [0, 1, 2, 3, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+
+    STRUCT_FAIRLIGHT_HEADER = struct.Struct('>6xBBH')
+    STRUCT_FAIRLIGHT = struct.Struct('>15h')
+    STRUCT_MASTER = struct.Struct('>14h')
+
+    def __init__(self, capacity=64, use_numpy=True):
+        self.numpy = numpy is not None and use_numpy
+        self.capacity = capacity
+        self.strips = {}
+        self.updated = []
+        self._names = []
+        self._rows = {}
+        if self.numpy:
+            self.levels = numpy.full((capacity, self.COLUMNS), -60.0)
+            self._table = numpy.array(self.FAIRLIGHT_TABLE)
+            self._master_columns = numpy.array(self.MASTER_COLUMNS)
+        else:
+            self.levels = array('d', [-60.0]) * (capacity * self.COLUMNS)
+
+    def _row(self, strip_id):
+        if strip_id in self.strips:
+            return self.strips[strip_id]
+        row = len(self.strips)
+        if row == self.capacity:
+            if self.numpy:
+                extra = numpy.full((self.capacity, self.COLUMNS), -60.0)
+                self.levels = numpy.concatenate((self.levels, extra))
+            else:
+                self.levels.extend(array('d', [-60.0]) * (self.capacity * self.COLUMNS))
+            self.capacity *= 2
+        self.strips[strip_id] = row
+        self._names.append(strip_id)
+        return row
+
+    def _fairlight_row(self, header):
+        # Row for a FMLv field based on the is_split, subchannel and source index bytes
+        if header in self._rows:
+            return self._rows[header]
+        is_split, subchannel, index = self.STRUCT_FAIRLIGHT_HEADER.unpack(b'\0' * 6 + header)
+        if is_split == 0xff:
+            strip_id = f"{index}.{subchannel}"
+        else:
+            strip_id = f"{index}.0"
+        row = self._row(strip_id)
+        self._rows[header] = row
+        return row
+
+    def update(self, fields):
+        """
+        Decode the meter fields of a packet
+
+        :param fields: list of (code, raw) tuples for the AMLv, FMLv and FDLv fields
+        """
+        self.updated = []
+        fairlight = []
+        for code, raw in fields:
+            if code == b'FMLv':
+                fairlight.append(raw)
+            elif code == b'FDLv':
+                self._update_master(raw)
+            elif code == b'AMLv':
+                self._update_audio(raw)
+
+        if len(fairlight) > 0:
+            self._update_fairlight(fairlight)
+
+    def _update_fairlight(self, fields):
+        rows = [self._fairlight_row(bytes(raw[6:10])) for raw in fields]
+        self.updated.extend(self._names[row] for row in rows)
+
+        if self.numpy:
+            data = numpy.frombuffer(b''.join(raw[10:40] for raw in fields), dtype='>i2')
+            values = numpy.clip(data.reshape(len(fields), self.COLUMNS), -10000, 0) + 10000
+            self.levels[rows] = self._table[values]
+            return
+
+        table = self.FAIRLIGHT_TABLE
+        for row, raw in zip(rows, fields):
+            offset = row * self.COLUMNS
+            for i, value in enumerate(self.STRUCT_FAIRLIGHT.unpack_from(raw, 10)):
+                self.levels[offset + i] = table[min(max(value, -10000), 0) + 10000]
+
+    def _update_master(self, raw):
+        row = self._row('master')
+        self.updated.append('master')
+        values = self.STRUCT_MASTER.unpack_from(raw, 0)
+        if self.numpy:
+            values = numpy.clip(numpy.array(values), -10000, 0) + 10000
+            self.levels[row, self._master_columns] = self._table[values]
+            return
+
+        offset = row * self.COLUMNS
+        for column, value in zip(self.MASTER_COLUMNS, values):
+            self.levels[offset + column] = self.FAIRLIGHT_TABLE[min(max(value, -10000), 0) + 10000]
+
+    def _update_audio(self, raw):
+        count, = struct.unpack_from('>H', raw, 0)
+        sources = struct.unpack_from('>{}H'.format(count), raw, 36)
+        offset = int(math.ceil((36 + (2 * count)) / 4.0) * 4)
+        strips = ['master', 'monitor'] + [f'{source}.0' for source in sources]
+        rows = [self._row(strip) for strip in strips]
+        self.updated.extend(strips)
+
+        if self.numpy:
+            values = numpy.concatenate((
+                numpy.frombuffer(raw[4:36], dtype='>u4'),
+                numpy.frombuffer(raw[offset:offset + count * 16], dtype='>u4'),
+            )).reshape(count + 2, 4).astype(numpy.float64)
+            with numpy.errstate(divide='ignore'):
+                levels = numpy.log10(values / (128 * 65536)) * 20
+            levels[values == 0] = -60
+            self.levels[rows, self.LEVEL:self.LEVEL + 4] = levels
+            return
+
+        values = struct.unpack_from('>8I', raw, 4) + struct.unpack_from('>{}I'.format(count * 4), raw, offset)
+        for i, row in enumerate(rows):
+            for column in range(4):
+                value = values[i * 4 + column]
+                level = math.log10(value / (128 * 65536)) * 20 if value != 0 else -60
+                self.levels[row * self.COLUMNS + self.LEVEL + column] = level
+
+    def get(self, strip_id, column=0, count=COLUMNS):
+        """
+        Get the levels for a strip
+
+        :param strip_id: Strip id in the {source}.{subchannel} format, or master or monitor
+        :param column: First column to return
+        :param count: Number of columns to return
+        :return: tuple of levels in dB
+        """
+        row = self.strips[strip_id]
+        if self.numpy:
+            return tuple(self.levels[row, column:column + count].tolist())
+        offset = row * self.COLUMNS + column
+        return tuple(self.levels[offset:offset + count])
+
+    def get_level(self, strip_id):
+        """
+        Get the level after the fader
+
+        :param strip_id: Strip id in the {source}.{subchannel} format, or master or monitor
+        :return: tuple of (left level, right level, left peak, right peak) in dB
+        """
+        return self.get(strip_id, self.LEVEL, 4)
+
+    def __repr__(self):
+        return f'<MeterMatrix strips={len(self.strips)} updated={len(self.updated)}>'
+
+
+class MeterAggregator:
+    """
+    Reduces the rate of the audio meter updates for a consumer. The levels of every strip are combined over an
+    interval and the callback is called at most `rate` times per second with the highest level in the interval
+    and a peak-hold value that decays after the hold time. This works with both the `meters-updated` event from
+    bulk meter decoding and the separate meter field events.
+
+    The callback gets a dict of strip id to a tuple of (left level, right level, left peak hold, right peak hold) in
+    dB for the strips that were updated. It is called from the thread that handles the switcher events, or from the
+    thread that calls `tick()`. The switcher only sends meter data when the levels change, so the consumer should
+    call `tick()` from a timer at the update rate to get the last levels of an interval and the decaying peaks after
+    the meter updates stop.
+
+    :ivar rate: Maximum number of updates per second
+    :ivar hold: Seconds a peak is held before it decays
+    :ivar decay: Decay of the peak-hold value in dB per second
+    """
+
+    FLOOR = -60
+
+    def __init__(self, switcher, callback, rate=25, hold=1.0, decay=20.0):
+        self.switcher = switcher
+        self.callback = callback
+        self.rate = rate
+        self.hold = hold
+        self.decay = decay
+
+        self.last = time.monotonic()
+        self.lock = threading.RLock()
+
+        # strip id to [level left, level right] of the current interval
+        self.levels = {}
+
+        # strip id to the last (level left, level right, peak left, peak right) sent to the callback
+        self.current = {}
+
+        # strip id to [peak left, peak right, time left, time right]
+        self.peaks = {}
+
+        self.callback_ids = [
+            ('meters-updated', switcher.on('meters-updated', self._on_meters)),
+            ('change:audio-meter-levels', switcher.on('change:audio-meter-levels', self._on_audio)),
+            ('change:fairlight-meter-levels', switcher.on('change:fairlight-meter-levels', self._on_fairlight)),
+            ('change:fairlight-master-levels', switcher.on('change:fairlight-master-levels', self._on_master)),
+        ]
+
+    def close(self):
+        """
+        Stop receiving meter updates from the switcher
+        """
+        for event, callback_id in self.callback_ids:
+            self.switcher.off(event, callback_id)
+        self.callback_ids = []
+
+    def _on_meters(self, meters):
+        for strip_id in meters.updated:
+            level = meters.get_level(strip_id)
+            self._add(strip_id, level[0], level[1])
+        self._check()
+
+    def _on_audio(self, field):
+        self._add('master', field.master[0], field.master[1])
+        self._add('monitor', field.monitor[0], field.monitor[1])
+        for source, level in field.input.items():
+            self._add(f'{source}.0', level[0], level[1])
+        self._check()
+
+    def _on_fairlight(self, field):
+        self._add(field.strip_id, field.level[0], field.level[1])
+        self._check()
+
+    def _on_master(self, field):
+        self._add('master', field.level[0], field.level[1])
+        self._check()
+
+    def _add(self, strip_id, left, right):
+        with self.lock:
+            if strip_id not in self.levels:
+                self.levels[strip_id] = [left, right]
+                return
+            current = self.levels[strip_id]
+            if left > current[0]:
+                current[0] = left
+            if right > current[1]:
+                current[1] = right
+
+    def _peak(self, peak, channel, level, now):
+        held = now - peak[channel + 2]
+        value = peak[channel]
+        if held > self.hold:
+            value = max(value - (held - self.hold) * self.decay, self.FLOOR)
+        if level >= value:
+            peak[channel] = level
+            peak[channel + 2] = now
+            return level
+        return value
+
+    def _check(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last < 1 / self.rate:
+                return
+            self.last = now
+        self.flush(now)
+
+    def tick(self):
+        """
+        Send the aggregated levels to the callback if the interval has passed. This is meant to be called from a
+        timer so levels and peak-hold values are also updated when no new meter data arrives.
+        """
+        self._check()
+
+    def flush(self, now=None):
+        """
+        Send the aggregated levels to the callback right away. Strips without new levels in this interval are
+        included while their peak-hold value is still decaying.
+
+        :param now: Timestamp from time.monotonic()
+        """
+        if now is None:
+            now = time.monotonic()
+        result = {}
+        with self.lock:
+            levels = self.levels
+            self.levels = {}
+            for strip_id, (left, right) in levels.items():
+                if strip_id not in self.peaks:
+                    self.peaks[strip_id] = [left, right, now, now]
+                peak = self.peaks[strip_id]
+                result[strip_id] = (left, right, self._peak(peak, 0, left, now), self._peak(peak, 1, right, now))
+            for strip_id, peak in self.peaks.items():
+                if strip_id in levels:
+                    continue
+                left, right = self.current[strip_id][:2]
+                update = (left, right, self._peak(peak, 0, left, now), self._peak(peak, 1, right, now))
+                if update != self.current[strip_id]:
+                    result[strip_id] = update
+            self.current.update(result)
+        if len(result) > 0:
+            self.callback(result)
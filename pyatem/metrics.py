@@ -0,0 +1,153 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import bisect
+import time
+
+
+class Histogram:
+    """
+    Histogram with fixed bucket boundaries, adding a value only increments a counter so this can always be enabled.
+
+    :ivar bounds: Upper bound of every bucket, values above the last bound go in an extra bucket
+    :ivar buckets: Number of values in every bucket
+    :ivar count: Total number of values
+    :ivar total: Sum of all values
+    :ivar max: Highest value
+    """
+
+    # Boundaries in seconds for timing values
+    DEFAULT_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        Get an estimate of a percentile, this is the upper bound of the bucket the percentile falls in
+
+        :param fraction: The percentile as fraction, 0.5 for the median
+        :return: The upper bound or None if there are no values
+        """
+        if self.count == 0:
+            return None
+        position = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= position and count > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'average': self.total / self.count if self.count > 0 else None,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.bounds] + ['inf'], self.buckets)),
+        }
+
+    def __repr__(self):
+        return f'<Histogram count={self.count} max={self.max}>'
+
+
+class Timings:
+    """
+    Number of calls, total time and maximum time for a set of named operations. When only one in `sample` calls is
+    timed the count and total are scaled up to estimate the real values.
+
+    :ivar stats: Dict of name to [count, total seconds, max seconds] of the timed calls
+    :ivar sample: One in this many calls is timed
+    """
+
+    def __init__(self, sample=1):
+        self.stats = {}
+        self.sample = sample
+
+    def add(self, name, duration):
+        entry = self.stats.get(name)
+        if entry is None:
+            self.stats[name] = [1, duration, duration]
+            return
+        entry[0] += 1
+        entry[1] += duration
+        if duration > entry[2]:
+            entry[2] = duration
+
+    def to_dict(self):
+        result = {}
+        for name, (count, total, maximum) in list(self.stats.items()):
+            if isinstance(name, bytes):
+                name = name.decode(errors='replace')
+            result[name] = {
+                'count': count * self.sample,
+                'total': total * self.sample,
+                'average': total / count,
+                'max': maximum,
+            }
+        return result
+
+
+class TransportMetrics:
+    """
+    Traffic counters for a transport. The counters only go up, the rates are calculated when reading the metrics.
+
+    :ivar packets_in: Number of packets received
+    :ivar bytes_in: Number of bytes received
+    :ivar packets_out: Number of packets sent
+    :ivar bytes_out: Number of bytes sent
+    :ivar retransmissions_sent: Number of packets sent again because the hardware requested it
+    :ivar retransmissions_received: Number of packets the hardware sent again
+    :ivar retransmission_requests: Number of retransmission requests received from the hardware
+    :ivar ack_rtt: Histogram of the time between sending a packet and receiving the ACK for it
+    """
+
+    RATES = ('packets_in', 'bytes_in', 'packets_out', 'bytes_out')
+
+    def __init__(self):
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.retransmissions_sent = 0
+        self.retransmissions_received = 0
+        self.retransmission_requests = 0
+        self.ack_rtt = Histogram()
+        self._previous = (time.monotonic(), 0, 0, 0, 0)
+
+    def snapshot(self, queues=None):
+        """
+        Get all metrics, the rates are per second since the previous snapshot
+
+        :param queues: Dict of queue name to the number of items in that queue
+        :return: Dict with the metrics
+        """
+        now = time.monotonic()
+        current = tuple(getattr(self, name) for name in self.RATES)
+        previous = self._previous
+        elapsed = now - previous[0]
+        self._previous = (now,) + current
+
+        result = {
+            'retransmissions_sent': self.retransmissions_sent,
+            'retransmissions_received': self.retransmissions_received,
+            'retransmission_requests': self.retransmission_requests,
+            'ack_rtt': self.ack_rtt.to_dict(),
+            'queues': queues or {},
+        }
+        for i, name in enumerate(self.RATES):
+            result[name] = current[i]
+            result[name + '_per_second'] = (current[i] - previous[i + 1]) / elapsed if elapsed > 0 else 0.0
+        return result
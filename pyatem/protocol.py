@@ -1,16 +1,47 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
+import collections
+import concurrent.futures
 import logging
 import struct
+import threading
+import time
 
-from pyatem.transfer import TransferTask, TransferQueueFlushed
-from pyatem.transport import UdpProtocol, Packet, UsbProtocol, TcpProtocol, ConnectionReady
+from pyatem.transfer import TransferTask, TransferQueueFlushed, DownloadBuffer, TransferScheduler, FrameReader, \
+    UploadStream
+from pyatem.transport import UdpProtocol, Packet, UsbProtocol, TcpProtocol, ConnectionReady, ConnectionLost, \
+    AsyncUdpProtocol, LoopCallback
 from pyatem.command import LockCommand, TransferDownloadRequestCommand, TransferAckCommand, \
     TransferUploadRequestCommand, TransferDataCommand, TransferFileDataCommand, PartialLockCommand, TimeRequestCommand
-from pyatem.media import rle_decode
+from pyatem.media import rle_decode, rgb_to_atem
+from pyatem.meters import MeterMatrix
+from pyatem.metrics import Histogram, Timings
+from pyatem.state import StateStore
 import pyatem.field as fieldmodule
 
 
+def make_field_dispatch(pretty, unique, handlers):
+    """
+    Build the lookup table used to decode incoming fields. This resolves the pretty name, the decoder class from
+    pyatem.field and the struct to find the indexes of a field once instead of for every received field.
+
+    The last item is True if the field can be decoded lazily, this is not possible for fields that are handled by
+    a method or for field classes that set LAZY to False because the index in the state is read back from the
+    decoded strip_id.
+    """
+    result = {}
+    names = set(pretty.values())
+    for code in set(pretty.keys()) | {code for code in handlers if code not in names}:
+        key = pretty.get(code, code)
+        classname = key.title().replace('-', '') + "Field"
+        decoder = getattr(fieldmodule, classname, None)
+        handler = handlers.get(key)
+        lazy = decoder is not None and handler is None and decoder.LAZY
+        result[code.encode()] = (key, decoder, unique.get(key), handler, lazy)
+    return result
+
+
 class AtemProtocol:
     STRUCT_FIELD = struct.Struct('!H2x 4s')
 
@@ -175,40 +206,137 @@ class AtemProtocol:
         'supersource-box-properties': struct.Struct('>B'),
     }
 
+    # Subscribe to every index of a field
+    ANY_INDEX = '*'
+
+    # Maximum size of the commands in a single packet
+    MAX_COMMAND_DATA = 1300
+
+    # Only one in this many field decodes and event callbacks is timed for the metrics
+    TIMING_SAMPLE = 16
+
+    # Audio meter fields that are decoded by the MeterMatrix when bulk_meters is enabled
+    METER_FIELDS = {b'AMLv', b'FMLv', b'FDLv'}
+
+    # Fields the switcher also sends on its own while connected, these are never removed after a fast reconnect
+    STREAMING_FIELDS = METER_FIELDS | {b'Time', b'RTMR', b'SRST', b'SRSS'}
+
+    # Fields that are not stored in the state but handled by a method, the method gets the decoded field
+    FIELD_HANDLERS = {
+        'CapA': '_ignore_field',
+        'lock-obtained': '_on_lock_obtained',
+        'lock-state': '_on_lock_state',
+        'file-transfer-continue-data': '_on_transfer_continue',
+        'file-transfer-data': '_on_transfer_data',
+        'file-transfer-error': '_on_transfer_error',
+        'file-transfer-data-complete': '_on_transfer_data_complete',
+        'transfer-complete': '_on_transfer_complete',
+    }
+
+    # Raw 4 byte field code to (key, decoder class, uniqueness struct, handler method name, can be lazy)
+    FIELD_DISPATCH = make_field_dispatch(FIELDNAME_PRETTY, FIELDNAME_UNIQUE, FIELD_HANDLERS)
+
     def __init__(self, ip=None, port=9910, usb=None):
         if ip is None and usb is None:
             raise ValueError("Need either an ip or usb port")
-        if ip is not None:
-            if ip.startswith('tcp://'):
-                self.transport = TcpProtocol(url=ip)
-            else:
-                self.transport = UdpProtocol(ip, port)
-        else:
-            self.transport = UsbProtocol(usb)
+        self.transport = self._create_transport(ip, port, usb)
 
         self.log = logging.getLogger('AtemProtocol')
         self.transport.queue_callback = self.queue_callback
-        self.mixerstate = {}
+        self.field_dispatch = {}
+        for code, (key, decoder, unique, handler, lazy) in self.FIELD_DISPATCH.items():
+            if handler is not None:
+                handler = getattr(self, handler)
+            self.field_dispatch[code] = (key, decoder, unique, handler, lazy)
+        self.mixerstate = StateStore()
         self.callbacks = {}
         self.inputs = {}
         self.callback_idx = 1
         self.connected = False
 
+        # Decode all audio meter fields of a packet at once into a MeterMatrix instead of into the state
+        self.bulk_meters = False
+        self.meters = MeterMatrix()
+
+        # Store fields as LazyField and only decode them when used or when there's a handler for the specific field
+        self.lazy_decode = False
+
+        # Field key to {index: {subscription id: (callback, match, predicate)}}, the index is ANY_INDEX for handlers
+        # that get all indexes and None for fields that don't have an index
+        self.subscriptions = {}
+        self.subscription_ids = {}
+        # Subscriptions are changed from other threads, like the timers of send_command_confirmed(), while the
+        # thread that calls loop() reads them
+        self.subscription_lock = threading.RLock()
+
+        # Held while a packet is handled, timers run with this lock so they act as if they run in the loop
+        self.loop_lock = threading.RLock()
+
+        # Seconds to hold commands that have a coalesce_key() so newer values for the same target can replace them
+        self.command_window = 0
+        self.commands_coalesced = 0
+        self.pending_commands = collections.OrderedDict()
+        self.command_lock = threading.Lock()
+        self.command_timer = None
+
+        # Field keys with the number of commands waiting for that field to confirm them, these are never suppressed
+        self.awaiting = {}
+
+        # Round-trip time in seconds of the last confirmed commands
+        self.command_rtt = collections.deque(maxlen=100)
+
+        # Runtime metrics, see get_metrics()
+        self.callback_timings = Timings(sample=self.TIMING_SAMPLE)
+        self.callback_counter = 0
+        self.decode_timings = Timings(sample=self.TIMING_SAMPLE)
+        self.decode_counter = 0
+        self.command_rtt_histogram = Histogram()
+
+        # Skip decoding and events for fields that are sent again with the same contents
+        self.suppress_unchanged = False
+        self.suppressed = collections.Counter()
+
+        # Keep the state when the connection drops and only send events for fields that changed after reconnecting
+        self.fast_reconnect = False
+        self.resyncing = False
+
+        # Field data by (field code, index...) path for comparing new field data against
+        self.raw_state = {}
+        self.resync_seen = set()
+        self.resync_changed = 0
+
+        # Field codes that were sent in the initial sync dump of the current and the previous connection
+        self.synced = False
+        self.sync_fields = set()
+        self.dump_fields = set()
+
         self.locks = {}
         self.mode = None
         self.transfer_queue = {}
         self.transfer_id = 42
-        self.transfer_buffer = b''
-        self.transfer_buffer2 = []
-        self.transfer = None
-        self.transfer_requested = False
-        self.transfer_packets = 0
-        self.transfer_budget = []
+        self.transfers = {}
+        self.transfer_scheduler = TransferScheduler()
+        self.transfer_window = 32
+        self.queued_chunks = collections.deque()
+        self.media_cache = None
+
+        # Store and slot to the (hash, description) of the stills uploaded by this connection, the hardware doesn't
+        # report the description
+        self.slot_descriptions = {}
 
     @classmethod
     def usb_exists(cls):
         return UsbProtocol.device_exists()
 
+    def _create_transport(self, ip, port, usb):
+        if ip is not None:
+            if ip.startswith('tcp://'):
+                return TcpProtocol(url=ip)
+            else:
+                return UdpProtocol(ip, port)
+        else:
+            return UsbProtocol(usb)
+
     def connect(self):
         self.log.debug('Starting connection')
         self.transport.connect()
@@ -216,13 +344,22 @@ class AtemProtocol:
     def loop(self):
         self.log.debug('Waiting for data packet...')
         packet = self.transport.receive_packet()
-        if packet is None:
+        self._process_packet(packet)
+
+    def _process_packet(self, packet):
+        with self.loop_lock:
+            self._handle_packet(packet)
+
+    def _handle_packet(self, packet):
+        if packet is None or isinstance(packet, ConnectionLost):
             # Disconnected from hardware
             if self.connected:
-                self._raise('disconnected')
-                self.mixerstate = {}
+                self._disconnected()
             self.connected = False
             return
+        if isinstance(packet, LoopCallback):
+            packet.callback()
+            return
         if isinstance(packet, ConnectionReady):
             self.connected = True
             self.send_commands([TimeRequestCommand()])
@@ -233,15 +370,75 @@ class AtemProtocol:
             self._queue_flushed()
             return
         try:
+            meters = []
             for fieldname, data in self.decode_packet(packet.data):
+                if self.bulk_meters and fieldname in self.METER_FIELDS:
+                    meters.append((fieldname, data))
+                    continue
                 self.save_field_data(fieldname, data)
+            if len(meters) > 0:
+                self.meters.update(meters)
+                self._raise('meters-updated', self.meters)
         except ConnectionError:
             print("Encountered protocol corruption, closing connection")
-            self._raise('disconnected')
-            self.mixerstate = {}
+            self._disconnected()
             self.connected = False
 
+    def _disconnected(self):
+        self._raise('disconnected')
+        self.synced = False
+        self._drop_queued_chunks()
+        if self.fast_reconnect:
+            # Keep the old state around, the initial sync after reconnecting will be diffed against it
+            self.resyncing = True
+            self.resync_seen = set()
+            self.resync_changed = 0
+        else:
+            self.mixerstate.clear()
+            self.raw_state = {}
+
+    def _finish_resync(self):
+        """
+        Called when the initial sync after a reconnect is complete. Fields that were in the state before the
+        connection dropped but have not been sent again no longer exist on the hardware. This only applies to the
+        fields that are part of the initial sync dump, a `removed` event is sent for every removed field.
+        """
+        dumped = (self.dump_fields | self.sync_fields) - self.STREAMING_FIELDS
+        removed = 0
+        for path in list(self.raw_state.keys()):
+            if path in self.resync_seen or path[0] not in dumped:
+                continue
+            del self.raw_state[path]
+            key = self.field_dispatch[path[0]][0]
+            self.mixerstate.remove((key,) + path[1:])
+            self._raise('removed', key, path[1:] if len(path) > 1 else None)
+            removed += 1
+
+        self.log.info(f'Resynced state, {self.resync_changed} fields changed and {removed} removed')
+        self.resyncing = False
+        self.resync_seen = set()
+        self._raise('resynced')
+
     def on(self, event, callback):
+        """
+        Register an event handler. Field specific change events in the `change:key`, `change:key:index` and
+        `change:key:*` format are registered as a subscription.
+
+        :param event: Event name
+        :param callback: Function to call
+        :return: id to pass to off() to remove the handler
+        """
+        if event.startswith('change:'):
+            part = event.split(':', maxsplit=2)
+            index = None
+            if len(part) == 3:
+                index = part[2]
+                if index == '*':
+                    index = self.ANY_INDEX
+                elif index.isdigit():
+                    index = int(index)
+            return self.subscribe(part[1], callback, index=index)
+
         if event not in self.callbacks:
             self.callbacks[event] = {}
         self.callbacks[event][self.callback_idx] = callback
@@ -249,19 +446,139 @@ class AtemProtocol:
         return self.callback_idx - 1
 
     def off(self, event, callback_id):
+        if event.startswith('change:'):
+            self.unsubscribe(callback_id)
+            return
         if event not in self.callbacks:
             return
         del self.callbacks[event][callback_id]
 
+    def subscribe(self, key, callback, index=None, match=None, predicate=None):
+        """
+        Subscribe to changes of a specific field. The callback gets the changed field as argument.
+
+        Fields that have multiple instances, like the program bus for every M/E, have an index. Subscribing to
+        a specific index only gets the changes for that instance, ANY_INDEX gets the changes for every instance.
+        Fields without an index are subscribed with the index set to None.
+
+        The match and predicate filters are checked before the callback is called. Fields where one of the
+        attributes in match has a different value are skipped, as are fields where predicate(field) is False.
+
+        .. code-block:: python
+
+           # Only M/E 1
+           switcher.subscribe('program-bus-input', callback, index=0)
+
+           # Only when input 3 is switched to program on any M/E
+           switcher.subscribe('program-bus-input', callback, index=AtemProtocol.ANY_INDEX, match={'source': 3})
+
+        :param key: Field key like `program-bus-input`
+        :param callback: Function to call
+        :param index: First index of the field, ANY_INDEX or None
+        :param match: dict of attribute values the field needs to have
+        :param predicate: Function that gets the field and returns True if the callback should be called
+        :return: id to pass to unsubscribe()
+        """
+        with self.subscription_lock:
+            if key not in self.subscriptions:
+                self.subscriptions[key] = {}
+            if index not in self.subscriptions[key]:
+                self.subscriptions[key][index] = {}
+            subscription_id = self.callback_idx
+            self.callback_idx += 1
+            self.subscriptions[key][index][subscription_id] = (callback, match, predicate)
+            self.subscription_ids[subscription_id] = (key, index)
+        return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        with self.subscription_lock:
+            if subscription_id not in self.subscription_ids:
+                return
+            key, index = self.subscription_ids.pop(subscription_id)
+            del self.subscriptions[key][index][subscription_id]
+
+            # Remove the empty levels so fields without subscribers are skipped with a single lookup
+            if len(self.subscriptions[key][index]) == 0:
+                del self.subscriptions[key][index]
+            if len(self.subscriptions[key]) == 0:
+                del self.subscriptions[key]
+
+    def _notify(self, subscriptions, index, contents):
+        # The subscriptions can be removed from another thread while this runs, only use a copy
+        handlers = subscriptions.get(index)
+        if handlers is None:
+            return
+        for callback, match, predicate in list(handlers.values()):
+            if match is not None:
+                if any(getattr(contents, name) != value for name, value in match.items()):
+                    continue
+            if predicate is not None and not predicate(contents):
+                continue
+            callback(contents)
+
+    def changes_since(self, seq):
+        """
+        Get the fields that changed since an earlier sequence number from the state journal, for applications that
+        poll the state. See StateStore.changes_since()
+
+        .. code-block:: python
+
+           seq, snapshot, changes = switcher.changes_since(0)
+           # Some time later
+           seq, snapshot, changes = switcher.changes_since(seq)
+
+        :param seq: Sequence number returned by the previous call, or 0 to get all fields
+        :return: Tuple of (seq, snapshot, changes)
+        """
+        return self.mixerstate.changes_since(seq)
+
     def get_link_quality(self):
         return self.transport.get_link_quality()
 
+    def get_metrics(self):
+        """
+        Get the runtime metrics of the connection. These are always collected and only cost a few counter updates
+        per packet, field and event.
+
+        The result is a dict with:
+
+        * `transport`: packets and bytes sent and received with the rates since the previous call, retransmissions,
+          a histogram of the ACK round-trip time and the number of packets waiting in the queues.
+        * `callbacks`: the number of times and the time spent running the event handlers for every event name
+        * `decode`: the number of fields and the time spent decoding them for every field code
+
+        The callback and decode timings are estimated from timing one in TIMING_SAMPLE calls.
+        * `command_rtt`: histogram of the round-trip time of commands sent with send_command_confirmed()
+        * `suppressed`: the number of unchanged fields that were suppressed for every field name
+
+        :return: Dict with the metrics
+        """
+        return {
+            'transport': self.transport.get_metrics(),
+            'callbacks': self.callback_timings.to_dict(),
+            'decode': self.decode_timings.to_dict(),
+            'command_rtt': self.command_rtt_histogram.to_dict(),
+            'suppressed': dict(self.suppressed),
+        }
+
     def _raise(self, event, *args, **kwargs):
         if event in self.callbacks:
+            self.callback_counter += 1
+            if self.callback_counter % self.TIMING_SAMPLE:
+                for cbidx in self.callbacks[event]:
+                    self.callbacks[event][cbidx](*args, **kwargs)
+                return
+            start = time.perf_counter()
             for cbidx in self.callbacks[event]:
                 self.callbacks[event][cbidx](*args, **kwargs)
+            self.callback_timings.add(event, time.perf_counter() - start)
 
     def decode_packet(self, data):
+        """
+        Split packet data into fields. The field contents are memoryviews into the packet data, they are only
+        copied when a decoder needs the bytes.
+        """
+        data = memoryview(data)
         offset = 0
         while offset < len(data):
             datalen, cmd = self.STRUCT_FIELD.unpack_from(data, offset)
@@ -276,162 +593,363 @@ class AtemProtocol:
             offset += datalen
 
     def save_field_data(self, fieldname, contents):
+        try:
+            key, decoder, unique, handler, lazy = self.field_dispatch[fieldname]
+        except KeyError:
+            # Field that isn't in the protocol tables, store it under its raw name
+            entry = (fieldname.decode(), None, None, None, False)
+            key, decoder, unique, handler, lazy = self.field_dispatch[fieldname] = entry
+
+        # The field data is a view into the receive buffer, it is only copied when it's decoded or stored. The copy
+        # is shared between the decoded field and the raw state.
         raw = contents
-        key = fieldname.decode()
-        if key in self.FIELDNAME_PRETTY:
-            key = self.FIELDNAME_PRETTY[key]
-            classname = key.title().replace('-', '') + "Field"
-            if hasattr(fieldmodule, classname):
-                contents = getattr(fieldmodule, classname)(contents)
-
-        if key == 'CapA':
-            return
+        data = None
 
-        if key == 'lock-obtained':
-            self.log.info('Got lock for {}'.format(contents.store))
-            self.locks[contents.store] = True
-            self._transfer_trigger(contents.store)
-            return
-        elif key == 'lock-state':
-            if contents.state:
-                # Ignore lock aquired messages from other clients
-                return
-            if contents.store in self.locks and self.locks[contents.store]:
-                # Remove the lock if we held it
-                del self.locks[contents.store]
-            self.log.debug(contents)
-            return
-        elif key == 'file-transfer-continue-data':
-            self.transfer_budget = contents
-            old = self.transfer_budget.size
-            self.transfer_budget.size = self.transfer_budget.size // 8 * 8
-            if old != self.transfer_budget.size:
-                self.log.debug(f"Adjusted transfer chunk size from {old} to {self.transfer_budget.size}")
-            self._queue_chunks()
-            return
-        elif key == 'file-transfer-data':
-            if contents.transfer == self.transfer.tid:
-                self.transfer_packets += 1
-                self.transfer_buffer += contents.data
-                if self.transfer_packets % 20 == 0:
-                    total_size = self.mixerstate['video-mode'].get_pixels() * 4
-                    transfer_progress = len(self.transfer_buffer) / total_size
-                    self._raise('transfer-progress', self.transfer.store, self.transfer.slot, transfer_progress)
-                # The 0 should be the transfer slot, but it seems it's always 0 in practice
-                self.send_commands([TransferAckCommand(self.transfer.tid, 0)])
-            else:
-                self.log.error('Got file transfer data for wrong transfer id')
+        if handler is not None:
+            data = bytes(raw)
+            handler(decoder(data) if decoder is not None else data)
             return
-        elif key == 'file-transfer-error':
-            self.log.error(f"file-transfer-error: {str(contents)}")
-            self.transfer_requested = False
-            if contents.status == 1:
-                # Status is try-again
-                self.log.debug('Retrying transfer')
-                self._transfer_trigger(self.transfer.store, retry=True)
-            elif contents.status == 5:
-                self.locks[self.transfer.store] = False
-                self._transfer_trigger(self.transfer.store, retry=True)
-            return
-        elif key == 'file-transfer-data-complete':
-            self.log.debug('Transfer complete')
-            if self.transfer is None:
-                self.log.warning("Got FTDC without transfer active")
-                return
-            if contents.transfer != self.transfer.tid:
-                return
-            # Remove current item from the transfer queue
-            queue = self.transfer_queue[self.transfer.store]
-            self.transfer_queue[self.transfer.store] = queue[1:]
 
-            if self.transfer.upload:
-                self._raise('upload-done', self.transfer.store, self.transfer.slot)
-                self.transfer_requested = False
-            else:
-                # Assemble the buffer
-                data = self.transfer_buffer
-                self.transfer_buffer = b''
-                self.transfer_requested = False
+        idxes = None
+        if unique is not None:
+            idxes = unique.unpack_from(raw, 0)
 
-                # Decompress the buffer if needed
-                if self.transfer.store == 0:
-                    data = rle_decode(data)
+        if decoder is not None and not lazy:
+            data = bytes(raw)
+            contents = self._decode(fieldname, decoder, data)
 
-                self._raise('download-done', self.transfer.store, self.transfer.slot, data)
+            # Fairlight strips have weird numbering that's harder to parse here, read it back from the class. These
+            # are the field classes that can't be decoded lazily.
+            if idxes is not None and not decoder.LAZY:
+                idxes = (contents.strip_id,) + idxes[1:]
 
-            # Start next transfer in the queue
-            self._transfer_trigger(self.transfer.store)
-            return
-        elif key == 'transfer-complete':
-            self.log.debug('Proxy transfer complete')
+        if (self.suppress_unchanged or self.fast_reconnect) and key != 'InCm':
+            path = (fieldname,) + idxes if idxes is not None else (fieldname,)
+            if not self.synced:
+                self.sync_fields.add(fieldname)
+            if self.resyncing:
+                self.resync_seen.add(path)
+            if self.raw_state.get(path) == raw and key not in self.awaiting:
+                if self.suppress_unchanged or self.resyncing:
+                    self.suppressed[key] += 1
+                    return
+            elif self.resyncing:
+                self.resync_changed += 1
+            if data is None:
+                data = bytes(raw)
+            self.raw_state[path] = data
 
-            # Remove current item from the transfer queue
-            queue = self.transfer_queue[contents.store]
-            self.transfer_queue[contents.store] = queue[1:]
+        if data is None:
+            data = bytes(raw)
 
-            if contents.upload:
-                self._raise('upload-done', contents.store, contents.slot)
+        if decoder is None:
+            contents = data
+        elif lazy:
+            if self.lazy_decode and key not in self.subscriptions:
+                contents = fieldmodule.LazyField(decoder, data)
             else:
-                # TODO: Implement proxy download
-                pass
-            # Start next transfer in the queue
-            self._transfer_trigger(self.transfer.store)
-            return
+                contents = self._decode(fieldname, decoder, data)
 
-        if key in self.FIELDNAME_UNIQUE:
-            idxes = self.FIELDNAME_UNIQUE[key].unpack_from(raw, 0)
-            if key not in self.mixerstate:
-                self.mixerstate[key] = {}
-
-            # Fairlight strips have weird numbering that's harder to parse here, read it back from the class
-            if hasattr(contents, 'strip_id'):
-                idxes = list(idxes)
-                idxes[0] = contents.strip_id
-                idxes = tuple(idxes)
-
-            unique = self.make_unique_dict(contents, idxes)
-            self.mixerstate[key] = self.recursive_merge(self.mixerstate[key], unique)
-            self._raise('change:' + key + ':' + str(idxes[0]), contents)
-            self._raise('change:' + key + ':*', contents)
+        self.mixerstate.set(key, idxes, contents)
+        if idxes is not None:
+            subscriptions = self.subscriptions.get(key)
+            if subscriptions is not None:
+                self._notify(subscriptions, idxes[0], contents)
+                self._notify(subscriptions, self.ANY_INDEX, contents)
         else:
-            self.mixerstate[key] = contents
-            self._raise('change:' + key, contents)
+            subscriptions = self.subscriptions.get(key)
+            if subscriptions is not None:
+                self._notify(subscriptions, None, contents)
         if key == 'input-properties':
             self.inputs[contents.short_name] = contents.index
 
         if key == 'InCm':
+            if self.resyncing:
+                self._finish_resync()
+            if not self.synced:
+                self.dump_fields = self.sync_fields
+                self.sync_fields = set()
+                self.synced = True
             self.transport.mark_next_connected = True
             if isinstance(self.transport, TcpProtocol):
                 self._raise('connected')
         self._raise('change', key, contents)
 
-    def make_unique_dict(self, content, path):
-        result = {}
-        if len(path) == 1:
-            result[path[0]] = content
+    def _decode(self, fieldname, decoder, data):
+        self.decode_counter += 1
+        if self.decode_counter % self.TIMING_SAMPLE:
+            return decoder(data)
+        start = time.perf_counter()
+        contents = decoder(data)
+        self.decode_timings.add(fieldname, time.perf_counter() - start)
+        return contents
+
+    def _ignore_field(self, contents):
+        pass
+
+    def _on_lock_obtained(self, contents):
+        self.log.info('Got lock for {}'.format(contents.store))
+        self.locks[contents.store] = True
+        self._transfer_trigger(contents.store)
+
+    def _on_lock_state(self, contents):
+        if contents.state:
+            # Ignore lock aquired messages from other clients
+            return
+        if contents.store in self.locks and self.locks[contents.store]:
+            # Remove the lock if we held it
+            del self.locks[contents.store]
+        self.log.debug(contents)
+
+    def _find_transfer(self, tid):
+        for task in self.transfers.values():
+            if task.tid == tid:
+                return task
+        return None
+
+    def _on_transfer_continue(self, contents):
+        task = self._find_transfer(contents.transfer)
+        if task is None or not task.upload:
+            self.log.error('Got file transfer budget for unknown upload {}'.format(contents.transfer))
+            return
+        old = contents.size
+        contents.size = contents.size // 8 * 8
+        if old != contents.size:
+            self.log.debug(f"Adjusted transfer chunk size from {old} to {contents.size}")
+        self.transfer_scheduler.add_budget(task, contents)
+        self._queue_chunks()
+
+    def _on_transfer_data(self, contents):
+        task = self._find_transfer(contents.transfer)
+        if task is None or task.upload:
+            self.log.error('Got file transfer data for wrong transfer id')
+            return
+        task.packets += 1
+        task.buffer.feed(contents.data)
+        if task.packets % 20 == 0:
+            transfer_progress = task.buffer.progress()
+            if transfer_progress is not None:
+                self._raise('transfer-progress', task.store, task.slot, transfer_progress)
+        # The 0 should be the transfer slot, but it seems it's always 0 in practice
+        self.send_commands([TransferAckCommand(task.tid, 0)])
+
+    def _on_transfer_error(self, contents):
+        self.log.error(f"file-transfer-error: {str(contents)}")
+        task = self._find_transfer(contents.transfer)
+        if task is None:
+            return
+        task.requested = False
+        self.transfer_scheduler.remove(task)
+        # A retry starts with the same transfer id, chunks of the failed attempt must not be sent with it
+        self._drop_queued_chunks(task)
+        if contents.status == 1:
+            # Status is try-again
+            self.log.debug('Retrying transfer')
+            self._transfer_trigger(task.store, retry=True)
+        elif contents.status == 5:
+            self.locks[task.store] = False
+            self._transfer_trigger(task.store, retry=True)
+
+    def _on_transfer_data_complete(self, contents):
+        self.log.debug('Transfer complete')
+        task = self._find_transfer(contents.transfer)
+        if task is None:
+            self.log.warning("Got FTDC without transfer active")
+            return
+
+        # Remove current item from the transfer queue
+        del self.transfers[task.store]
+        queue = self.transfer_queue[task.store]
+        self.transfer_queue[task.store] = queue[1:]
+        self.transfer_scheduler.remove(task)
+
+        if task.upload:
+            if task.store == 0 and task.hash is not None:
+                self.slot_descriptions[(task.store, task.slot)] = (task.hash, task.description)
+            self._raise('upload-done', task.store, task.slot)
         else:
-            result[path[0]] = self.make_unique_dict(content, path[1:])
-        return result
-
-    def recursive_merge(self, d1, d2):
-        '''update first dict with second recursively'''
-        if not isinstance(d2, dict):
-            return d2
-        for k, v in d1.items():
-            if k in d2:
-                d2[k] = self.recursive_merge(v, d2[k])
-        d1.update(d2)
-        return d1
+            data = task.buffer.finish()
+            task.buffer = None
+            if data is not None and task.store == 0 and self.media_cache is not None:
+                self.media_cache.put_background(frame=data)
+            self._raise('download-done', task.store, task.slot, data)
+
+        # Start next transfer in the queue
+        self._transfer_trigger(task.store)
+
+    def _on_transfer_complete(self, contents):
+        self.log.debug('Proxy transfer complete')
+
+        # Remove current item from the transfer queue
+        queue = self.transfer_queue[contents.store]
+        self.transfer_queue[contents.store] = queue[1:]
+
+        if contents.upload:
+            self._raise('upload-done', contents.store, contents.slot)
+        else:
+            # TODO: Implement proxy download
+            pass
+        # Start next transfer in the queue
+        self._transfer_trigger(contents.store)
 
     def send_commands(self, commands):
-        data = b''
-        for command in commands:
-            data += command.get_command()
+        """
+        Send commands to the switcher. The commands are packed in as few packets as possible.
+
+        Commands that set a value on a target, like the T-bar position or a fader level, are combined when newer
+        commands for the same target are sent before they go out. Only the latest value is sent. By default this only
+        happens within a single call, set `command_window` to hold these commands for that many seconds. Commands
+        that can't be combined are always sent right away together with all held commands, in the same order as
+        they were passed to send_commands.
+
+        :param commands: List of command objects
+        """
+        with self.command_lock:
+            ready = []
+            for command in commands:
+                key = command.coalesce_key()
+                if key is None:
+                    ready.extend(self.pending_commands.values())
+                    self.pending_commands.clear()
+                    ready.append(command)
+                    continue
+
+                if key in self.pending_commands:
+                    # Replace the older command, the new one goes to the end to keep the order of the commands
+                    del self.pending_commands[key]
+                    self.commands_coalesced += 1
+                self.pending_commands[key] = command
+
+            if len(ready) > 0 or self.command_window == 0:
+                ready.extend(self.pending_commands.values())
+                self.pending_commands.clear()
+                if self.command_timer is not None:
+                    self.command_timer.cancel()
+                    self.command_timer = None
+            elif self.command_timer is None:
+                self.command_timer = self._call_later(self.command_window, self.flush_commands)
+            self._send_command_packets(ready)
+
+    def flush_commands(self):
+        """
+        Send the commands that are held for the command_window right away
+        """
+        with self.command_lock:
+            commands = list(self.pending_commands.values())
+            self.pending_commands.clear()
+            self.command_timer = None
+            self._send_command_packets(commands)
+
+    def send_command_confirmed(self, command, field=None, index=None, match=None, timeout=2.0):
+        """
+        Send a command and get a future that resolves when the switcher has sent back the field that confirms the
+        command has taken effect. The result of the future is the round-trip time in seconds, this is also added
+        to `command_rtt` and sent with the `command-confirmed` event. The future gets a TimeoutError when the
+        field doesn't arrive in time.
+
+        The expected field is taken from command.expect() or can be passed as arguments. The future resolves from
+        the thread that calls loop(), so don't block on it from that thread. The timeout never runs while a packet
+        is being handled, a confirming field in that packet always wins. With AsyncAtemProtocol this returns an
+        asyncio future that can be awaited.
+
+        .. code-block:: python
+
+           future = switcher.send_command_confirmed(ProgramInputCommand(index=0, source=1))
+           future.add_done_callback(lambda f: print(f"Took {f.result() * 1000:.1f}ms"))
+
+        :param command: Command object
+        :param field: Key of the field that confirms the command
+        :param index: First index value of the field, or None to accept any index
+        :param match: Dict of attribute values the field should have
+        :param timeout: Seconds to wait for the field
+        :return: Future
+        """
+        if field is None:
+            expectation = command.expect()
+            if expectation is None:
+                raise ValueError(f"No expected field known for {command.__class__.__name__}, pass the field")
+            field, index, match = expectation
+        if index is None and field in self.FIELDNAME_UNIQUE:
+            index = self.ANY_INDEX
+
+        future = self._create_future()
+        start = time.perf_counter()
+        lock = threading.Lock()
+        state = {'finished': False}
+
+        def finish():
+            # The field and the timeout can arrive at the same time from different threads
+            with lock:
+                if state['finished']:
+                    return False
+                state['finished'] = True
+            self.unsubscribe(state['subscription'])
+            if 'timer' in state:
+                state['timer'].cancel()
+            with self.subscription_lock:
+                self.awaiting[field] -= 1
+                if self.awaiting[field] == 0:
+                    del self.awaiting[field]
+            return not future.cancelled()
+
+        def on_field(contents):
+            rtt = time.perf_counter() - start
+            if not finish():
+                return
+            self.command_rtt.append(rtt)
+            self.command_rtt_histogram.add(rtt)
+            future.set_result(rtt)
+            self._raise('command-confirmed', command, rtt)
+
+        def on_timeout():
+            if finish():
+                future.set_exception(TimeoutError(f"No {field} received for {command.__class__.__name__}"))
+
+        with self.subscription_lock:
+            self.awaiting[field] = self.awaiting.get(field, 0) + 1
+        state['subscription'] = self.subscribe(field, on_field, index=index, match=match)
+        state['timer'] = self._call_later(timeout, on_timeout)
+        self.send_commands([command])
+        self.flush_commands()
+        return future
+
+    def _create_future(self):
+        return concurrent.futures.Future()
+
+    def _call_soon(self, callback):
+        # Run the callback from the thread that calls loop(), transports that can't pass it through their receive
+        # path get a timer that waits for the packet that is being handled instead
+        if not self.transport.post(LoopCallback(callback)):
+            self._call_later(0, callback)
+
+    def _call_later(self, delay, callback):
+        # The timer thread waits for the packet that is being handled, like a timer in the loop would
+        def run():
+            with self.loop_lock:
+                callback()
+
+        timer = threading.Timer(delay, run)
+        timer.daemon = True
+        timer.start()
+        return timer
 
-        if len(data) > 1300:
-            raise ValueError("Command list too long for UDP packet")
+    def _send_command_packets(self, commands):
+        commands = [command.get_command() for command in commands]
+        for data in commands:
+            if len(data) > self.MAX_COMMAND_DATA:
+                raise ValueError("Command too long for UDP packet")
 
-        self.send_raw(data)
+        packet = []
+        size = 0
+        for data in commands:
+            if size + len(data) > self.MAX_COMMAND_DATA:
+                self.send_raw(b''.join(packet))
+                packet = []
+                size = 0
+            packet.append(data)
+            size += len(data)
+        if len(packet) > 0:
+            self.send_raw(b''.join(packet))
 
     def send_raw(self, data):
         packet = Packet()
@@ -440,21 +958,91 @@ class AtemProtocol:
         self.transport.send_packet(packet)
 
     def queue_callback(self, remaining, size):
-        if not self.transfer:
+        # The transport sends the queued FTDa packets in order, the task and chunk size for every packet are kept in
+        # the same order by _fill_queue
+        if len(self.queued_chunks) == 0:
             return
+        task, size = self.queued_chunks.popleft()
+        if self.transfers.get(task.store) is not task:
+            return
+
+        task.send_done += size
+        window = self.transport.window
+        if window is not None:
+            task.window = window.size
+            task.throughput = window.throughput
+        fraction = task.progress()
+        self._raise('upload-progress', task.store, task.slot, fraction * 100, task.send_done, task.send_length)
+        self._fill_queue()
+
+    def download(self, store, index, output=None):
+        """
+        Queue a download from the media pool or macro pool, the data is passed to the `download-done` event.
 
-        self.transfer.send_done += size
-        fraction = self.transfer.send_done / self.transfer.send_length
-        self._raise('upload-progress', self.transfer.store, self.transfer.slot, fraction * 100, self.transfer.send_done,
-                    self.transfer.send_length)
+        Stills are decompressed while the data arrives. When `output` is set the data is not kept in memory but
+        written to it as it arrives, the data argument of the `download-done` event is then None.
 
-    def download(self, store, index):
+        :param store: Store index, 0 for stills and 0xffff for macros
+        :param index: Slot in the store
+        :param output: File-like object with a write() method or a function that receives every part of the data
+        """
         self.log.info("Queue download of {}:{}".format(store, index))
+        if self._download_cached(store, index, output):
+            return
+        self._queue_download(store, index, output)
+
+    def _queue_download(self, store, index, output):
         if store not in self.transfer_queue:
             self.transfer_queue[store] = []
-        self.transfer_queue[store].append(TransferTask(store, index))
+        task = TransferTask(store, index)
+        task.output = output
+        self.transfer_queue[store].append(task)
         self._transfer_trigger(store)
 
+    def _slot_info(self, store, index):
+        # Only the stills have their hash in the mediaplayer-file-info field
+        if store != 0:
+            return None
+        info = self.mixerstate.get('mediaplayer-file-info', {}).get(index)
+        if info is None or not info.is_used:
+            return None
+        return info
+
+    def _download_cached(self, store, index, output):
+        if self.media_cache is None:
+            return False
+        info = self._slot_info(store, index)
+        if info is None or info.hash not in self.media_cache:
+            return False
+
+        # The frame is read by the cache thread and download-done is raised from the loop, like a download from
+        # the hardware
+        future = self.media_cache.get_background(info.hash)
+        future.add_done_callback(
+            lambda f: self._call_soon(lambda: self._finish_cached_download(store, index, f.result(), output)))
+        return True
+
+    def _finish_cached_download(self, store, index, data, output):
+        if data is None:
+            # Evicted or unreadable, get it from the hardware instead
+            self._queue_download(store, index, output)
+            return
+
+        self.log.info(f'Serving download of {store}:{index} from the media cache')
+        if output is not None:
+            if hasattr(output, 'write'):
+                output.write(data)
+            else:
+                output(data)
+            data = None
+        self._raise('download-done', store, index, data)
+
+    def _download_size(self, store):
+        # Macros have no known size, the media stores contain frames
+        if store == 0xffff or 'video-mode' not in self.mixerstate:
+            return None
+        return self.mixerstate['video-mode'].get_pixels() * 4
+
     def upload(self, store, index, data, compress=True, compressed=False, name=None, description=None, size=None,
                task=None):
         self.log.info("Queue upload of {}:{}".format(store, index))
@@ -467,6 +1055,7 @@ class AtemProtocol:
             task.send_length = len(data)
             task.name = name
             task.description = description
+            uncompressed = data
             if compressed:
                 uncompressed = rle_decode(data)
                 task.data = uncompressed
@@ -474,124 +1063,325 @@ class AtemProtocol:
                 task.data = data
             else:
                 task.calculate_hash()
+            # The stills are cached by the hash the hardware reports for every slot
+            use_cache = self.media_cache is not None and store == 0
+            if self._upload_unchanged(task):
+                if use_cache:
+                    self.media_cache.put_background(uncompressed, digest=task.hash)
+                return
+            if compress and use_cache and self.media_cache.has_compressed(task.hash):
+                # The compressed frame is read by the cache thread, the upload continues from the loop
+                future = self.media_cache.get_compressed_background(task.hash)
+                future.add_done_callback(
+                    lambda f: self._call_soon(lambda: self._upload_cached(task, uncompressed, f.result())))
+                return
             if compress:
                 task.compress()
             elif compressed:
-                task.data_length = len(rle_decode(data))
+                task.data_length = len(uncompressed)
+            if use_cache:
+                self.media_cache.put_background(uncompressed, task.data if compress or compressed else None,
+                                                digest=task.hash)
+        elif self._upload_unchanged(task):
+            return
+
+        self._queue_upload(task)
+
+    def _upload_cached(self, task, uncompressed, cached):
+        if cached is None:
+            # Evicted or unreadable, compress it again
+            task.compress()
+            self.media_cache.put_background(uncompressed, task.data, digest=task.hash)
+        else:
+            task.data = cached
+            task.send_length = len(cached)
+        self._queue_upload(task)
 
+    def _queue_upload(self, task):
         self.log.info(f'New upload task is {len(task.data)} bytes, {task.data_length} uncompressed')
 
         if isinstance(self.transport, TcpProtocol):
             self.transport.upload(task)
         else:
-            self.transfer_queue[store].append(task)
-            self._transfer_trigger(store)
+            self.transfer_queue[task.store].append(task)
+            self._transfer_trigger(task.store)
 
-    def _queue_chunks(self):
-        # Can't transfer without a chunk size
-        if self.transfer_budget is None:
-            self.log.error('Cannot transfer without chunk size')
-            return
+    def _upload_unchanged(self, task):
+        # Uploading the content that is already in the slot does nothing, this is only checked when the media
+        # cache is enabled to keep the behaviour without it the same
+        if self.media_cache is None:
+            return False
+        info = self._slot_info(task.store, task.slot)
+        if info is None or info.hash != task.hash:
+            return False
+        if task.name is not None and info.name != task.name.encode():
+            return False
+        if task.description is not None:
+            # Only skip when this connection uploaded the same content with the same description to the slot
+            if self.slot_descriptions.get((task.store, task.slot)) != (task.hash, task.description):
+                return False
+        self.log.info(f'Slot {task.store}:{task.slot} already has this content, skipping upload')
+        self._raise('upload-done', task.store, task.slot)
+        return True
 
-        # Only queue chunks if an upload is planned
-        if self.transfer is None:
-            self.log.error('No transfer scheduled')
-            return
+    def upload_stream(self, store, index, source, width, height, frames=1, name=None, description=None,
+                      premultiply=False):
+        """
+        Upload frames from a stream of RGBA data. The data is converted, hashed and compressed in small blocks while
+        the upload runs, so only a few blocks are kept in memory and sending starts right away. With multiple frames,
+        like the frames of a clip, every frame is uploaded to the next slot and read from the source when its
+        upload starts.
+
+        The size argument of the `upload-progress` event is None for these uploads since the compressed size is only
+        known at the end.
 
-        if not self.transfer.upload:
-            self.log.error('Current transfer is a download')
+        :param store: Store index, 0 for stills and 1 and up for clips
+        :param index: Slot for the first frame
+        :param source: Iterable of bytes-like objects in any size, like rows or whole frames, or a file-like object
+        :param width: Frame width in pixels
+        :param height: Frame height in pixels
+        :param frames: Number of frames to read from the source
+        :param name: Name for the frames
+        :param description: Description for the frames
+        :param premultiply: Premultiply the color values with the alpha channel
+        """
+        reader = FrameReader(source)
+        if isinstance(self.transport, TcpProtocol):
+            # The proxy protocol sends the hash before the data, so the whole frame is needed
+            for i in range(frames):
+                frame = reader.read(width * height * 4)
+                data = rgb_to_atem(frame, width, height, premultiply)
+                self.upload(store, index + i, data, name=name, description=description)
             return
 
-        chunk_size = self.transfer_budget.size
-        self.log.debug(f'Queue {self.transfer_budget.count} chunks of {chunk_size}')
-        for i in range(0, self.transfer_budget.count):
-            if len(self.transfer.data) == 0:
-                break
+        if store not in self.transfer_queue:
+            self.transfer_queue[store] = []
+        for i in range(frames):
+            self.log.info("Queue streamed upload of {}:{}".format(store, index + i))
+            task = TransferTask(store, index + i, upload=True)
+            task.stream = UploadStream(reader, width, height, premultiply)
+            task.data_length = task.stream.length
+            task.name = name
+            task.description = description
+            self.transfer_queue[store].append(task)
+        self._transfer_trigger(store)
 
-            chunk = self.transfer.data[0:chunk_size]
-            used = chunk_size
-            if chunk[-8:] == b'\xFE\xFE\xFE\xFE\xFE\xFE\xFE\xFE':
-                chunk = self.transfer.data[0:chunk_size - 8]
-                used -= 8
-            elif chunk[-16:-8] == b'\xFE\xFE\xFE\xFE\xFE\xFE\xFE\xFE':
-                chunk = self.transfer.data[0:chunk_size - 16]
-                used -= 16
-            self.transfer.data = self.transfer.data[used:]
-
-            self.transfer_budget.count -= 1
-            if self.transfer_budget.count == 0:
-                self.log.debug('Transfer budget ran out')
-                self.transfer_budget = None
-
-            cmd = TransferDataCommand(self.transfer.tid, chunk)
+    def _fill_queue(self):
+        # Only keep transfer_window chunks in the transport queue so uploads that get a budget later still get
+        # their share of the bandwidth
+        while len(self.transport.send_queue) < self.transfer_window:
+            item = self.transfer_scheduler.take()
+            if item is None:
+                break
+            task, chunk = item
+            cmd = TransferDataCommand(task.tid, chunk)
             packet = Packet()
             packet.flags = UdpProtocol.FLAG_RELIABLE
             packet.data = cmd.get_command()
+            self.queued_chunks.append((task, len(chunk)))
             self.transport.queue_packet(packet)
+
+    def _drop_queued_chunks(self, task=None):
+        """
+        Remove the FTDa packets that have not been sent yet from the transport queue
+
+        :param task: Only remove the chunks of this transfer, or None to remove all
+        """
+        # The queued_chunks entries are in the same order as the packets in the transport queue
+        send_queue = self.transport.send_queue
+        kept = []
+        if task is not None:
+            kept = [item for item in zip(self.queued_chunks, send_queue) if item[0][0] is not task]
+        self.queued_chunks.clear()
+        send_queue.clear()
+        for entry, packet in kept:
+            self.queued_chunks.append(entry)
+            send_queue.append(packet)
+
+    def _queue_chunks(self):
+        self._fill_queue()
         self.transport.queue_trigger()
 
     def _queue_flushed(self):
         self.log.info('Queue flushed')
-        if len(self.transfer.data):
-            self._queue_chunks()
-            return
-        self.log.info('Sending file metadata')
-        cmd = TransferFileDataCommand(self.transfer.tid, self.transfer.hash,
-                                      name=self.transfer.name, description=self.transfer.description)
-        self.send_commands([cmd])
+        for task in list(self.transfers.values()):
+            if not task.upload or not task.requested or task.metadata_sent:
+                continue
+            # Without a budget the rest is sent when the hardware asks for the next chunks
+            if task.remaining():
+                continue
+            self.log.info(f'Sending file metadata for {task}')
+            task.metadata_sent = True
+            cmd = TransferFileDataCommand(task.tid, task.hash, name=task.name, description=task.description)
+            self.send_commands([cmd])
 
     def _transfer_trigger(self, store, retry=False):
-        next = None
-
+        """
+        Start the next transfer for a store. Every store has its own queue and lock, so transfers on different
+        stores run at the same time.
+        """
         self.log.info(f'transfer trigger for store {store} (retry={retry})')
 
-        # Try the preferred queue
-        if store in self.transfer_queue:
-            if len(self.transfer_queue[store]) > 0:
-                next = self.transfer_queue[store][0]
-
-        # Try any queue
-        if next is None:
-            for store in self.transfer_queue:
-                if len(self.transfer_queue[store]) > 0:
-                    next = self.transfer_queue[store][0]
-                    break
-
+        queue = self.transfer_queue.get(store)
+        next = queue[0] if queue else None
         self.log.info(f'next transfer: {next}')
 
-        # All transfers done, clean locks
+        # All transfers for this store are done, release the lock
         if next is None:
-            for lock in self.locks:
-                if self.locks[lock]:
-                    self.log.info('Releasing lock {}'.format(lock))
-                    cmd = LockCommand(lock, False)
-                    self.send_commands([cmd])
+            if self.locks.get(store):
+                self.log.info('Releasing lock {}'.format(store))
+                self.locks[store] = False
+                cmd = LockCommand(store, False)
+                self.send_commands([cmd])
             return
 
         # Request a lock if needed
-        if next.store != 0xffff and (next.store not in self.locks or not self.locks[next.store]):
+        if next.store != 0xffff and not self.locks.get(next.store):
             self.log.info('Requesting lock for {}'.format(next.store))
             cmd = PartialLockCommand(next.store, next.slot)
             self.send_commands([cmd])
             return
 
-        # A transfer request is already running, don't start a new one
-        if self.transfer_requested:
+        # A transfer request is already running for this store, don't start a new one
+        if next.requested:
             self.log.info('Request already submitted, do nothing')
             return
 
         # Assign a transfer id and start the transfer
-        if not retry:
+        if next.tid is None or not retry:
             self.transfer_id += 1
-        self.transfer = next
-        self.transfer.tid = self.transfer_id
+            next.tid = self.transfer_id
+        self.transfers[store] = next
 
-        if self.transfer.upload:
-            cmd = TransferUploadRequestCommand(self.transfer.tid, self.transfer.store, self.transfer.slot,
-                                               self.transfer.data_length, 1)
+        if next.upload:
+            try:
+                next.start()
+            except ValueError as e:
+                self.log.error(f'Dropping upload to {next.store}:{next.slot}: {e}')
+                del self.transfers[store]
+                self.transfer_queue[store] = queue[1:]
+                self._transfer_trigger(store)
+                return
+            next.metadata_sent = False
+            cmd = TransferUploadRequestCommand(next.tid, next.store, next.slot, next.data_length, 1)
             self.log.info('Requesting upload to {}:{}'.format(next.store, next.slot))
         else:
-            cmd = TransferDownloadRequestCommand(self.transfer.tid, self.transfer.store, self.transfer.slot)
+            cmd = TransferDownloadRequestCommand(next.tid, next.store, next.slot)
+            next.buffer = DownloadBuffer(self._download_size(next.store), compressed=next.store == 0,
+                                         output=next.output)
+            next.packets = 0
             self.log.info('Requesting download of {}:{}'.format(next.store, next.slot))
-        self.transfer_requested = True
+        next.requested = True
         self.send_commands([cmd])
+
+
+class LoopTimer:
+    """
+    Timer on an asyncio event loop that is started from another thread. Like the TimerHandle from
+    loop.call_later() it can be cancelled, the callback runs on the event loop.
+    """
+
+    def __init__(self, loop, delay, callback):
+        self.loop = loop
+        self.callback = callback
+        self.handle = None
+        self.cancelled = False
+        loop.call_soon_threadsafe(self._start, delay)
+
+    def _start(self, delay):
+        if not self.cancelled:
+            self.handle = self.loop.call_later(delay, self._run)
+
+    def _run(self):
+        if not self.cancelled:
+            self.callback()
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class AsyncAtemProtocol(AtemProtocol):
+    """
+    AtemProtocol variant for use with asyncio. Incoming packets are decoded directly from the event loop so any
+    number of switchers can be handled by a single event loop without extra threads. Commands can also be sent from
+    other threads, the timers for them run on the event loop that was used for connect().
+
+    .. code-block:: python
+
+       switcher = AsyncAtemProtocol("192.168.2.1")
+       await switcher.connect()
+       async for key, contents in switcher.changes():
+           print(key, contents)
+    """
+
+    def __init__(self, ip, port=9910):
+        self._ready = None
+        self.event_loop = None
+        super().__init__(ip=ip, port=port)
+        self.on('connected', self._on_connected)
+        self.on('disconnected', self._on_disconnected)
+
+    def _create_transport(self, ip, port, usb):
+        if ip.startswith('tcp://'):
+            raise ValueError("The asyncio protocol only supports UDP connections")
+        return AsyncUdpProtocol(ip, port, packet_callback=self._process_packet)
+
+    async def connect(self, wait=True):
+        """
+        Start the connection to the hardware. By default this waits until the initial state sync has completed,
+        use asyncio.wait_for() to put a limit on the time this takes.
+
+        :param wait: Wait for the initial state sync before returning
+        """
+        self.log.debug('Starting connection')
+        self.event_loop = asyncio.get_running_loop()
+        self._ready = self.event_loop.create_future()
+        await self.transport.connect()
+        if wait:
+            await asyncio.shield(self._ready)
+
+    def close(self):
+        self.transport.close()
+
+    def loop(self):
+        raise RuntimeError("AsyncAtemProtocol is driven by the asyncio event loop, loop() is not needed")
+
+    def _get_loop(self):
+        # Before connect() this is only called from the event loop the switcher will run on
+        if self.event_loop is None:
+            return asyncio.get_running_loop()
+        return self.event_loop
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._get_loop()
+        except RuntimeError:
+            return False
+
+    def _create_future(self):
+        return self._get_loop().create_future()
+
+    def _call_later(self, delay, callback):
+        if self._in_loop():
+            return self._get_loop().call_later(delay, callback)
+        return LoopTimer(self._get_loop(), delay, callback)
+
+    async def changes(self):
+        """
+        Async iterator yielding a (key, contents) tuple for every changed field
+        """
+        queue = asyncio.Queue()
+        callback_id = self.on('change', lambda key, contents: queue.put_nowait((key, contents)))
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.off('change', callback_id)
+
+    def _on_connected(self):
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_result(True)
+
+    def _on_disconnected(self):
+        if self._ready is not None and self._ready.done():
+            self._ready = self._get_loop().create_future()
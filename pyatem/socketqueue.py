@@ -36,3 +36,32 @@ class SocketQueue(queue.Queue):
     def get(self, **kwargs):
         self._getsocket.recv(1)
         return super().get(**kwargs)
+
+    def get_all(self):
+        """
+        Get all items that are currently in the queue without blocking. The wakeup bytes for all items are
+        consumed with a single read, any byte belonging to an item that is added during this call only causes
+        a spurious wakeup of select() that returns an empty list.
+        """
+        if hasattr(socket, 'MSG_DONTWAIT'):
+            try:
+                while len(self._getsocket.recv(4096, socket.MSG_DONTWAIT)) == 4096:
+                    pass
+            except BlockingIOError:
+                pass
+        else:
+            self._getsocket.setblocking(False)
+            try:
+                while len(self._getsocket.recv(4096)) == 4096:
+                    pass
+            except BlockingIOError:
+                pass
+            finally:
+                self._getsocket.setblocking(True)
+
+        result = []
+        while True:
+            try:
+                result.append(queue.Queue.get(self, block=False))
+            except queue.Empty:
+                return result
@@ -0,0 +1,171 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import collections
+import threading
+
+
+class StateStore(dict):
+    """
+    State of the switcher. This is a dict with the nested layout that has always been used for the switcher state,
+    where the fields with an index are stored in nested dicts for every index value. The path of a field is the
+    field key followed by the index values.
+
+    Every field has a version, the value of the global sequence number that is increased on every update. The
+    versions are kept in a second tree of dicts with the same layout that only holds the version numbers, the
+    fields themselves are only stored once. The paths of the last updates are kept in a bounded journal, so clients
+    that poll the state can request only the fields that changed since the sequence number of their previous
+    request.
+
+    .. code-block:: python
+
+       state['program-bus-input'][0].source
+       state.entry(('program-bus-input', 0))   # (version, field)
+
+    :ivar versions: Nested dicts with the version of every field
+    :ivar seq: The sequence number of the last update
+    :ivar journal: The paths of the last updates and removals, the last one has sequence number `seq`
+    :ivar journal_start: The journal has all changes after this sequence number
+    """
+
+    def __init__(self, journal_size=4096):
+        super().__init__()
+        self.versions = {}
+        self.seq = 0
+        self.journal = collections.deque(maxlen=journal_size)
+        self.journal_start = 0
+        # The sequence number of a journal entry follows from its position, the lock keeps seq and the journal
+        # consistent for readers on other threads
+        self.lock = threading.Lock()
+
+    def _record(self, path):
+        with self.lock:
+            if len(self.journal) == self.journal.maxlen:
+                self.journal_start = self.seq - len(self.journal) + 1
+            self.seq += 1
+            self.journal.append(path)
+
+    @staticmethod
+    def _parent(tree, path, create=False):
+        # Get the dict that holds the last index of the path
+        parent = tree
+        for idx in path[:-1]:
+            child = parent.get(idx)
+            if not isinstance(child, dict):
+                if not create:
+                    return None
+                child = {}
+                dict.__setitem__(parent, idx, child)
+            parent = child
+        return parent
+
+    def set(self, key, idxes, value):
+        """
+        Store a field
+
+        :param key: Field key
+        :param idxes: Tuple of index values or None for fields without index
+        :param value: The field
+        :return: The version of the stored field
+        """
+        path = (key,) if idxes is None else (key,) + idxes
+        self._record(path)
+        self._parent(self, path, create=True)[path[-1]] = value
+        self._parent(self.versions, path, create=True)[path[-1]] = self.seq
+        return self.seq
+
+    def remove(self, path):
+        """
+        Remove a field, the dicts for the indexes are kept even if they are empty
+
+        :param path: Tuple of the field key and index values
+        """
+        versions = self._parent(self.versions, path)
+        if versions is None or versions.pop(path[-1], None) is None:
+            return
+        self._record(path)
+        parent = self._parent(self, path)
+        if parent is not None:
+            parent.pop(path[-1], None)
+
+    def entry(self, path):
+        """
+        Get a field together with its version
+
+        :param path: Tuple of the field key and index values
+        :return: Tuple of (version, value) or None if the field is not in the state
+        """
+        versions = self._parent(self.versions, path)
+        parent = self._parent(self, path)
+        if versions is None or parent is None:
+            return None
+        try:
+            return versions[path[-1]], parent[path[-1]]
+        except KeyError:
+            return None
+
+    def _entries(self, tree=None, prefix=()):
+        # All (path, version, value) in the state. Every level is copied first since the state can be modified from
+        # the thread that receives the data from the switcher.
+        for idx, item in list((tree if tree is not None else self.versions).items()):
+            path = prefix + (idx,)
+            if isinstance(item, dict):
+                yield from self._entries(item, path)
+                continue
+            entry = self.entry(path)
+            if entry is not None:
+                yield path, entry[0], entry[1]
+
+    def version(self, path):
+        """
+        Get the version of a field
+
+        :param path: Tuple of the field key and index values
+        :return: The version or None if the field is not in the state
+        """
+        versions = self._parent(self.versions, path)
+        if versions is None:
+            return None
+        return versions.get(path[-1])
+
+    def changes_since(self, seq):
+        """
+        Get the fields that were updated or removed after a sequence number. When the sequence number is older than
+        the journal a snapshot of all fields is returned instead, the client should then replace its state.
+
+        :param seq: Sequence number from an earlier `seq` or field version
+        :return: Tuple of (current, snapshot, changes) where current is the sequence number to use for the next
+                 request and changes is a list of (path, version, value) ordered by version, value is None for
+                 removed fields
+        """
+        # Copy the journal first, it can be modified from the thread that receives the data from the switcher
+        with self.lock:
+            current = self.seq
+            journal = list(self.journal)
+            journal_start = self.journal_start
+        if seq < journal_start or seq > current:
+            result = list(self._entries())
+            result.sort(key=lambda item: item[1])
+            return current, True, result
+
+        result = {}
+        for i, path in enumerate(reversed(journal)):
+            version = current - i
+            if version <= seq:
+                break
+            if path not in result:
+                entry = self.entry(path)
+                result[path] = entry if entry is not None else (version, None)
+        result = [(path, version, value) for path, (version, value) in result.items()]
+        result.sort(key=lambda item: item[1])
+        return current, False, result
+
+    def clear(self):
+        """
+        Remove all fields, the sequence number keeps counting so versions never repeat
+        """
+        super().clear()
+        self.versions.clear()
+        with self.lock:
+            self.journal.clear()
+            self.seq += 1
+            self.journal_start = self.seq
@@ -0,0 +1,151 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import struct
+import threading
+from unittest import TestCase
+
+from pyatem.dispatcher import EventDispatcher, change_key
+from pyatem.field import ProgramBusInputField, LazyField
+from pyatem.protocol import AtemProtocol
+from pyatem.transport import Packet
+
+
+def program_bus(me, source):
+    return ProgramBusInputField(bytes([me, 0]) + source.to_bytes(2, 'big'))
+
+
+class TestEventDispatcher(TestCase):
+    def setUp(self):
+        self.dispatcher = EventDispatcher(workers=2)
+        self.block = threading.Event()
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.received = []
+
+    def tearDown(self):
+        self.block.set()
+        self.dispatcher.close()
+
+    def _handler(self, *args):
+        self.started.set()
+        self.block.wait(5)
+        self.received.append(args)
+        if args[0] == 'last':
+            self.done.set()
+
+    def test_order(self):
+        handler = self.dispatcher.wrap(self._handler)
+        self.block.set()
+        for i in range(200):
+            handler('event', i)
+        handler('last')
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([('event', i) for i in range(200)] + [('last',)], self.received)
+
+    def test_drop_oldest(self):
+        handler = self.dispatcher.wrap(self._handler, maxsize=4)
+
+        # The first event is taken by the worker which blocks in the handler, the rest is queued
+        handler('event', 0)
+        self.assertTrue(self.started.wait(5))
+        for i in range(1, 10):
+            handler('event', i)
+        handler('last')
+        self.block.set()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(6, handler.dropped)
+        self.assertEqual([('event', 7), ('event', 8), ('event', 9), ('last',)], self.received[-4:])
+
+    def test_coalesce_latest(self):
+        handler = self.dispatcher.wrap(self._handler, policy=EventDispatcher.COALESCE_LATEST)
+        handler('first')
+        self.assertTrue(self.started.wait(5))
+        for source in range(2, 10):
+            handler('program-bus-input', program_bus(0, source))
+            handler('program-bus-input', program_bus(1, source))
+        handler('last')
+        self.block.set()
+        self.assertTrue(self.done.wait(5))
+
+        pending = [(args[1].index, args[1].source) for args in self.received[1:-1]]
+        self.assertEqual([(0, 9), (1, 9)], pending)
+        self.assertEqual(14, handler.coalesced)
+        self.assertEqual(0, handler.dropped)
+
+    def test_coalesce_no_drop(self):
+        handler = self.dispatcher.wrap(self._handler, policy=EventDispatcher.COALESCE_LATEST, maxsize=4)
+        handler('first')
+        self.assertTrue(self.started.wait(5))
+        for source in range(10):
+            handler('aux-output-source', bytes([source, 0, 0, 1]))
+        handler('last')
+        self.block.set()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(12, len(self.received))
+        self.assertEqual(0, handler.dropped)
+
+    def test_key_exception(self):
+        def broken(*args):
+            raise ValueError("broken")
+
+        handler = self.dispatcher.wrap(self._handler, policy=EventDispatcher.COALESCE_LATEST, key=broken)
+        with self.assertLogs('EventDispatcher'):
+            handler('event')
+        handler('last')
+        self.block.set()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([('event',), ('last',)], self.received)
+
+    def test_field_without_decoder(self):
+        # The raw bytes are passed to the handlers for fields without a decoder class
+        received = []
+        done = threading.Event()
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.on('change', self.dispatcher.wrap(lambda *args: (received.append(args), done.set()),
+                                                   policy=EventDispatcher.COALESCE_LATEST))
+        packet = Packet()
+        packet.data = struct.pack('!H2x 4s', 12, b'KePt') + bytes([0, 1, 5, 0])
+        switcher._process_packet(packet)
+        self.assertTrue(done.wait(5))
+        self.assertEqual('key-properties-pattern', received[0][0])
+
+    def test_slow_handler(self):
+        slow = self.dispatcher.wrap(self._handler)
+        fast_done = threading.Event()
+        fast = self.dispatcher.wrap(lambda *args: fast_done.set())
+
+        slow('event', 0)
+        fast('event', 0)
+        self.assertTrue(fast_done.wait(5))
+        self.assertEqual([], self.received)
+
+    def test_exception(self):
+        def broken(*args):
+            raise ValueError("broken")
+
+        handler = self.dispatcher.wrap(broken)
+        after = self.dispatcher.wrap(self._handler)
+        with self.assertLogs('EventDispatcher'):
+            handler('event')
+            self.block.set()
+            after('last')
+            self.assertTrue(self.done.wait(5))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.dispatcher.wrap(self._handler, policy='newest')
+
+
+class TestChangeKey(TestCase):
+    def test_keys(self):
+        raw = bytes([1, 0, 0, 3])
+        self.assertEqual('InCm', change_key('InCm', b''))
+        self.assertEqual(('program-bus-input', (1,)), change_key('program-bus-input', ProgramBusInputField(raw)))
+        lazy = LazyField(ProgramBusInputField, raw)
+        self.assertEqual(('program-bus-input', (1,)), change_key('program-bus-input', lazy))
+        self.assertEqual(('event', 1, 2), change_key('event', 1, 2))
+
+    def test_no_decoder(self):
+        # Fields without a decoder class are passed as bytes
+        self.assertEqual(('key-properties-pattern', (0, 1)), change_key('key-properties-pattern', bytes([0, 1, 5, 0])))
+
@@ -0,0 +1,64 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import hashlib
+import os
+import tempfile
+from unittest import TestCase
+
+from pyatem.mediacache import MediaCache
+
+
+class TestMediaCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = self.dir.name
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_put_get(self):
+        cache = MediaCache(self.path)
+        frame = b'\x01\x02\x03\x04' * 100
+        digest = cache.put(frame, b'compressed')
+        self.assertEqual(hashlib.md5(frame).digest(), digest)
+        self.assertIn(digest, cache)
+        self.assertEqual(frame, cache.get(digest))
+        self.assertEqual(b'compressed', cache.get_compressed(digest))
+        self.assertIsNone(cache.get(b'\x00' * 16))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_evict(self):
+        cache = MediaCache(self.path, max_size=250)
+        first = cache.put(b'\x01' * 100)
+        second = cache.put(b'\x02' * 100)
+        # Using the first frame makes the second one the least recently used
+        cache.get(first)
+        third = cache.put(b'\x03' * 100)
+        self.assertIn(first, cache)
+        self.assertNotIn(second, cache)
+        self.assertIn(third, cache)
+        self.assertEqual(200, cache.size)
+        self.assertEqual(2, len(os.listdir(self.path)))
+
+    def test_reload(self):
+        cache = MediaCache(self.path)
+        digest = cache.put(b'\x01' * 100, b'\x02' * 10)
+
+        cache = MediaCache(self.path)
+        self.assertEqual(110, cache.size)
+        self.assertEqual(b'\x01' * 100, cache.get(digest))
+
+        # The cache is trimmed when it's opened with a smaller limit
+        cache = MediaCache(self.path, max_size=50)
+        self.assertEqual(0, cache.size)
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_background(self):
+        cache = MediaCache(self.path)
+        frame = b'\x01\x02\x03\x04' * 100
+        future = cache.put_background(frame, b'compressed')
+        cache.flush()
+        self.assertTrue(future.done())
+        self.assertEqual(hashlib.md5(frame).digest(), future.result())
+        self.assertEqual(frame, cache.get(future.result()))
@@ -0,0 +1,160 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import struct
+from unittest import TestCase
+from unittest.mock import patch
+
+import pyatem.meters
+from pyatem.field import FairlightMeterLevelsField, FairlightMasterLevelsField, AudioMeterLevelsField
+from pyatem.meters import MeterMatrix, MeterAggregator
+from pyatem.protocol import AtemProtocol
+from pyatem.transport import Packet
+
+
+def fairlight_meter(index, values, split=False, subchannel=0):
+    return struct.pack('>6xBBH 15h', 0xff if split else 0, subchannel, index, *values)
+
+
+def audio_meter(sources):
+    count = len(sources)
+    raw = struct.pack('>H2x 4I 4I', count, 0, 1 << 22, 1 << 23, 1 << 20, 1 << 21, 0, 0, 0)
+    raw += struct.pack('>{}H'.format(count), *sources)
+    raw += b'\0' * (len(raw) % 4)
+    for i in range(count):
+        raw += struct.pack('>4I', (i + 1) << 18, (i + 1) << 19, 0, 1 << 23)
+    return raw
+
+
+class TestMeterMatrix(TestCase):
+    def _compare(self, use_numpy):
+        matrix = MeterMatrix(capacity=2, use_numpy=use_numpy)
+        fields = [
+            fairlight_meter(1, [-i * 600 for i in range(15)]),
+            fairlight_meter(2, [-10000] * 15, split=True, subchannel=1),
+            fairlight_meter(3, [0] * 14 + [-1]),
+        ]
+        master = struct.pack('>14h', *[-i * 700 for i in range(14)])
+        audio = audio_meter([1, 2, 1301])
+        matrix.update([(b'FMLv', memoryview(raw)) for raw in fields] + [(b'FDLv', master)])
+        self.assertEqual(['master', '1.0', '2.1', '3.0'], matrix.updated)
+
+        for raw in fields:
+            field = FairlightMeterLevelsField(raw)
+            levels = matrix.get(field.strip_id)
+            expected = field.input + (field.expander_gr, field.compressor_gr, field.limiter_gr) + field.output + \
+                field.level
+            for a, b in zip(expected, levels):
+                self.assertAlmostEqual(a, b)
+
+        field = FairlightMasterLevelsField(master)
+        expected = field.input + (field.compressor_gr, field.limiter_gr) + field.output + field.level
+        levels = matrix.get('master')
+        for a, b in zip(expected, levels[0:4] + levels[5:]):
+            self.assertAlmostEqual(a, b)
+
+        # The classic audio mixer meters
+        matrix = MeterMatrix(capacity=2, use_numpy=use_numpy)
+        matrix.update([(b'AMLv', audio)])
+        self.assertEqual(['master', 'monitor', '1.0', '2.0', '1301.0'], matrix.updated)
+        field = AudioMeterLevelsField(audio)
+        for a, b in zip(field.master, matrix.get_level('master')):
+            self.assertAlmostEqual(a, b)
+        for a, b in zip(field.monitor, matrix.get_level('monitor')):
+            self.assertAlmostEqual(a, b)
+        for source in field.input:
+            for a, b in zip(field.input[source], matrix.get_level(f'{source}.0')):
+                self.assertAlmostEqual(a, b)
+
+    def test_array(self):
+        self._compare(False)
+
+    def test_numpy(self):
+        if pyatem.meters.numpy is None:
+            self.skipTest("NumPy is not available")
+        self._compare(True)
+
+    def test_event(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.bulk_meters = True
+        events = []
+        switcher.on('meters-updated', lambda meters: events.append(list(meters.updated)))
+        packet = Packet()
+        packet.data = b''.join(struct.pack('!H2x 4s', 48, b'FMLv') + fairlight_meter(i, [-5000] * 15)
+                               for i in range(20))
+        switcher._process_packet(packet)
+        self.assertEqual(1, len(events))
+        self.assertEqual(20, len(events[0]))
+        self.assertNotIn('fairlight-meter-levels', switcher.mixerstate)
+
+
+class TestMeterAggregator(TestCase):
+    def test_aggregate(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.bulk_meters = True
+        updates = []
+        aggregator = MeterAggregator(switcher, updates.append, rate=5, hold=1.0, decay=10.0)
+
+        def send(*levels):
+            packet = Packet()
+            packet.data = b''.join(struct.pack('!H2x 4s', 48, b'FMLv') + fairlight_meter(i, [value] * 15)
+                                   for i, value in enumerate(levels))
+            switcher._process_packet(packet)
+
+        # All packets within the interval are combined into a single update
+        aggregator.last = 0
+        send(-2000, -8000)
+        send(-1000, -9000)
+        send(-3000, -9000)
+        self.assertEqual(1, len(updates))
+        start = aggregator.last
+        aggregator.flush(start + 0.2)
+        self.assertEqual(2, len(updates))
+        peak = updates[1]['0.0'][2]
+        self.assertAlmostEqual(updates[1]['0.0'][0], peak)
+
+        # The peak is held and then decays
+        aggregator._add('0.0', -60, -60)
+        aggregator.flush(start + 0.5)
+        self.assertAlmostEqual(peak, updates[2]['0.0'][2])
+        aggregator._add('0.0', -60, -60)
+        aggregator.flush(start + 1.7)
+        self.assertAlmostEqual(peak - 5.0, updates[3]['0.0'][2])
+
+        aggregator.close()
+        send(0, 0)
+        self.assertEqual(4, len(updates))
+
+    def test_tick(self):
+        switcher = AtemProtocol('127.0.0.1')
+        updates = []
+        now = [100.0]
+        with patch('pyatem.meters.time.monotonic', lambda: now[0]):
+            aggregator = MeterAggregator(switcher, updates.append, rate=5, hold=1.0, decay=10.0)
+
+            # Levels that arrive right after an update are sent by the timer when the interval has passed
+            aggregator._add('0.0', -10, -20)
+            aggregator.tick()
+            self.assertEqual([], updates)
+            now[0] += 0.2
+            aggregator.tick()
+            self.assertEqual([{'0.0': (-10, -20, -10, -20)}], updates)
+
+            # Without new meter data the level stays and the peak-hold decays to it
+            aggregator._add('0.0', -40, -40)
+            now[0] += 0.2
+            aggregator.tick()
+            now[0] += 1.5
+            aggregator.tick()
+            left, right, left_peak, right_peak = updates[-1]['0.0']
+            self.assertEqual((-40, -40), (left, right))
+            self.assertAlmostEqual(-17.0, left_peak)
+            self.assertAlmostEqual(-27.0, right_peak)
+            now[0] += 5
+            aggregator.tick()
+            self.assertEqual((-40, -40, -40, -40), updates[-1]['0.0'])
+
+            # Nothing is sent once the peak is back at the level
+            count = len(updates)
+            now[0] += 1
+            aggregator.tick()
+            self.assertEqual(count, len(updates))
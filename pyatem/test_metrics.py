@@ -0,0 +1,53 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+from unittest import TestCase
+
+from pyatem.metrics import Histogram, Timings, TransportMetrics
+
+
+class TestHistogram(TestCase):
+    def test_percentile(self):
+        histogram = Histogram(bounds=(1, 2, 5))
+        self.assertIsNone(histogram.percentile(0.5))
+        for value in [0.5] * 90 + [3] * 9 + [7]:
+            histogram.add(value)
+
+        self.assertEqual([90, 0, 9, 1], histogram.buckets)
+        self.assertEqual(1, histogram.percentile(0.5))
+        self.assertEqual(5, histogram.percentile(0.99))
+        self.assertEqual(7, histogram.percentile(1.0))
+        result = histogram.to_dict()
+        self.assertEqual(100, result['count'])
+        self.assertEqual(7, result['max'])
+        self.assertEqual({'1': 90, '2': 0, '5': 9, 'inf': 1}, result['buckets'])
+
+
+class TestTimings(TestCase):
+    def test_sampled(self):
+        timings = Timings(sample=4)
+        timings.add(b'PrgI', 0.002)
+        timings.add(b'PrgI', 0.004)
+        timings.add('change', 0.001)
+
+        result = timings.to_dict()
+        self.assertEqual({'count': 8, 'total': 0.024, 'average': 0.003, 'max': 0.004}, result['PrgI'])
+        self.assertEqual(4, result['change']['count'])
+
+
+class TestTransportMetrics(TestCase):
+    def test_rates(self):
+        metrics = TransportMetrics()
+        metrics._previous = (metrics._previous[0] - 2.0, 0, 0, 0, 0)
+        metrics.packets_in = 10
+        metrics.bytes_in = 1000
+
+        result = metrics.snapshot({'send': 3})
+        self.assertEqual(10, result['packets_in'])
+        self.assertAlmostEqual(5, result['packets_in_per_second'], delta=0.1)
+        self.assertAlmostEqual(500, result['bytes_in_per_second'], delta=10)
+        self.assertEqual({'send': 3}, result['queues'])
+
+        # Rates are calculated since the previous snapshot
+        result = metrics.snapshot()
+        self.assertEqual(10, result['packets_in'])
+        self.assertEqual(0, result['packets_in_per_second'])
@@ -0,0 +1,747 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
+import hashlib
+import io
+import os
+import struct
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyatem.command import ProgramInputCommand, TransitionPositionCommand, CutCommand, CameraControlCommand, \
+    FairlightStripPropertiesCommand, KeyOnAirCommand, AuxSourceCommand
+from pyatem.field import LazyField, ProgramBusInputField
+from pyatem.media import rle_encode, rle_decode, rgb_to_atem
+from pyatem.mediacache import MediaCache
+from pyatem.protocol import AtemProtocol, AsyncAtemProtocol
+from pyatem.transfer import UploadStream
+from pyatem.transport import Packet
+
+
+def make_packet(*fields):
+    packet = Packet()
+    packet.data = b''.join(struct.pack('!H2x 4s', len(data) + 8, code) + data for code, data in fields)
+    return packet
+
+
+class TestFastReconnect(TestCase):
+    def _sync(self, switcher, *fields):
+        switcher._process_packet(make_packet(*fields, (b'InCm', b'\0\0\0\0')))
+
+    def test_resync(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.fast_reconnect = True
+        self._sync(switcher,
+                   (b'PrgI', struct.pack('>BxH', 0, 1)),
+                   (b'PrgI', struct.pack('>BxH', 1, 2)),
+                   (b'AuxS', struct.pack('>BxH', 0, 3)))
+
+        changes = []
+        resynced = []
+        switcher.on('change', lambda key, contents: changes.append(key))
+        switcher.on('resynced', lambda: resynced.append(True))
+
+        switcher._process_packet(None)
+        self.assertEqual(2, switcher.mixerstate['program-bus-input'][1].source)
+
+        # M/E 2 changed program source and the aux output disappeared while disconnected
+        self._sync(switcher,
+                   (b'PrgI', struct.pack('>BxH', 0, 1)),
+                   (b'PrgI', struct.pack('>BxH', 1, 5)))
+
+        self.assertEqual(['program-bus-input', 'InCm'], changes)
+        self.assertEqual([True], resynced)
+        self.assertEqual(5, switcher.mixerstate['program-bus-input'][1].source)
+        self.assertEqual({}, switcher.mixerstate['aux-output-source'])
+
+    def test_resync_removed(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.fast_reconnect = True
+        self._sync(switcher,
+                   (b'PrgI', struct.pack('>BxH', 0, 1)),
+                   (b'AuxS', struct.pack('>BxH', 0, 3)),
+                   (b'AuxS', struct.pack('>BxH', 1, 4)))
+        # The time is only sent after the initial sync
+        switcher._process_packet(make_packet((b'Time', struct.pack('>BBBB?3x', 1, 2, 3, 4, False))))
+        seq, snapshot, changes = switcher.changes_since(0)
+
+        removed = []
+        switcher.on('removed', lambda key, index: removed.append((key, index)))
+        switcher._process_packet(None)
+        self._sync(switcher,
+                   (b'PrgI', struct.pack('>BxH', 0, 1)),
+                   (b'AuxS', struct.pack('>BxH', 0, 3)))
+
+        # Only fields from the initial sync dump are removed, and the removal is in the journal
+        self.assertEqual([('aux-output-source', (1,))], removed)
+        self.assertEqual(3, switcher.mixerstate['time'].seconds)
+        seq, snapshot, changes = switcher.changes_since(seq)
+        self.assertIn((('aux-output-source', 1), None), [(path, value) for path, version, value in changes])
+
+    def test_disabled(self):
+        switcher = AtemProtocol('127.0.0.1')
+        self._sync(switcher, (b'PrgI', struct.pack('>BxH', 0, 1)))
+        switcher._process_packet(None)
+        self.assertEqual({}, switcher.mixerstate)
+
+
+class TestSuppressUnchanged(TestCase):
+    def test_suppress(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.suppress_unchanged = True
+        changes = []
+        switcher.on('change', lambda key, contents: changes.append((key, getattr(contents, 'source', None))))
+
+        for i in range(3):
+            switcher._process_packet(make_packet(
+                (b'PrgI', struct.pack('>BxH', 0, 1)),
+                (b'PrgI', struct.pack('>BxH', 1, 2 + i // 2)),
+                (b'InCm', b'\0\0\0\0'),
+            ))
+
+        self.assertEqual([
+            ('program-bus-input', 1), ('program-bus-input', 2), ('InCm', None),
+            ('InCm', None),
+            ('program-bus-input', 3), ('InCm', None),
+        ], changes)
+        self.assertEqual({'program-bus-input': 3}, switcher.suppressed)
+
+        # After a reconnect without fast_reconnect every field is new again
+        switcher._process_packet(None)
+        switcher._process_packet(make_packet((b'PrgI', struct.pack('>BxH', 0, 1))))
+        self.assertEqual(('program-bus-input', 1), changes[-1])
+
+    def test_raw_field(self):
+        # Fields without decoder are stored as a copy of the data, the duplicate is compared without copying it
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.suppress_unchanged = True
+        changes = []
+        switcher.on('change', lambda key, contents: changes.append(contents))
+        for i in range(2):
+            switcher._process_packet(make_packet((b'KePt', bytes([0, 1, 5, 0]))))
+        self.assertEqual(1, len(changes))
+        self.assertIsInstance(changes[0], bytes)
+        self.assertIsInstance(switcher.mixerstate['key-properties-pattern'][0][1], bytes)
+        self.assertEqual({'key-properties-pattern': 1}, switcher.suppressed)
+
+    def test_disabled(self):
+        switcher = AtemProtocol('127.0.0.1')
+        changes = []
+        switcher.on('change', lambda key, contents: changes.append(key))
+        for i in range(2):
+            switcher._process_packet(make_packet((b'PrgI', struct.pack('>BxH', 0, 1))))
+        self.assertEqual(['program-bus-input', 'program-bus-input'], changes)
+        self.assertEqual({}, switcher.raw_state)
+
+    def test_strips(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.suppress_unchanged = True
+        changes = []
+        switcher.on('change', lambda key, contents: changes.append(contents.strip_id))
+
+        # Both subchannels of a split strip have the same index in the field data
+        left = struct.pack('>H 12xBBxB 4x h 5x ? 4x h 2x Hh 4x h x B 2x', 1, 0xff, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        right = struct.pack('>H 12xBBxB 4x h 5x ? 4x h 2x Hh 4x h x B 2x', 1, 0xff, 1, 0, 0, 0, 0, 0, 0, 0, 0)
+        for i in range(2):
+            switcher._process_packet(make_packet((b'FASP', left), (b'FASP', right)))
+        self.assertEqual(['1.0', '1.1'], changes)
+        self.assertEqual({'1.0', '1.1'}, set(switcher.mixerstate['fairlight-strip-properties']))
+
+
+class TestFieldDispatch(TestCase):
+    def test_dispatch(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher._process_packet(make_packet(
+            (b'PrgI', struct.pack('>BxH', 0, 1)),
+            (b'CapA', b'\0\0\0\0'),
+            (b'XXXX', b'\1\2\3\4'),
+        ))
+        self.assertEqual(1, switcher.mixerstate['program-bus-input'][0].source)
+        self.assertNotIn('CapA', switcher.mixerstate)
+        self.assertEqual(b'\1\2\3\4', switcher.mixerstate['XXXX'])
+
+    def test_handler(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher._transfer_trigger = lambda store, retry=False: None
+        switcher._process_packet(make_packet((b'LKOB', struct.pack('>H2x', 3))))
+        self.assertTrue(switcher.locks[3])
+        self.assertNotIn('lock-obtained', switcher.mixerstate)
+
+
+class TestLazyDecode(TestCase):
+    def test_lazy(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.lazy_decode = True
+        switcher.on('change:preview-bus-input', lambda contents: None)
+        switcher._process_packet(make_packet(
+            (b'PrgI', struct.pack('>BxH', 0, 1)),
+            (b'PrvI', struct.pack('>BxH4x', 0, 2)),
+        ))
+        program = switcher.mixerstate['program-bus-input'][0]
+        self.assertIsInstance(program, LazyField)
+        self.assertIsInstance(program, ProgramBusInputField)
+        self.assertFalse(program.decoded)
+        self.assertEqual(struct.pack('>H2x4s', 12, b'PrgI') + struct.pack('>BxH', 0, 1), program.make_packet())
+        self.assertFalse(program.decoded)
+        self.assertEqual(1, program.source)
+        self.assertTrue(program.decoded)
+
+        # Fields with a handler registered are decoded right away
+        self.assertNotIsInstance(switcher.mixerstate['preview-bus-input'][0], LazyField)
+
+    def test_strip_id(self):
+        # Fields that are stored under their decoded strip_id are never lazy
+        for code, (key, decoder, unique, handler, lazy) in AtemProtocol('127.0.0.1').field_dispatch.items():
+            if decoder is not None and 'strip_id' in decoder.__slots__:
+                self.assertFalse(lazy, key)
+
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.lazy_decode = True
+        strip = struct.pack('>H 12xBBxB 4x h 5x ? 4x h 2x Hh 4x h x B 2x', 1, 0xff, 1, 0, 0, 0, 0, 0, 0, 0, 0)
+        switcher._process_packet(make_packet((b'FASP', strip)))
+        self.assertEqual({'1.1'}, set(switcher.mixerstate['fairlight-strip-properties']))
+        self.assertNotIsInstance(switcher.mixerstate['fairlight-strip-properties']['1.1'], LazyField)
+
+
+class TestLoopCallback(TestCase):
+    def test_call_soon(self):
+        # Callbacks from other threads are run by the thread that calls loop(), between the packets
+        switcher = AtemProtocol('127.0.0.1')
+        threads = []
+        worker = threading.Thread(target=switcher._call_soon,
+                                  args=(lambda: threads.append(threading.current_thread()),))
+        worker.start()
+        worker.join()
+        self.assertEqual([], threads)
+        switcher.loop()
+        self.assertEqual([threading.current_thread()], threads)
+
+
+class TestSubscriptions(TestCase):
+    def _send(self, switcher):
+        switcher._process_packet(make_packet(
+            (b'PrgI', struct.pack('>BxH', 0, 1)),
+            (b'PrgI', struct.pack('>BxH', 1, 3)),
+            (b'PrgI', struct.pack('>BxH', 2, 3)),
+            (b'VidM', struct.pack('>B3x', 3)),
+        ))
+
+    def test_string_events(self):
+        switcher = AtemProtocol('127.0.0.1')
+        result = []
+        switcher.on('change:program-bus-input:1', lambda c: result.append(('one', c.index)))
+        switcher.on('change:program-bus-input:*', lambda c: result.append(('any', c.index)))
+        switcher.on('change:video-mode', lambda c: result.append(('mode', None)))
+        callback_id = switcher.on('change:program-bus-input', lambda c: result.append(('never', None)))
+        self._send(switcher)
+        self.assertEqual([('any', 0), ('one', 1), ('any', 1), ('any', 2), ('mode', None)], result)
+
+        switcher.off('change:program-bus-input', callback_id)
+        self.assertEqual({None}, set(switcher.subscriptions['video-mode'].keys()))
+        self.assertNotIn(None, switcher.subscriptions['program-bus-input'])
+
+    def test_filters(self):
+        switcher = AtemProtocol('127.0.0.1')
+        result = []
+        switcher.subscribe('program-bus-input', lambda c: result.append(('match', c.index)),
+                           index=AtemProtocol.ANY_INDEX, match={'source': 3})
+        switcher.subscribe('program-bus-input', lambda c: result.append(('predicate', c.index)),
+                           index=AtemProtocol.ANY_INDEX, predicate=lambda c: c.index > 1)
+        subscription_id = switcher.subscribe('program-bus-input', lambda c: result.append(('me0', c.index)), index=0)
+        switcher.unsubscribe(subscription_id)
+        self._send(switcher)
+        self.assertEqual([('match', 1), ('match', 2), ('predicate', 2)], result)
+
+    def test_removed_during_notify(self):
+        # Another thread can remove the last subscription for an index right after the field was matched
+        class Racing(dict):
+            def __contains__(self, index):
+                result = dict.__contains__(self, index)
+                self.pop(index, None)
+                return result
+
+        switcher = AtemProtocol('127.0.0.1')
+        result = []
+        subscriptions = Racing({0: {1: (result.append, None, None)}})
+        switcher._notify(subscriptions, 0, 'field')
+        self.assertEqual(['field'], result)
+
+
+class TestSendCommands(TestCase):
+    def setUp(self):
+        self.switcher = AtemProtocol('127.0.0.1')
+        self.packets = []
+        self.switcher.send_raw = self.packets.append
+
+    def _commands(self):
+        result = []
+        for packet in self.packets:
+            commands = []
+            for code, data in self.switcher.decode_packet(packet):
+                commands.append((code.decode(), bytes(data)))
+            result.append(commands)
+        return result
+
+    def test_split(self):
+        commands = [ProgramInputCommand(index=i % 4, source=i) for i in range(200)]
+        self.switcher.send_commands(commands)
+
+        self.assertEqual([108, 92], [len(packet) for packet in self._commands()])
+        self.assertTrue(all(len(packet) <= 1300 for packet in self.packets))
+        sources = [struct.unpack('>BxH', data)[1] for packet in self._commands() for code, data in packet]
+        self.assertEqual(list(range(200)), sources)
+
+    def test_coalesce(self):
+        self.switcher.send_commands([
+            TransitionPositionCommand(index=0, position=100),
+            TransitionPositionCommand(index=1, position=100),
+            TransitionPositionCommand(index=0, position=200),
+            CutCommand(index=1),
+            TransitionPositionCommand(index=0, position=300),
+            TransitionPositionCommand(index=0, position=400),
+            CameraControlCommand(1, 0, 9, relative=True, datatype=1, data=[1]),
+            CameraControlCommand(1, 0, 9, relative=True, datatype=1, data=[1]),
+        ])
+        self.assertEqual([[
+            ('CTPs', struct.pack('>BxH', 1, 100)),
+            ('CTPs', struct.pack('>BxH', 0, 200)),
+            ('DCut', struct.pack('>B3x', 1)),
+            ('CTPs', struct.pack('>BxH', 0, 400)),
+            ('CCmd', CameraControlCommand(1, 0, 9, relative=True, datatype=1, data=[1]).get_command()[8:]),
+            ('CCmd', CameraControlCommand(1, 0, 9, relative=True, datatype=1, data=[1]).get_command()[8:]),
+        ]], self._commands())
+        self.assertEqual(2, self.switcher.commands_coalesced)
+
+        # Fader commands only replace commands that change the same settings
+        self.packets.clear()
+        self.switcher.send_commands([
+            FairlightStripPropertiesCommand(source=1, channel=-1, volume=-100),
+            FairlightStripPropertiesCommand(source=1, channel=-1, balance=20),
+            FairlightStripPropertiesCommand(source=1, channel=-1, volume=-200),
+        ])
+        self.assertEqual(2, len(self._commands()[0]))
+
+    def test_window(self):
+        self.switcher.command_window = 60
+        for position in range(0, 1000, 100):
+            self.switcher.send_commands([TransitionPositionCommand(index=0, position=position)])
+        self.assertEqual([], self.packets)
+        self.assertIsNotNone(self.switcher.command_timer)
+
+        # Other commands are sent right away together with the held commands
+        self.switcher.send_commands([CutCommand(index=0)])
+        self.assertIsNone(self.switcher.command_timer)
+        self.assertEqual([[
+            ('CTPs', struct.pack('>BxH', 0, 900)),
+            ('DCut', struct.pack('>B3x', 0)),
+        ]], self._commands())
+
+        self.packets.clear()
+        self.switcher.send_commands([TransitionPositionCommand(index=0, position=10000)])
+        self.switcher.flush_commands()
+        self.assertEqual([[('CTPs', struct.pack('>BxH', 0, 10000))]], self._commands())
+
+    def test_timer(self):
+        self.switcher.command_window = 0.01
+        sent = threading.Event()
+        self.switcher.send_raw = lambda data: sent.set()
+        self.switcher.send_commands([TransitionPositionCommand(index=0, position=100)])
+        self.assertTrue(sent.wait(5))
+        self.assertEqual(0, len(self.switcher.pending_commands))
+
+    def test_too_long(self):
+        with self.assertRaises(ValueError):
+            self.switcher.send_commands([CameraControlCommand(1, 1, 0, datatype=5, data=['x' * 1400])])
+        self.assertEqual([], self.packets)
+
+
+class TestCommandConfirmation(TestCase):
+    def _switcher(self, cls=AtemProtocol):
+        switcher = cls('127.0.0.1')
+        switcher.send_raw = lambda data: None
+        return switcher
+
+    def test_confirm(self):
+        switcher = self._switcher()
+        confirmed = []
+        switcher.on('command-confirmed', lambda command, rtt: confirmed.append(command))
+
+        command = ProgramInputCommand(index=0, source=3)
+        future = switcher.send_command_confirmed(command)
+        switcher._process_packet(make_packet(
+            (b'PrgI', struct.pack('>BxH', 1, 3)),
+            (b'PrgI', struct.pack('>BxH', 0, 2)),
+        ))
+        self.assertFalse(future.done())
+
+        switcher._process_packet(make_packet((b'PrgI', struct.pack('>BxH', 0, 3))))
+        self.assertGreaterEqual(future.result(timeout=0), 0)
+        self.assertEqual([future.result()], list(switcher.command_rtt))
+        self.assertEqual([command], confirmed)
+        self.assertEqual({}, switcher.awaiting)
+        self.assertEqual({}, switcher.subscriptions)
+
+    def test_unchanged(self):
+        # The confirmation is not suppressed when the field didn't change
+        switcher = self._switcher()
+        switcher.suppress_unchanged = True
+        switcher._process_packet(make_packet((b'KeOn', struct.pack('>BB?x', 0, 1, True))))
+
+        future = switcher.send_command_confirmed(KeyOnAirCommand(index=0, keyer=1, enabled=True))
+        switcher._process_packet(make_packet((b'KeOn', struct.pack('>BB?x', 0, 1, True))))
+        self.assertTrue(future.done())
+        self.assertEqual({}, switcher.suppressed)
+
+    def test_timeout(self):
+        switcher = self._switcher()
+        future = switcher.send_command_confirmed(CutCommand(index=0), field='program-bus-input', match={'source': 1},
+                                                 timeout=0.01)
+        self.assertIsInstance(future.exception(timeout=5), TimeoutError)
+        self.assertEqual({}, switcher.awaiting)
+
+        with self.assertRaises(ValueError):
+            switcher.send_command_confirmed(CutCommand(index=0))
+
+    def test_timeout_during_dispatch(self):
+        # The timeout expires while the packet with the confirming field is being handled
+        switcher = self._switcher()
+        switcher.subscribe('program-bus-input', lambda contents: time.sleep(0.2), index=0)
+        future = switcher.send_command_confirmed(ProgramInputCommand(index=0, source=3), timeout=0.05)
+        switcher._process_packet(make_packet((b'PrgI', struct.pack('>BxH', 0, 3))))
+        self.assertGreaterEqual(future.result(timeout=5), 0.2)
+        time.sleep(0.1)
+        self.assertEqual({}, switcher.awaiting)
+        self.assertEqual({0}, set(switcher.subscriptions['program-bus-input'].keys()))
+
+    def test_async(self):
+        async def run():
+            switcher = self._switcher(AsyncAtemProtocol)
+            future = switcher.send_command_confirmed(AuxSourceCommand(index=1, source=4))
+            asyncio.get_running_loop().call_soon(switcher._process_packet,
+                                                 make_packet((b'AuxS', struct.pack('>BxH', 1, 4))))
+            return await asyncio.wait_for(future, 5)
+
+        self.assertGreaterEqual(asyncio.run(run()), 0)
+
+    def test_async_other_thread(self):
+        # Commands are sent from a thread that doesn't run the event loop of the switcher
+        switcher = self._switcher(AsyncAtemProtocol)
+        switcher.command_window = 0.01
+        sent = threading.Event()
+        switcher.send_raw = lambda data: sent.set()
+        switcher.event_loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=switcher.event_loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            switcher.send_commands([TransitionPositionCommand(index=0, position=100)])
+            self.assertTrue(sent.wait(5))
+
+            future = switcher.send_command_confirmed(CutCommand(index=0), field='program-bus-input', timeout=0.01)
+            done = threading.Event()
+            switcher.event_loop.call_soon_threadsafe(future.add_done_callback, lambda f: done.set())
+            self.assertTrue(done.wait(5))
+            self.assertIsInstance(future.exception(), TimeoutError)
+            self.assertEqual({}, switcher.awaiting)
+        finally:
+            switcher.event_loop.call_soon_threadsafe(switcher.event_loop.stop)
+            thread.join()
+            switcher.event_loop.close()
+
+
+class TestDownload(TestCase):
+    def setUp(self):
+        self.switcher = AtemProtocol('127.0.0.1')
+        self.switcher.send_raw = lambda data: None
+        self.switcher.locks[0] = True
+        # 720p50, a frame is 1280 * 720 * 4 bytes
+        self.switcher._process_packet(make_packet((b'VidM', b'\x04\x00\x00\x00')))
+        self.frame = bytes(range(256)) * 7200 + b'\x10\x20\x30\x40' * 460800
+        self.done = []
+        self.switcher.on('download-done', lambda store, slot, data: self.done.append((store, slot, data)))
+
+    def _transfer(self):
+        tid = self.switcher.transfers[0].tid
+        compressed = rle_encode(self.frame)
+        for i in range(0, len(compressed), 1336):
+            chunk = compressed[i:i + 1336]
+            self.switcher._process_packet(make_packet((b'FTDa', struct.pack('>HH', tid, len(chunk)) + chunk)))
+        self.switcher._process_packet(make_packet((b'FTDC', struct.pack('>HBB', tid, 0, 0))))
+
+    def test_download(self):
+        self.switcher.download(0, 3)
+        self.assertEqual(len(self.frame), len(self.switcher.transfers[0].buffer.buffer))
+        self._transfer()
+        self.assertEqual([(0, 3, self.frame)], self.done)
+
+    def test_stream(self):
+        output = io.BytesIO()
+        self.switcher.download(0, 3, output=output)
+        self._transfer()
+        self.assertEqual([(0, 3, None)], self.done)
+        self.assertEqual(self.frame, output.getvalue())
+
+    def test_cached(self):
+        with tempfile.TemporaryDirectory() as path:
+            self.switcher.media_cache = MediaCache(path)
+            self.switcher.download(0, 3)
+            self._transfer()
+            self.switcher.media_cache.flush()
+            self.assertIn(hashlib.md5(self.frame).digest(), self.switcher.media_cache)
+
+            # The slot reports the hash of the downloaded frame, the next download doesn't need the hardware
+            info = struct.pack('>Bx H ? 16s 2x', 0, 3, True, hashlib.md5(self.frame).digest()) + b'\x04test'
+            self.switcher._process_packet(make_packet((b'MPfe', info)))
+            calls = []
+            self.switcher._call_soon = calls.append
+            self.switcher.download(0, 3)
+            self.switcher.media_cache.flush()
+
+            # The frame is read by the cache thread and the event is raised from the loop, like for a download
+            # from the hardware
+            self.assertEqual(1, len(self.done))
+            self.assertEqual(1, len(calls))
+            calls[0]()
+            self.assertEqual((0, 3, self.frame), self.done[-1])
+            self.assertEqual(2, len(self.done))
+            self.assertEqual(1, self.switcher.media_cache.hits)
+            self.assertNotIn(0, self.switcher.transfers)
+
+    def test_cache_evicted(self):
+        with tempfile.TemporaryDirectory() as path:
+            self.switcher.media_cache = MediaCache(path)
+            self.switcher.media_cache.put(frame=self.frame)
+            info = struct.pack('>Bx H ? 16s 2x', 0, 3, True, hashlib.md5(self.frame).digest()) + b'\x04test'
+            self.switcher._process_packet(make_packet((b'MPfe', info)))
+            calls = []
+            self.switcher._call_soon = calls.append
+
+            # The frame can't be read anymore, the download falls back to the hardware
+            for name in os.listdir(path):
+                os.unlink(os.path.join(path, name))
+            self.switcher.download(0, 3)
+            self.switcher.media_cache.flush()
+            calls[0]()
+            self.assertEqual([], self.done)
+            self._transfer()
+            self.assertEqual([(0, 3, self.frame)], self.done)
+
+
+class TestUpload(TestCase):
+    def test_chunks(self):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.send_raw = lambda data: None
+        switcher.locks[0] = True
+        chunks = []
+        switcher.transport.queue_packet = lambda packet: chunks.append(bytes(packet.data[12:]))
+        switcher.transport.queue_trigger = lambda: None
+
+        frame = (bytes(range(256)) * 4 + b'\x01' * 80) * 40
+        switcher.upload(0, 2, frame)
+        compressed = rle_encode(frame)
+        while switcher.transfers[0].remaining():
+            tid = switcher.transfers[0].tid
+            switcher._process_packet(make_packet((b'FTCD', struct.pack('>H 4x HH 2x', tid, 1000, 4))))
+
+        self.assertEqual(compressed, b''.join(chunks))
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in chunks))
+        # Every chunk can be decoded on its own, no RLE sequence is split over two chunks
+        self.assertEqual(frame, b''.join(rle_decode(chunk) for chunk in chunks))
+
+    def test_retry(self):
+        switcher = AtemProtocol('127.0.0.1')
+        commands = []
+        switcher.send_raw = lambda data: commands.extend(code for code, _ in switcher.decode_packet(data))
+        switcher.locks[0] = True
+        switcher.locks[1] = True
+        switcher.transport.queue_trigger = lambda: None
+
+        switcher.upload(0, 2, bytes(range(256)) * 40)
+        switcher.upload(1, 0, bytes(range(256)) * 40)
+        still, clip = switcher.transfers[0], switcher.transfers[1]
+        switcher._process_packet(make_packet((b'FTCD', struct.pack('>H 4x HH 2x', still.tid, 1000, 3))))
+        switcher._process_packet(make_packet((b'FTCD', struct.pack('>H 4x HH 2x', clip.tid, 1000, 2))))
+        self.assertEqual(5, len(switcher.transport.send_queue))
+
+        # The still upload is retried with the same transfer id, only the chunks of the clip are left in the queue
+        switcher._process_packet(make_packet((b'FTDE', struct.pack('>HBx', still.tid, 1))))
+        self.assertEqual(still.tid, switcher.transfers[0].tid)
+        self.assertEqual(b'FTSD', commands[-1])
+        send_queue = switcher.transport.send_queue
+        self.assertEqual([clip.tid, clip.tid], [struct.unpack_from('>H', p.data, 8)[0] for p in send_queue])
+        self.assertEqual([clip, clip], [task for task, size in switcher.queued_chunks])
+
+        # A disconnect drops everything that was not sent yet
+        switcher._process_packet(None)
+        self.assertEqual(0, len(send_queue))
+        self.assertEqual(0, len(switcher.queued_chunks))
+
+    def test_concurrent(self):
+        switcher = AtemProtocol('127.0.0.1')
+        commands = []
+        switcher.send_raw = lambda data: commands.extend(code for code, _ in switcher.decode_packet(data))
+        switcher.locks[0] = True
+        switcher.locks[1] = True
+        switcher.transfer_window = 1
+        switcher.transport.queue_trigger = lambda: None
+
+        switcher.upload(0, 2, bytes(range(256)) * 40)
+        switcher.upload(1, 0, bytes(range(256)) * 40)
+        switcher.download(0xffff, 3)
+        switcher.upload(0, 3, bytes(range(256)) * 40)
+
+        # One transfer per store is started right away, the second still waits for the first
+        self.assertEqual([b'FTSD', b'FTSD', b'FTSU'], commands)
+        still, clip, macro = switcher.transfers[0].tid, switcher.transfers[1].tid, switcher.transfers[0xffff].tid
+        self.assertEqual(3, len({still, clip, macro}))
+
+        # Both uploads share the link, the chunks are interleaved within the budget of each upload
+        switcher._process_packet(make_packet((b'FTCD', struct.pack('>H 4x HH 2x', still, 1000, 3))))
+        switcher._process_packet(make_packet((b'FTCD', struct.pack('>H 4x HH 2x', clip, 1000, 2))))
+        sent = []
+        send_queue = switcher.transport.send_queue
+        while len(send_queue) > 0:
+            packet = send_queue.popleft()
+            sent.append(struct.unpack_from('>H', packet.data, 8)[0])
+            switcher.queue_callback(len(send_queue), len(packet.data) - 4)
+        self.assertEqual([still, still, clip, still, clip], sent)
+        # The progress of every upload only counts its own chunks
+        self.assertEqual(2000, switcher.transfers[1].send_done)
+
+        switcher._process_packet(make_packet((b'FTDC', struct.pack('>HBB', still, 0, 0))))
+        self.assertEqual(b'FTSD', commands[-1])
+        self.assertNotEqual(still, switcher.transfers[0].tid)
+        self.assertEqual(clip, switcher.transfers[1].tid)
+
+    def test_unchanged(self):
+        switcher = AtemProtocol('127.0.0.1')
+        commands = []
+        switcher.send_raw = lambda data: commands.extend(code for code, _ in switcher.decode_packet(data))
+        switcher.locks[0] = True
+        done = []
+        switcher.on('upload-done', lambda store, slot: done.append((store, slot)))
+        frame = bytes(range(256)) * 40
+        info = struct.pack('>Bx H ? 16s 2x', 0, 2, True, hashlib.md5(frame).digest()) + b'\x04test'
+        switcher._process_packet(make_packet((b'MPfe', info)))
+
+        with tempfile.TemporaryDirectory() as path:
+            switcher.media_cache = MediaCache(path)
+            # Same content and name as the slot already has
+            switcher.upload(0, 2, frame, name='test')
+            self.assertEqual([(0, 2)], done)
+            self.assertEqual([], commands)
+
+            # A different name still needs the upload for the metadata
+            switcher.upload(0, 2, frame, name='other')
+            self.assertEqual([b'FTSD'], commands)
+            # The compressed frame is stored for the next upload of the same content
+            switcher.media_cache.flush()
+            self.assertEqual(rle_encode(frame), switcher.media_cache.get_compressed(hashlib.md5(frame).digest()))
+
+    def test_cached_compressed(self):
+        switcher = AtemProtocol('127.0.0.1')
+        commands = []
+        switcher.send_raw = lambda data: commands.extend(code for code, _ in switcher.decode_packet(data))
+        switcher.locks[0] = True
+        calls = []
+        switcher._call_soon = calls.append
+        frame = bytearray(bytes(range(256)) * 40)
+
+        with tempfile.TemporaryDirectory() as path:
+            switcher.media_cache = MediaCache(path)
+            switcher.upload(0, 2, frame)
+            # The caller can reuse its buffer while the cache is still writing
+            frame[:4] = b'\xff' * 4
+            switcher.media_cache.flush()
+            digest = hashlib.md5(bytes(range(256)) * 40).digest()
+            self.assertEqual(bytes(range(256)) * 40, switcher.media_cache.get(digest))
+
+            # The compressed frame is read from the cache in the background, the upload continues from the loop
+            del switcher.transfers[0]
+            switcher.transfer_queue[0] = []
+            switcher.upload(0, 3, bytes(range(256)) * 40)
+            self.assertEqual([b'FTSD'], commands)
+            switcher.media_cache.flush()
+            self.assertEqual(1, len(calls))
+            calls[0]()
+            self.assertEqual([b'FTSD', b'FTSD'], commands)
+            self.assertEqual(rle_encode(bytes(range(256)) * 40), switcher.transfers[0].data)
+
+    def test_unchanged_description(self):
+        switcher = AtemProtocol('127.0.0.1')
+        commands = []
+        switcher.send_raw = lambda data: commands.extend(code for code, _ in switcher.decode_packet(data))
+        switcher.locks[0] = True
+        done = []
+        switcher.on('upload-done', lambda store, slot: done.append((store, slot)))
+        frame = bytes(range(256)) * 40
+        info = struct.pack('>Bx H ? 16s 2x', 0, 2, True, hashlib.md5(frame).digest()) + b'\x04test'
+        switcher._process_packet(make_packet((b'MPfe', info)))
+
+        with tempfile.TemporaryDirectory() as path:
+            switcher.media_cache = MediaCache(path)
+            # The hardware doesn't report the description, it can't be known to be the same
+            switcher.upload(0, 2, frame, name='test', description='first')
+            self.assertEqual([b'FTSD'], commands)
+            tid = switcher.transfers[0].tid
+            switcher._process_packet(make_packet((b'FTDC', struct.pack('>HBB', tid, 0, 0))))
+            self.assertEqual([(0, 2)], done)
+
+            # After uploading it the description is known
+            switcher.upload(0, 2, frame, name='test', description='first')
+            self.assertEqual([(0, 2), (0, 2)], done)
+            self.assertEqual(1, commands.count(b'FTSD'))
+
+            # The compressed frame is in the cache now, run the upload from the cache right away
+            switcher.media_cache.flush()
+            switcher._call_soon = lambda callback: callback()
+            switcher.locks[0] = True
+            switcher.upload(0, 2, frame, name='test', description='second')
+            switcher.media_cache.flush()
+            self.assertEqual(2, len(done))
+            self.assertEqual(2, commands.count(b'FTSD'))
+            switcher.media_cache.flush()
+
+    def _stream(self, source, frames):
+        switcher = AtemProtocol('127.0.0.1')
+        commands = []
+        switcher.send_raw = lambda data: commands.extend((code, bytes(raw)) for code, raw in switcher.decode_packet(data))
+        switcher.locks[1] = True
+        chunks = []
+        buffered = []
+        switcher.transport.queue_packet = lambda packet: chunks.append(bytes(packet.data[12:]))
+        switcher.transport.queue_trigger = lambda: None
+
+        switcher.upload_stream(1, 0, source, 64, 32, frames=frames, name='clip')
+        uploaded = []
+        for i in range(frames):
+            task = switcher.transfers[1]
+            self.assertEqual(i, task.slot)
+            while task.remaining():
+                switcher._process_packet(make_packet((b'FTCD', struct.pack('>H 4x HH 2x', task.tid, 1000, 4))))
+                buffered.append(len(task.data))
+            switcher._queue_flushed()
+            ftfd = [raw for code, raw in commands if code == b'FTFD'][-1]
+            self.assertEqual(task.hash, ftfd[194:210])
+            uploaded.append((task.hash, b''.join(chunks)))
+            chunks.clear()
+            switcher._process_packet(make_packet((b'FTDC', struct.pack('>HBB', task.tid, 0, 0))))
+        return uploaded, max(buffered)
+
+    def test_stream(self):
+        frames = [bytes([i, 255 - i, 128, 255]) * 64 * 16 + bytes(range(256)) * 16 for i in range(2)]
+        expected = [rgb_to_atem(frame, 64, 32) for frame in frames]
+
+        # Rows, frames or a file all give the same result
+        rows = [frame[i:i + 256] for frame in frames for i in range(0, len(frame), 256)]
+        sources = [rows, frames, io.BytesIO(b''.join(frames))]
+        for source in sources:
+            with patch.object(UploadStream, 'BLOCK_SIZE', 1024):
+                uploaded, buffered = self._stream(source, 2)
+            # Only a block and a chunk of compressed data are buffered at a time
+            self.assertLess(buffered, 2048)
+            for (digest, data), frame in zip(uploaded, expected):
+                self.assertEqual(hashlib.md5(frame).digest(), digest)
+                self.assertEqual(frame, rle_decode(data))
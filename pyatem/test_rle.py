@@ -3,7 +3,7 @@
 from unittest import TestCase
 
 from pyatem.hexdump import hexdump
-from pyatem.media import rle_decode, rle_encode
+from pyatem.media import rle_decode, rle_decode_slow, rle_encode, RleDecoder
 
 
 class Test(TestCase):
@@ -67,3 +67,34 @@ class Test(TestCase):
         testdata += b'\x02\x02\x02\x02\x02\x02\x02\x02'
         testdata += b'\x02\x02\x02\x02\x02\x02\x02\x02'
         self._rle_loop_check('third block', testdata)
+
+    def test_rle_decoder_chunks(self):
+        testdata = bytes(range(256)) * 10 + b'\x01' * 8 * 100 + b'\x02' * 8 * 3 + bytes(range(64))
+        compressed = rle_encode(testdata)
+        for chunk_size in [1, 7, 8, 16, 24, 100, 1000]:
+            result = bytearray()
+            decoder = RleDecoder(result.extend)
+            for i in range(0, len(compressed), chunk_size):
+                decoder.feed(compressed[i:i + chunk_size])
+            decoder.finish()
+            self.assertEqual(rle_decode(compressed), result, f'chunk size {chunk_size}')
+
+    def test_rle_decode_native(self):
+        testdata = bytes(range(256)) * 10 + b'\x01' * 8 * 100 + b'\x02' * 8 * 3 + bytes(range(64))
+        compressed = rle_encode(testdata)
+        self.assertEqual(rle_decode_slow(compressed), rle_decode(compressed))
+        self.assertEqual(testdata, rle_decode(memoryview(compressed)))
+        # Data that is not a multiple of 8 bytes is kept as is at the end
+        self.assertEqual(rle_decode_slow(compressed + b'abc'), rle_decode(compressed + b'abc'))
+
+    def test_rle_decode_output(self):
+        testdata = b'\x01' * 8 * 100 + bytes(range(64))
+        compressed = rle_encode(testdata)
+        output = bytearray(len(testdata) + 8)
+        self.assertEqual(len(testdata), rle_decode(compressed, output))
+        self.assertEqual(testdata, output[:len(testdata)])
+
+        with self.assertRaises(ValueError):
+            rle_decode(compressed, bytearray(100))
+        with self.assertRaises(ValueError):
+            rle_decode(compressed[:20])
@@ -0,0 +1,84 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+from unittest import TestCase
+
+from pyatem.state import StateStore
+
+
+class TestStateStore(TestCase):
+    def test_nested_view(self):
+        state = StateStore()
+        state.set('video-mode', None, 'mode')
+        state.set('program-bus-input', (0,), 'me1')
+        state.set('program-bus-input', (1,), 'me2')
+        state.set('multiviewer-input', (0, 3), 'window')
+        state.set('program-bus-input', (0,), 'me1-new')
+
+        self.assertEqual({
+            'video-mode': 'mode',
+            'program-bus-input': {0: 'me1-new', 1: 'me2'},
+            'multiviewer-input': {0: {3: 'window'}},
+        }, state)
+        self.assertEqual((5, 'me1-new'), state.entry(('program-bus-input', 0)))
+        self.assertIsNone(state.entry(('program-bus-input', 2)))
+        self.assertEqual(1, state.version(('video-mode',)))
+        self.assertIsNone(state.version(('aux-output-source', 0)))
+
+    def test_changes_since(self):
+        state = StateStore()
+        state.set('program-bus-input', (0,), 'a')
+        state.set('preview-bus-input', (0,), 'b')
+        seq = state.seq
+        state.set('program-bus-input', (1,), 'c')
+        state.set('program-bus-input', (0,), 'd')
+        state.set('program-bus-input', (0,), 'e')
+        state.remove(('preview-bus-input', 0))
+
+        self.assertEqual((6, False, [
+            (('program-bus-input', 1), 3, 'c'),
+            (('program-bus-input', 0), 5, 'e'),
+            (('preview-bus-input', 0), 6, None),
+        ]), state.changes_since(seq))
+        self.assertEqual((6, False, []), state.changes_since(state.seq))
+
+    def test_snapshot(self):
+        state = StateStore(journal_size=4)
+        for i in range(6):
+            state.set('program-bus-input', (i % 3,), i)
+
+        # The journal only has the last 4 changes
+        self.assertEqual((6, False, [(('program-bus-input', 2), 6, 5)]), state.changes_since(5))
+        self.assertFalse(state.changes_since(2)[1])
+        seq, snapshot, changes = state.changes_since(1)
+        self.assertTrue(snapshot)
+        self.assertEqual([
+            (('program-bus-input', 0), 4, 3),
+            (('program-bus-input', 1), 5, 4),
+            (('program-bus-input', 2), 6, 5),
+        ], changes)
+
+        # Sequence numbers from the future come from a different state
+        self.assertTrue(state.changes_since(100)[1])
+
+        state.clear()
+        state.set('video-mode', None, 'mode')
+        self.assertEqual((8, True, [(('video-mode',), 8, 'mode')]), state.changes_since(seq))
+        self.assertEqual((8, False, [(('video-mode',), 8, 'mode')]), state.changes_since(7))
+
+    def test_remove(self):
+        state = StateStore()
+        state.set('video-mode', None, 'mode')
+        state.set('multiviewer-input', (0, 3), 'window')
+        state.remove(('multiviewer-input', 0, 3))
+        state.remove(('video-mode',))
+        state.remove(('aux-output-source', 0))
+
+        self.assertEqual({'multiviewer-input': {0: {}}}, state)
+        self.assertEqual({'multiviewer-input': {0: {}}}, state.versions)
+        self.assertEqual(4, state.seq)
+
+        state.set('video-mode', None, 'mode')
+        state.clear()
+        self.assertEqual({}, state)
+        self.assertEqual({}, state.versions)
+        self.assertGreater(state.seq, 5)
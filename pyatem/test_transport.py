@@ -0,0 +1,399 @@
+# Copyright 2022 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
+import socket
+import struct
+import threading
+import time
+from unittest import TestCase, skipIf
+
+from pyatem.protocol import AsyncAtemProtocol
+from pyatem.socketqueue import SocketQueue
+from pyatem.transport import Packet, UdpProtocol, RetransmissionBuffer, CongestionWindow, ReceiveBuffer, \
+    ConnectionLost, MSG_DONTWAIT, AsyncUdpProtocol
+
+
+def make_field(code, data):
+    return struct.pack('!H2x 4s', len(data) + 8, code) + data
+
+
+class FakeMixer(asyncio.DatagramProtocol):
+    """
+    Minimal UDP endpoint that performs the handshake and sends a tiny initial state
+    """
+    SESSION = 0x8001
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.endpoint = None
+        self.sequence = 0
+        self.received = []
+        self.handshake = False
+
+    def connection_made(self, transport):
+        self.endpoint = transport
+
+    def send(self, addr, flags, data=b'', session=None):
+        packet = Packet()
+        packet.flags = flags
+        packet.session = session or self.SESSION
+        if not flags & UdpProtocol.FLAG_SYN:
+            self.sequence += 1
+            packet.sequence_number = self.sequence
+        packet.data = data
+        self.endpoint.sendto(packet.to_bytes(), addr)
+
+    def datagram_received(self, data, addr):
+        packet = Packet.from_bytes(data)
+        self.received.append(packet)
+        if packet.flags & UdpProtocol.FLAG_SYN:
+            self.sequence = 0
+            self.handshake = True
+            self.send(addr, UdpProtocol.FLAG_SYN, b'\x02\x00\x00\x00\x00\x00\x00\x00', session=packet.session)
+        elif packet.flags & UdpProtocol.FLAG_ACK and self.handshake:
+            self.handshake = False
+            self.send(addr, UdpProtocol.FLAG_ACK)
+            self.send(addr, UdpProtocol.FLAG_RELIABLE, b''.join(self.fields) + make_field(b'InCm', b'\0\0\0\0'))
+            self.send(addr, UdpProtocol.FLAG_ACK)
+
+
+class TestPacket(TestCase):
+    def test_roundtrip(self):
+        packet = Packet()
+        packet.flags = UdpProtocol.FLAG_RELIABLE
+        packet.session = 0x8001
+        packet.sequence_number = 42
+        packet.data = make_field(b'PrgI', b'\x00\x00\x00\x05')
+        raw = packet.to_bytes()
+        self.assertEqual(24, len(raw))
+
+        parsed = Packet.from_bytes(raw)
+        self.assertIsInstance(parsed.data, memoryview)
+        self.assertEqual(packet.data, bytes(parsed.data))
+        self.assertEqual(42, parsed.sequence_number)
+        self.assertEqual(0x8001, parsed.session)
+
+    def test_receive_buffer(self):
+        rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rx.bind(('127.0.0.1', 0))
+        tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        buffer = ReceiveBuffer(size=4096)
+        received = []
+        for i in range(8):
+            tx.sendto(bytes([i]) * 1000, rx.getsockname())
+            data, address = buffer.receive(rx)
+            received.append(data)
+        rx.close()
+        tx.close()
+
+        # Earlier views stay valid after the arena has been replaced
+        for i, data in enumerate(received):
+            self.assertEqual(bytes([i]) * 1000, bytes(data))
+
+    @skipIf(not MSG_DONTWAIT, 'MSG_DONTWAIT is not available')
+    def test_receive_drain(self):
+        # The socket stays blocking for sends, draining the received datagrams doesn't wait for more
+        rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rx.bind(('127.0.0.1', 0))
+        rx.setblocking(True)
+        tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        buffer = ReceiveBuffer()
+        for i in range(2):
+            tx.sendto(bytes([i]) * 10, rx.getsockname())
+        time.sleep(0.05)
+        received = [bytes(buffer.receive(rx, MSG_DONTWAIT)[0]) for i in range(2)]
+        with self.assertRaises(BlockingIOError):
+            buffer.receive(rx, MSG_DONTWAIT)
+        rx.close()
+        tx.close()
+        self.assertEqual([b'\x00' * 10, b'\x01' * 10], received)
+
+
+class TestAsyncProtocol(TestCase):
+    async def _connect(self, count):
+        loop = asyncio.get_running_loop()
+        mixers = []
+        switchers = []
+        for i in range(count):
+            mixer = FakeMixer([
+                make_field(b'_ver', struct.pack('>HH', 2, 30)),
+                make_field(b'PrgI', struct.pack('>BxH', 0, i + 1)),
+            ])
+            transport, _ = await loop.create_datagram_endpoint(lambda: mixer, local_addr=('127.0.0.1', 0))
+            mixers.append(transport)
+            switcher = AsyncAtemProtocol('127.0.0.1', transport.get_extra_info('sockname')[1])
+            switchers.append(switcher)
+
+        await asyncio.wait_for(asyncio.gather(*[s.connect() for s in switchers]), 5)
+        result = [s.mixerstate['program-bus-input'][0].source for s in switchers]
+        for switcher in switchers:
+            switcher.close()
+        for transport in mixers:
+            transport.close()
+        return result
+
+    def test_connect_many(self):
+        result = asyncio.run(self._connect(4))
+        self.assertEqual([1, 2, 3, 4], result)
+
+    async def _changes(self):
+        loop = asyncio.get_running_loop()
+        mixer = FakeMixer([make_field(b'PrgI', struct.pack('>BxH', 0, 5))])
+        transport, _ = await loop.create_datagram_endpoint(lambda: mixer, local_addr=('127.0.0.1', 0))
+        switcher = AsyncAtemProtocol('127.0.0.1', transport.get_extra_info('sockname')[1])
+        changes = switcher.changes()
+        pending = asyncio.ensure_future(changes.__anext__())
+        await switcher.connect(wait=False)
+        key, contents = await asyncio.wait_for(pending, 5)
+        await changes.aclose()
+        switcher.close()
+        transport.close()
+        return key, contents
+
+    def test_changes(self):
+        key, contents = asyncio.run(self._changes())
+        self.assertEqual('program-bus-input', key)
+        self.assertEqual(5, contents.source)
+
+
+class TestReconnect(TestCase):
+    async def _reconnect(self):
+        loop = asyncio.get_running_loop()
+        mixer = FakeMixer([
+            make_field(b'PrgI', struct.pack('>BxH', 0, 1)),
+            make_field(b'PrgI', struct.pack('>BxH', 1, 2)),
+        ])
+        transport, _ = await loop.create_datagram_endpoint(lambda: mixer, local_addr=('127.0.0.1', 0))
+        switcher = AsyncAtemProtocol('127.0.0.1', transport.get_extra_info('sockname')[1])
+        switcher.fast_reconnect = True
+        # The fake mixer sends nothing after the initial sync so the connection times out
+        switcher.transport.TIMEOUT = 0.2
+        events = []
+        resynced = loop.create_future()
+        switcher.on('disconnected', lambda: events.append('disconnected'))
+        switcher.on('change', lambda key, contents: events.append(key))
+        switcher.on('resynced', lambda: resynced.done() or resynced.set_result(True))
+        await asyncio.wait_for(switcher.connect(), 5)
+
+        # The state after reconnecting has one changed field and one field less
+        mixer.fields = [make_field(b'PrgI', struct.pack('>BxH', 0, 3))]
+        events.clear()
+        await asyncio.wait_for(resynced, 5)
+        state = {index: field.source for index, field in switcher.mixerstate['program-bus-input'].items()}
+        switcher.close()
+        transport.close()
+        return events, state
+
+    def test_timeout(self):
+        events, state = asyncio.run(self._reconnect())
+        self.assertEqual(['disconnected', 'program-bus-input', 'InCm'], events)
+        self.assertEqual({0: 3}, state)
+
+    def test_send_error(self):
+        class Endpoint:
+            def __init__(self, protocol):
+                self.protocol = protocol
+                self.fail = False
+
+            def is_closing(self):
+                return False
+
+            def sendto(self, raw):
+                if self.fail:
+                    self.protocol.error_received(OSError("No buffer space available"))
+
+        transport = AsyncUdpProtocol('127.0.0.1')
+        transport.session_id = 0x8001
+        transport.state = UdpProtocol.STATE_ESTABLISHED
+        transport.had_traffic = True
+        lost = []
+        transport.packet_callback = lost.append
+        transport.endpoint = Endpoint(transport)
+        for fail in (False, True, False):
+            transport.endpoint.fail = fail
+            packet = Packet()
+            packet.flags = UdpProtocol.FLAG_RELIABLE
+            packet.data = b'\x00' * 8
+            transport._send_packet(packet)
+
+        # Only the packets that were sent are counted, the failed one signals the upper layer
+        self.assertEqual(2, transport.packet_sucess)
+        self.assertEqual(2, transport.metrics.snapshot()['packets_out'])
+        self.assertEqual([None], lost)
+
+
+class RecordingUdpProtocol(UdpProtocol):
+    """
+    UDP transport without socket or thread that records the datagrams it would send
+    """
+
+    def _setup_io(self):
+        self.sent = []
+
+    def _send_packet(self, packet):
+        self._send_packet_low(packet)
+
+    def _sendto(self, raw):
+        self.sent.append(bytes(raw))
+
+
+class TestRetransmission(TestCase):
+    def _transport(self, packets):
+        transport = RecordingUdpProtocol('127.0.0.1')
+        transport.local_sequence_number = 0
+        transport.session_id = 0x8001
+        transport.enable_ack = True
+        for i in range(packets):
+            packet = Packet()
+            packet.flags = UdpProtocol.FLAG_RELIABLE
+            packet.data = bytes([i % 256]) * 8
+            transport._send_packet(packet)
+        transport.sent = []
+        return transport
+
+    def _request(self, sequence):
+        raw = bytearray(Packet().to_bytes())
+        raw[0] |= UdpProtocol.FLAG_REQUEST_RETRANSMISSION << 3
+        raw[6:8] = sequence.to_bytes(2, 'big')
+        return bytes(raw)
+
+    def test_buffer_wraps(self):
+        buffer = RetransmissionBuffer(size=4)
+        for i in range(2 ** 16 - 2, 2 ** 16 + 3):
+            buffer.store(i % 2 ** 16, i)
+        self.assertIsNone(buffer.get(2 ** 16 - 2))
+        self.assertEqual([2 ** 16 - 1, 2 ** 16, 2 ** 16 + 1, 2 ** 16 + 2], buffer.get_range(2 ** 16 - 1, 2))
+        self.assertIsNone(buffer.get_range(2 ** 16 - 2, 2))
+
+    def test_resend_requested(self):
+        transport = self._transport(10)
+        transport._process_datagram(self._request(8))
+        self.assertEqual(3, len(transport.sent))
+        resent = [Packet.from_bytes(raw) for raw in transport.sent]
+        self.assertEqual([8, 9, 10], [p.sequence_number for p in resent])
+        for packet in resent:
+            self.assertTrue(packet.flags & UdpProtocol.FLAG_RETRANSMISSION)
+            self.assertTrue(packet.flags & UdpProtocol.FLAG_RELIABLE)
+        self.assertEqual(bytes([7]) * 8, bytes(resent[0].data))
+        self.assertEqual(1, transport.retransmission_buffer.requested)
+        self.assertEqual(3, transport.retransmission_buffer.resent)
+        self.assertEqual(1, transport.metrics.retransmission_requests)
+        self.assertEqual(3, transport.metrics.retransmissions_sent)
+
+    def test_resend_evicted(self):
+        transport = self._transport(2000)
+        transport._process_datagram(self._request(5))
+        self.assertEqual([], transport.sent)
+        self.assertEqual(1, transport.retransmission_buffer.missed)
+
+
+class TestCongestionWindow(TestCase):
+    def test_grow_and_backoff(self):
+        window = CongestionWindow(initial=4)
+        self.assertEqual(4, window.available())
+        for i in range(1, 5):
+            window.sent(i, 1000)
+        self.assertEqual(0, window.available())
+
+        # Cumulative ACK for all four packets
+        window.acknowledge(4)
+        self.assertEqual(8, window.available())
+        self.assertIsNotNone(window.rtt)
+
+        window.loss()
+        self.assertEqual(4, window.available())
+
+        # After a loss the window grows linearly instead of doubling
+        for i in range(5, 9):
+            window.sent(i, 1000)
+        window.acknowledge(8)
+        self.assertLess(window.size, 6)
+
+    def test_reserved(self):
+        window = CongestionWindow(initial=4)
+        window.reserve(3)
+        self.assertEqual(1, window.available())
+        window.sent(1, 100, reserved=True)
+        self.assertEqual(1, window.available())
+        # Commands and other packets that were not queued don't use up a reservation
+        window.sent(2, 100)
+        self.assertEqual(0, window.available())
+
+    def test_unacknowledged_expire(self):
+        window = CongestionWindow(initial=4, timeout=0)
+        for i in range(1, 5):
+            window.sent(i, 1000)
+        self.assertEqual(2, window.available())
+
+    def test_transport_ack(self):
+        transport = RecordingUdpProtocol('127.0.0.1')
+        transport.local_sequence_number = 0
+        transport.session_id = 0x8001
+        transport.enable_ack = True
+        for i in range(10):
+            packet = Packet()
+            packet.flags = UdpProtocol.FLAG_RELIABLE
+            packet.data = b'\0' * 8
+            transport.queue_packet(packet)
+        transport.queue_trigger()
+        self.assertEqual(4, len(transport.sent))
+
+        ack = Packet()
+        ack.flags = UdpProtocol.FLAG_ACK
+        ack.acknowledgement_number = 4
+        transport._process_datagram(ack.to_bytes())
+        transport.queue_trigger()
+        self.assertEqual(10, len(transport.sent))
+
+        metrics = transport.metrics.snapshot()
+        self.assertEqual(10, metrics['packets_out'])
+        self.assertEqual(1, metrics['packets_in'])
+        self.assertEqual(1, metrics['ack_rtt']['count'])
+
+
+class TestBatchedIO(TestCase):
+    def _datagram(self, sequence):
+        packet = Packet()
+        packet.flags = UdpProtocol.FLAG_RELIABLE
+        packet.session = 0x8001
+        packet.sequence_number = sequence
+        packet.data = make_field(b'PrgI', b'\x00\x00\x00\x05')
+        return packet.to_bytes()
+
+    def test_coalesced_ack(self):
+        transport = RecordingUdpProtocol('127.0.0.1')
+        transport.session_id = 0x8001
+        transport.enable_ack = True
+        transport.ack_batching = True
+        for i in range(1, 21):
+            transport._process_datagram(self._datagram(i))
+        transport._flush_ack()
+
+        # One ACK after ACK_BATCH_SIZE packets and one for the rest of the batch
+        acks = [Packet.from_bytes(raw) for raw in transport.sent]
+        self.assertEqual([16, 20], [p.acknowledgement_number for p in acks])
+
+    def test_timeout(self):
+        transport = RecordingUdpProtocol('127.0.0.1')
+        transport.thread = threading.Thread()
+        transport.state = UdpProtocol.STATE_ESTABLISHED
+        transport.receive_buffer = ReceiveBuffer()
+        transport.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        transport.sock.bind(('127.0.0.1', 0))
+        transport.sock.settimeout(0.01)
+
+        # A receive timeout restarts the handshake and tells the protocol the connection was lost
+        result = transport._handle_packet(transport._receive_packet_low())
+        transport.sock.close()
+        self.assertIsInstance(result, ConnectionLost)
+        self.assertEqual(UdpProtocol.STATE_SYN_SENT, transport.state)
+        self.assertTrue(Packet.from_bytes(transport.sent[-1]).flags & UdpProtocol.FLAG_SYN)
+
+    def test_socketqueue_get_all(self):
+        queue = SocketQueue()
+        for i in range(5):
+            queue.put(i)
+        self.assertEqual([0, 1, 2, 3, 4], queue.get_all())
+        self.assertEqual([], queue.get_all())
+        queue.put(5)
+        self.assertEqual(5, queue.get())
@@ -1,9 +1,11 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import bisect
+import collections
 import hashlib
 import struct
 
-from pyatem.media import rle_encode
+from pyatem.media import rle_encode, rle_sequences, rgb_to_atem, RleDecoder
 
 
 class TransferTask:
@@ -21,10 +23,26 @@ class TransferTask:
 
         self.send_length = None
         self.send_done = 0
+        self.window = None
+        self.throughput = None
 
         self.name = None
         self.description = None
 
+        self.output = None
+        self.stream = None
+
+        self.offset = 0
+        self.sequences = None
+        self.view = None
+
+        # State of the running transfer
+        self.requested = False
+        self.budget = None
+        self.packets = 0
+        self.buffer = None
+        self.metadata_sent = False
+
     def calculate_hash(self):
         hasher = hashlib.md5(self.data)
         self.hash = hasher.digest()
@@ -35,6 +53,75 @@ class TransferTask:
         self.data = compressed
         self.send_length = len(self.data)
 
+    def start(self):
+        """
+        Prepare the data for sending it in chunks, this rewinds to the start of the data
+        """
+        self.offset = 0
+        if self.stream is not None:
+            if self.stream.consumed > 0:
+                raise ValueError("A streamed upload can't be restarted after sending started")
+            # Only the compressed data that has not been sent yet is kept
+            self.data = bytearray()
+            return
+        self.view = memoryview(self.data)
+        if self.sequences is None:
+            self.sequences = rle_sequences(self.data)
+
+    def _fill(self, size):
+        while len(self.data) < size and not self.stream.done:
+            self.data += self.stream.next_block()
+        if self.stream.done and self.hash is None:
+            self.hash = self.stream.hash
+
+    def remaining(self):
+        if self.stream is not None:
+            self._fill(1)
+            return len(self.data)
+        return len(self.data) - self.offset
+
+    def progress(self):
+        """
+        :return: Fraction of the upload that has been sent
+        """
+        if self.stream is not None:
+            return self.stream.consumed / self.stream.length
+        return self.send_done / self.send_length
+
+    def next_chunk(self, size):
+        """
+        Get the next chunk of the data to send. The chunk is shortened when it would end inside an RLE sequence.
+
+        :param size: Maximum size of the chunk
+        :return: memoryview of the chunk
+        """
+        if self.stream is not None:
+            return self._next_stream_chunk(size)
+        start = self.offset
+        end = start + size
+        if end >= len(self.data):
+            end = len(self.data)
+        else:
+            i = bisect.bisect_left(self.sequences, end)
+            if i > 0 and end - self.sequences[i - 1] < 24 and self.sequences[i - 1] > start:
+                end = self.sequences[i - 1]
+        self.offset = end
+        return self.view[start:end]
+
+    def _next_stream_chunk(self, size):
+        # The buffer always starts at the start of a raw block or RLE sequence, so the sequences can be found in it
+        self._fill(size + 24)
+        end = min(size, len(self.data))
+        if end < len(self.data):
+            sequences = rle_sequences(bytes(self.data[:end + 24]))
+            i = bisect.bisect_left(sequences, end)
+            if i > 0 and end - sequences[i - 1] < 24 and sequences[i - 1] > 0:
+                end = sequences[i - 1]
+        chunk = memoryview(bytes(self.data[:end]))
+        del self.data[:end]
+        self.offset += end
+        return chunk
+
     def __repr__(self):
         direction = 'upload' if self.upload else 'download'
         return f'<TransferTask {direction} store={self.store} slot={self.slot}>'
@@ -47,15 +134,10 @@ class TransferTask:
 
         # Large packets, let TCP fragmentation deal with it
         chunksize = 16000
-        buffer = self.data
+        view = memoryview(self.data)
         packets = []
-        while True:
-            chunk = buffer[0:chunksize]
-            buffer = buffer[chunksize:]
-            packet = header + chunk
-            packets.append((b'*XFR', packet))
-            if len(buffer) == 0:
-                break
+        for offset in range(0, max(len(view), 1), chunksize):
+            packets.append((b'*XFR', header + view[offset:offset + chunksize]))
         return packets
 
     @classmethod
@@ -73,6 +155,194 @@ class TransferTask:
         return self
 
 
+class DownloadBuffer:
+    """
+    Collects the chunks of a download. The buffer is allocated once for the expected size of the transfer and is
+    filled in place, compressed data is decoded as the chunks arrive. When an output is set the data is passed to
+    it instead of being stored, this can be a file-like object with a write() method or a function that gets called
+    with the bytes of every part.
+
+    :ivar expected: Expected size of the decoded data or None if unknown
+    :ivar received: Number of bytes received from the hardware
+    :ivar written: Number of bytes stored or passed to the output after decoding
+    """
+
+    def __init__(self, expected=None, compressed=False, output=None):
+        self.expected = expected
+        self.received = 0
+        self.written = 0
+        self.buffer = None
+        if output is None:
+            self.buffer = bytearray(expected or 0)
+            self._sink = self._store
+        elif hasattr(output, 'write'):
+            self._sink = output.write
+        else:
+            self._sink = lambda part: output(bytes(part))
+        self.decoder = RleDecoder(self._write) if compressed else None
+
+    def _store(self, part):
+        self.buffer[self.written:self.written + len(part)] = part
+
+    def _write(self, part):
+        self._sink(part)
+        self.written += len(part)
+
+    def feed(self, chunk):
+        self.received += len(chunk)
+        if self.decoder is not None:
+            self.decoder.feed(chunk)
+        else:
+            self._write(chunk)
+
+    def progress(self):
+        """
+        :return: Fraction of the expected data that has been written or None if the size is unknown
+        """
+        if not self.expected:
+            return None
+        return min(self.written / self.expected, 1.0)
+
+    def finish(self):
+        """
+        :return: The downloaded data or None when the data was passed to an output
+        """
+        if self.decoder is not None:
+            self.decoder.finish()
+        if self.buffer is None:
+            return None
+        del self.buffer[self.written:]
+        return self.buffer
+
+
+class FrameReader:
+    """
+    Reads RGBA data in blocks of any size from an iterable of bytes-like objects, like rows or complete frames, or
+    from a file-like object with a read() method.
+    """
+
+    def __init__(self, source):
+        self.file = source if hasattr(source, 'read') else None
+        self.pieces = iter(source) if self.file is None else None
+        self.piece = memoryview(b'')
+
+    def read(self, size):
+        """
+        :param size: Number of bytes to read
+        :return: Up to size bytes, less only when the source has ended
+        """
+        if self.file is not None:
+            result = self.file.read(size)
+            while 0 < len(result) < size:
+                more = self.file.read(size - len(result))
+                if not more:
+                    break
+                result += more
+            return result
+
+        result = bytearray()
+        while len(result) < size:
+            if len(self.piece) == 0:
+                piece = next(self.pieces, None)
+                if piece is None:
+                    break
+                self.piece = memoryview(piece).cast('B')
+                continue
+            take = size - len(result)
+            result += self.piece[:take]
+            self.piece = self.piece[take:]
+        return result
+
+
+class UploadStream:
+    """
+    Converts RGBA data to the ATEM format, hashes it and compresses it block by block while the upload is running,
+    so the frame never has to be in memory completely.
+
+    :ivar length: Size of the frame in bytes
+    :ivar consumed: Number of bytes of the frame that have been read from the source
+    :ivar done: The whole frame has been read
+    :ivar hash: MD5 hash of the frame in the ATEM format once the whole frame has been read
+    """
+
+    # Multiple of 8 bytes, the conversion and compression work on pairs of pixels
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, reader, width, height, premultiply=False):
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.premultiply = premultiply
+        self.length = width * height * 4
+        self.consumed = 0
+        self.done = False
+        self.hash = None
+        self.hasher = hashlib.md5()
+
+    def next_block(self):
+        """
+        :return: The next compressed block
+        """
+        size = min(self.BLOCK_SIZE, self.length - self.consumed)
+        data = self.reader.read(size)
+        if len(data) < size:
+            raise ValueError(f'The source ended after {self.consumed + len(data)} of {self.length} bytes')
+        data = rgb_to_atem(data, self.width, size // 4 // self.width or 1, self.premultiply)
+        self.hasher.update(data)
+        self.consumed += size
+        if self.consumed == self.length:
+            self.done = True
+            self.hash = self.hasher.digest()
+        return rle_encode(data)
+
+
+class TransferScheduler:
+    """
+    Shares the upload bandwidth between the uploads that run at the same time on different stores. Every upload
+    can only send the chunks the hardware asked for in its last FTCD, the scheduler takes one chunk of every upload
+    in turn so a long clip upload doesn't hold back a still or a macro.
+
+    :ivar uploads: The uploads that have budget left, by transfer id
+    """
+
+    def __init__(self):
+        self.uploads = collections.OrderedDict()
+
+    def add_budget(self, task, budget):
+        """
+        Set the budget from an FTCD for an upload
+
+        :param task: The TransferTask of the upload
+        :param budget: FileTransferContinueDataField with the chunk size and count
+        """
+        task.budget = budget
+        self.uploads[task.tid] = task
+
+    def remove(self, task):
+        self.uploads.pop(task.tid, None)
+
+    def take(self):
+        """
+        Take the next chunk to send, the uploads take turns
+
+        :return: Tuple of (task, chunk) or None if no upload can send right now
+        """
+        while len(self.uploads) > 0:
+            tid, task = next(iter(self.uploads.items()))
+            if task.remaining() == 0 or task.budget is None:
+                del self.uploads[tid]
+                continue
+            chunk = task.next_chunk(task.budget.size)
+            task.budget.count -= 1
+            if task.budget.count == 0:
+                task.budget = None
+                del self.uploads[tid]
+            else:
+                self.uploads.move_to_end(tid)
+            return task, chunk
+        return None
+
+
 class TransferQueueFlushed:
     def __init__(self):
         pass
@@ -1,5 +1,6 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
 import select
 import socket
 import struct
@@ -13,19 +14,46 @@ import threading
 import usb.core
 import usb.util
 
+from pyatem.metrics import TransportMetrics
 from pyatem.socketqueue import SocketQueue
 from pyatem.transfer import TransferQueueFlushed, TransferTask
 
+# Not available on Windows, the batched receive loop polls the socket there instead
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
 
 class ConnectionReady:
     def __init__(self):
         pass
 
 
+class ConnectionLost:
+    """
+    Passed to the upper layer when the hardware stopped responding and the transport starts a new connection
+    """
+
+    def __init__(self):
+        pass
+
+
+class LoopCallback:
+    """
+    Function that is passed through the receive path of the transport, so it runs on the thread that handles the
+    received packets
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+
 class Packet:
     STRUCT_HEADER = struct.Struct('>HHH 2x HH')
+    STRUCT_RETRANSMISSION = struct.Struct('>H')
     STRUCT_USB = struct.Struct('<I')
 
+    __slots__ = ('flags', 'length', 'session', 'sequence_number', 'acknowledgement_number', 'remote_sequence_number',
+                 'retransmission_number', 'data', 'debug', 'original', 'label', 'last_packet_time', 'reserved')
+
     def __init__(self):
         self.flags = 0
         self.length = 0
@@ -33,14 +61,21 @@ class Packet:
         self.sequence_number = 0
         self.acknowledgement_number = 0
         self.remote_sequence_number = 0
+        self.retransmission_number = 0
         self.data = None
         self.debug = False
         self.original = None
         self.label = None
         self.last_packet_time = None
+        # Queued packet that has a reservation in the congestion window
+        self.reserved = False
 
     @classmethod
     def from_bytes(cls, packet):
+        """
+        Parse a packet from a bytes-like object. The data attribute of the result is a memoryview into the
+        original buffer so the payload is not copied.
+        """
         res = cls()
         res.original = packet
         fields = cls.STRUCT_HEADER.unpack_from(packet)
@@ -56,30 +91,35 @@ class Packet:
         res.acknowledgement_number = fields[2]
         res.remote_sequence_number = fields[3]
         res.sequence_number = fields[4]
-        res.data = packet[12:]
+        if res.flags & UdpProtocol.FLAG_REQUEST_RETRANSMISSION:
+            res.retransmission_number, = cls.STRUCT_RETRANSMISSION.unpack_from(packet, 6)
+        res.data = memoryview(packet)[12:]
         return res
 
     def to_bytes(self):
         header_len = 12
         data_len = len(self.data) if self.data is not None else 0
         packet_len = header_len + data_len
-        result = self.STRUCT_HEADER.pack(
+        result = bytearray(packet_len)
+        self.STRUCT_HEADER.pack_into(
+            result, 0,
             packet_len + (self.flags << 11),
             self.session,
             self.acknowledgement_number,
             self.remote_sequence_number,
             self.sequence_number)
 
-        if self.data:
-            result += bytes(self.data)
+        if data_len:
+            result[header_len:] = self.data
 
         return result
 
     def to_usb(self):
         data_len = len(self.data) if self.data is not None else 0
-        result = self.STRUCT_USB.pack(data_len)
-        if self.data:
-            result += bytes(self.data)
+        result = bytearray(4 + data_len)
+        self.STRUCT_USB.pack_into(result, 0, data_len)
+        if data_len:
+            result[4:] = self.data
         return result
 
     def __repr__(self):
@@ -93,7 +133,7 @@ class Packet:
             flags += ' RETRANSMISSION'
         if self.flags & UdpProtocol.FLAG_REQUEST_RETRANSMISSION:
             flags += ' REQ-RETRANSMISSION'
-            extra = ' req={}'.format(self.remote_sequence_number)
+            extra = ' req={}'.format(self.retransmission_number)
         if self.flags & UdpProtocol.FLAG_ACK:
             flags += ' ACK'
             extra = ' ack={}'.format(self.acknowledgement_number)
@@ -119,30 +159,235 @@ class Packet:
         return flags
 
 
+class ReceiveBuffer:
+    """
+    Preallocated arena that incoming datagrams are received into with recvfrom_into(). Every datagram gets its
+    own region of the arena and is returned as a memoryview, so received data is never copied by the transport.
+    When the arena is full a new one is allocated, the old one is released when the last view into it is gone.
+    """
+
+    MTU = 2048
+
+    def __init__(self, size=256 * 1024):
+        self.size = size
+        self.view = None
+        self.offset = 0
+        self._allocate()
+
+    def _allocate(self):
+        self.view = memoryview(bytearray(self.size))
+        self.offset = 0
+
+    def receive(self, sock, flags=0):
+        if self.size - self.offset < self.MTU:
+            self._allocate()
+        nbytes, address = sock.recvfrom_into(self.view[self.offset:self.offset + self.MTU], 0, flags)
+        result = self.view[self.offset:self.offset + nbytes]
+        self.offset += nbytes
+        return result, address
+
+
+class RetransmissionBuffer:
+    """
+    Fixed size ring of the most recently sent reliable packets, indexed by their sequence number. This is used to
+    answer retransmission requests from the hardware without keeping every packet of the session in memory.
+
+    :ivar requested: Number of retransmission requests received
+    :ivar resent: Number of packets that have been sent again
+    :ivar missed: Number of requested packets that were no longer in the buffer
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.sequence = [None] * size
+        self.packets = [None] * size
+
+        self.requested = 0
+        self.resent = 0
+        self.missed = 0
+
+    def clear(self):
+        self.sequence = [None] * self.size
+        self.packets = [None] * self.size
+
+    def store(self, sequence_number, raw):
+        index = sequence_number % self.size
+        self.sequence[index] = sequence_number
+        self.packets[index] = raw
+
+    def get(self, sequence_number):
+        index = sequence_number % self.size
+        if self.sequence[index] != sequence_number:
+            return None
+        return self.packets[index]
+
+    def get_range(self, first, last):
+        """
+        Get the stored packets from sequence number first up to and including last, taking the wrap-around of
+        the 16 bit sequence number into account. Returns None if any packet in the range has been evicted.
+        """
+        count = ((last - first) % 2 ** 16) + 1
+        if count > self.size:
+            return None
+        result = []
+        for i in range(count):
+            raw = self.get((first + i) % 2 ** 16)
+            if raw is None:
+                return None
+            result.append(raw)
+        return result
+
+    def __repr__(self):
+        return '<RetransmissionBuffer size={} requested={} resent={} missed={}>'.format(self.size, self.requested,
+                                                                                     self.resent, self.missed)
+
+
+class CongestionWindow:
+    """
+    AIMD congestion window used to pace bulk traffic like file uploads. The window grows while packets get
+    acknowledged by the hardware and is halved when the hardware has to request a retransmission.
+
+    :ivar size: Current window size in packets
+    :ivar rtt: Smoothed round trip time of acknowledged packets in seconds
+    :ivar throughput: Smoothed rate of acknowledged bytes per second
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=256, timeout=1.0):
+        self.size = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.threshold = float(maximum)
+        self.timeout = timeout
+
+        self.rtt = None
+        self.throughput = 0.0
+
+        self.in_flight = collections.OrderedDict()
+        self.reserved = 0
+        self.lock = threading.Lock()
+
+        self.acked_bytes = 0
+        self.acked_since = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.in_flight.clear()
+            self.reserved = 0
+
+    def reserve(self, count):
+        """Mark packets as handed to the transport before they have a sequence number"""
+        with self.lock:
+            self.reserved += count
+
+    def sent(self, sequence_number, size, reserved=False):
+        """
+        Track a sent packet until it is acknowledged
+
+        :param reserved: The packet was counted in an earlier reserve()
+        """
+        with self.lock:
+            if reserved and self.reserved > 0:
+                self.reserved -= 1
+            self.in_flight[sequence_number] = (time.monotonic(), size)
+
+    def acknowledge(self, sequence_number):
+        """
+        Handle an ACK from the hardware. ACKs are cumulative so this also acknowledges every packet that was
+        sent before the acknowledged sequence number.
+
+        :return: The round trip time of the acknowledged packet or None if it was not in flight
+        """
+        with self.lock:
+            if sequence_number not in self.in_flight:
+                return None
+            now = time.monotonic()
+            while True:
+                seq, (sent, size) = self.in_flight.popitem(last=False)
+                self.acked_bytes += size
+                if self.size < self.threshold:
+                    # Slow start
+                    self.size += 1
+                else:
+                    self.size += 1 / self.size
+                if seq == sequence_number:
+                    break
+            self.size = min(self.size, self.maximum)
+
+            sample = now - sent
+            self.rtt = sample if self.rtt is None else (self.rtt * 7 + sample) / 8
+
+            elapsed = now - self.acked_since
+            if elapsed > 0.25:
+                rate = self.acked_bytes / elapsed
+                self.throughput = rate if self.throughput == 0 else (self.throughput + rate) / 2
+                self.acked_bytes = 0
+                self.acked_since = now
+            return sample
+
+    def loss(self):
+        with self.lock:
+            self.threshold = max(self.size / 2, self.minimum)
+            self.size = self.threshold
+
+    def available(self):
+        """Number of packets that can be sent right now"""
+        with self.lock:
+            if len(self.in_flight) > 0:
+                # Packets that are never acknowledged should not close the window forever
+                oldest, _ = next(iter(self.in_flight.values()))
+                if time.monotonic() - oldest > self.timeout:
+                    self.in_flight.clear()
+                    self.threshold = max(self.size / 2, self.minimum)
+                    self.size = self.threshold
+            return max(0, int(self.size) - len(self.in_flight) - self.reserved)
+
+    def __repr__(self):
+        rtt = 'unknown' if self.rtt is None else '{:.1f}ms'.format(self.rtt * 1000)
+        return '<CongestionWindow size={:.1f} in-flight={} rtt={} throughput={:.0f}B/s>'.format(
+            self.size, len(self.in_flight), rtt, self.throughput)
+
+
 class BaseProtocol:
     def __init__(self):
+        self.metrics = TransportMetrics()
         self.send_queue = collections.deque(maxlen=1024)
         self.queue_enabled = False
         self.queue_callback = None
         self.mark_next_connected = False
         self.batch_size = 1
         self.batch_delay = 0
+        self.window = None
 
     def _send_packet(self, packet):
         raise NotImplementedError()
 
+    def post(self, item):
+        """
+        Pass an object like a LoopCallback to the receiving side of the connection, it is returned by the
+        receive path in the thread that handles the packets.
+
+        :param item: Object to pass to the upper layer
+        :return: False if the transport can't pass objects through its receive path
+        """
+        return False
+
     def queue_packet(self, packet):
         self.send_queue.append(packet)
 
+    def _queue_budget(self):
+        return self.batch_size
+
     def queue_trigger(self):
         if len(self.send_queue) > 0:
             self.queue_enabled = True
-            for i in range(0, min(len(self.send_queue), self.batch_size)):
+            for i in range(0, min(len(self.send_queue), self._queue_budget())):
                 p = self.send_queue.popleft()
+                p.reserved = self.window is not None
                 self._send_packet(p)
                 if self.queue_callback is not None:
                     self.queue_callback(len(self.send_queue), len(p.data) - 4)
-            time.sleep(self.batch_delay)
+            if self.batch_delay:
+                time.sleep(self.batch_delay)
         elif self.queue_enabled:
             self.queue_enabled = False
             return True
@@ -151,6 +396,15 @@ class BaseProtocol:
     def get_link_quality(self):
         return 100
 
+    def get_metrics(self):
+        """
+        Get the traffic metrics of the transport, see TransportMetrics.snapshot()
+        """
+        return self.metrics.snapshot(self._queue_depths())
+
+    def _queue_depths(self):
+        return {'transfer': len(self.send_queue)}
+
 
 class UdpProtocol(BaseProtocol):
     STATE_CLOSED = 0
@@ -164,17 +418,23 @@ class UdpProtocol(BaseProtocol):
     FLAG_REQUEST_RETRANSMISSION = 8
     FLAG_ACK = 16
 
+    # Returned by the state machine when a packet didn't produce anything for the upper layer
+    PENDING = object()
+
+    # Seconds without traffic before the connection is restarted
+    TIMEOUT = 5
+
+    # Maximum number of datagrams handled per wakeup of the I/O thread
+    BATCH_SIZE = 64
+
+    # Maximum number of received packets covered by a single coalesced ACK
+    ACK_BATCH_SIZE = 16
+
     def __init__(self, ip, port=9910):
         super().__init__()
         self.ip = ip
         self.port = port
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(5)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 16)
-
-        self.thread = threading.Thread(None, self._udp_thread, "atem-udp", daemon=True)
-
         self.local_sequence_number = 0
         self.local_ack_number = 0
         self.remote_sequence_number = 0
@@ -187,19 +447,36 @@ class UdpProtocol(BaseProtocol):
         self.had_traffic = False
 
         self.received_packets = collections.deque(maxlen=1024)
-        self.retransmission_buffer = {}
-
-        self.thread_queue = SocketQueue()
-        self.thread_recv_queue = Queue()
+        self.retransmission_buffer = RetransmissionBuffer()
+        self.window = CongestionWindow()
 
-        self.batch_size = 5
-        self.batch_delay = 0.003
+        self.batch_io = True
+        self.ack_batching = False
+        self.ack_pending = 0
+        self.received_batch = collections.deque()
 
         self.log = logging.getLogger('UdpTransport')
         self.packet_sucess = 0
         self.packet_errors = 0
 
+        self._setup_io()
+
+    def _setup_io(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 16)
+
+        self.thread = threading.Thread(None, self._udp_thread, "atem-udp", daemon=True)
+
+        self.thread_queue = SocketQueue()
+        self.thread_recv_queue = Queue()
+        self.receive_buffer = ReceiveBuffer()
+
     def _udp_thread(self):
+        if self.batch_io:
+            self._udp_thread_batched()
+            return
+
         while True:
             readable, _, _ = select.select([self.sock, self.thread_queue], [], [])
             for queue in readable:
@@ -219,9 +496,67 @@ class UdpProtocol(BaseProtocol):
                     self.thread_recv_queue.put(None)
                     RuntimeError("Unexpected result from select()")
 
+    def _udp_thread_batched(self):
+        """
+        I/O loop that handles everything that is pending on a single wakeup. All datagrams waiting in the socket
+        are received before the received packets are handed to the receiving thread in one go, the ACKs for
+        them are coalesced and all queued outgoing packets are sent.
+        """
+        # The socket stays blocking so sends wait for room in the send buffer, only the receive drain doesn't block
+        self.sock.setblocking(True)
+        while True:
+            readable, _, _ = select.select([self.sock, self.thread_queue], [], [], self.TIMEOUT)
+            if len(readable) == 0:
+                self.thread_recv_queue.put(self._connection_timeout())
+                continue
+
+            if self.sock in readable:
+                received = []
+                self.ack_batching = True
+                for i in range(self.BATCH_SIZE):
+                    if i > 0 and not MSG_DONTWAIT and not select.select([self.sock], [], [], 0)[0]:
+                        break
+                    try:
+                        data, address = self.receive_buffer.receive(self.sock, MSG_DONTWAIT)
+                    except BlockingIOError:
+                        break
+                    packet = self._process_datagram(data)
+                    if packet is not None:
+                        received.append(packet)
+                self.ack_batching = False
+                self._flush_ack()
+                if len(received) > 0:
+                    self.thread_recv_queue.put(received)
+
+            if self.thread_queue in readable:
+                try:
+                    for packet in self.thread_queue.get_all():
+                        self._send_packet_low(packet)
+                except OSError as e:
+                    self.log.error(e)
+                    # Queue a None to signal the socket died
+                    self.thread_recv_queue.put(None)
+                    return
+
+    def post(self, item):
+        self.thread_recv_queue.put(item)
+        return True
+
     def get_link_quality(self):
         return 100 - (self.packet_errors / self.packet_sucess * 100)
 
+    def _queue_depths(self):
+        return {
+            'transfer': len(self.send_queue),
+            'send': self.thread_queue.qsize(),
+            'receive': self.thread_recv_queue.qsize() + len(self.received_batch),
+        }
+
+    def _queue_budget(self):
+        budget = self.window.available()
+        self.window.reserve(min(budget, len(self.send_queue)))
+        return budget
+
     def _send_packet(self, packet):
         self.thread_queue.put(packet)
         self.packet_sucess += 1
@@ -233,36 +568,58 @@ class UdpProtocol(BaseProtocol):
                 self.local_sequence_number = 0
             packet.sequence_number = (self.local_sequence_number + 1) % 2 ** 16
         raw = packet.to_bytes()
-        self.sock.sendto(raw, (self.ip, self.port))
+        self._sendto(raw)
+        self.metrics.packets_out += 1
+        self.metrics.bytes_out += len(raw)
         self.log.debug('> {}'.format(packet))
         if packet.debug:
             # hexdump(raw)
             pass
         if packet.flags & (UdpProtocol.FLAG_SYN | UdpProtocol.FLAG_ACK) == 0:
             self.local_sequence_number = (self.local_sequence_number + 1) % 2 ** 16
-        self.retransmission_buffer[self.local_sequence_number] = packet
+            self.retransmission_buffer.store(packet.sequence_number, raw)
+            self.window.sent(packet.sequence_number, len(raw), packet.reserved)
 
         if packet.label == "_handshake":
             # Clear temporary session id, use the session id received in the first packet from the remote
             self.session_id = None
 
+    def _sendto(self, raw):
+        self.sock.sendto(raw, (self.ip, self.port))
+
     def _receive_packet(self):
-        return self.thread_recv_queue.get()
+        if len(self.received_batch) > 0:
+            return self.received_batch.popleft()
+        packet = self.thread_recv_queue.get()
+        if isinstance(packet, list):
+            self.received_batch.extend(packet)
+            return self.received_batch.popleft()
+        return packet
 
     def _receive_packet_low(self):
         try:
-            data, address = self.sock.recvfrom(2048)
+            data, address = self.receive_buffer.receive(self.sock)
         except socket.timeout:
-            # No longer receiving data from the hardware, reset the state of the connection and re-init
-            self.state = UdpProtocol.STATE_CLOSED
-            self.connect()
-            return
+            return self._connection_timeout()
+        return self._process_datagram(data)
+
+    def _connection_timeout(self):
+        # No longer receiving data from the hardware, reset the state of the connection and re-init. The upper
+        # layer gets a ConnectionLost so it handles this like any other disconnect.
+        self.state = UdpProtocol.STATE_CLOSED
+        self.connect()
+        return ConnectionLost()
+
+    def _process_datagram(self, data):
         packet = Packet.from_bytes(data)
+        self.metrics.packets_in += 1
+        self.metrics.bytes_in += len(data)
 
         if packet.flags & UdpProtocol.FLAG_RETRANSMISSION:
             if len(data) > 12:
                 self.log.error("retransmission detected")
                 self.packet_errors += 1
+                self.metrics.retransmissions_received += 1
                 if self.get_link_quality() < 80:
                     self.log.error(f"Connection quality bad ({self.get_link_quality():.1f}%)")
             else:
@@ -270,10 +627,16 @@ class UdpProtocol(BaseProtocol):
         else:
             self.packet_sucess += 1
 
+        if packet.flags & UdpProtocol.FLAG_ACK:
+            rtt = self.window.acknowledge(packet.acknowledgement_number)
+            if rtt is not None:
+                self.metrics.ack_rtt.add(rtt)
+
         if packet.flags & UdpProtocol.FLAG_REQUEST_RETRANSMISSION:
-            self.log.error("retransmission requested")
             self.packet_errors += 1
-            # hexdump(data)
+            self.metrics.retransmission_requests += 1
+            self.window.loss()
+            self._retransmit(packet.retransmission_number)
 
         new_sequence_number = packet.sequence_number
         self.remote_sequence_number = new_sequence_number
@@ -292,14 +655,51 @@ class UdpProtocol(BaseProtocol):
                 (not self.enable_ack and UdpProtocol.FLAG_ACK and len(packet.data) == 0):
             self.enable_ack = True
             # ACK this
-            ack = Packet()
-            ack.flags = UdpProtocol.FLAG_ACK
-            ack.acknowledgement_number = self.remote_sequence_number
-            ack.remote_sequence_number = 0x61
-            self._send_packet(ack)
+            if self.ack_batching:
+                self.ack_pending += 1
+                if self.ack_pending >= self.ACK_BATCH_SIZE:
+                    self._flush_ack()
+            else:
+                self._send_ack(self.remote_sequence_number)
 
         return packet
 
+    def _make_ack(self, sequence_number):
+        ack = Packet()
+        ack.flags = UdpProtocol.FLAG_ACK
+        ack.acknowledgement_number = sequence_number
+        ack.remote_sequence_number = 0x61
+        return ack
+
+    def _send_ack(self, sequence_number):
+        self._send_packet(self._make_ack(sequence_number))
+
+    def _flush_ack(self):
+        # ACKs are cumulative, acknowledging the last packet of a batch acknowledges the whole batch. This runs
+        # in the I/O thread so the ACK can be sent directly instead of through the send queue.
+        if self.ack_pending == 0:
+            return
+        self.ack_pending = 0
+        self._send_packet_low(self._make_ack(self.remote_sequence_number))
+
+    def _retransmit(self, sequence_number):
+        self.retransmission_buffer.requested += 1
+        packets = self.retransmission_buffer.get_range(sequence_number, self.local_sequence_number)
+        if packets is None:
+            self.log.error(f"retransmission requested for {sequence_number} but it is no longer buffered")
+            self.retransmission_buffer.missed += 1
+            return
+
+        self.log.warning(f"retransmission requested, resending {len(packets)} packets from {sequence_number}")
+        for raw in packets:
+            resend = bytearray(raw)
+            resend[0] |= UdpProtocol.FLAG_RETRANSMISSION << 3
+            self._sendto(resend)
+            self.retransmission_buffer.resent += 1
+            self.metrics.retransmissions_sent += 1
+            self.metrics.packets_out += 1
+            self.metrics.bytes_out += len(resend)
+
     def _handshake(self, packet):
         if not packet.flags & UdpProtocol.FLAG_SYN:
             return
@@ -327,6 +727,9 @@ class UdpProtocol(BaseProtocol):
         if not self.thread.is_alive():
             self.thread.start()
 
+        self._start_handshake()
+
+    def _start_handshake(self):
         # Reset internal state
         self.local_sequence_number = -1
         self.local_ack_number = 0
@@ -334,6 +737,8 @@ class UdpProtocol(BaseProtocol):
         self.remote_ack_numbe = 0
         self.session_id = 0x1337
         self.enable_ack = False
+        self.retransmission_buffer.clear()
+        self.window.reset()
 
         # Create first syn packet
         syn = Packet()
@@ -349,60 +754,182 @@ class UdpProtocol(BaseProtocol):
 
     def receive_packet(self):
         while True:
-            packet = self._receive_packet()
+            result = self._handle_packet(self._receive_packet())
+            if result is not UdpProtocol.PENDING:
+                return result
+
+    def _handle_packet(self, packet):
+        """
+        Run a received packet through the connection state machine. This returns the object that should be
+        passed to the upper layer or PENDING if the packet was consumed by the transport layer itself.
+        """
+        if packet is True:
+            return UdpProtocol.PENDING
+        if isinstance(packet, (ConnectionLost, LoopCallback)):
+            return packet
+        if packet is None and not self.had_traffic:
+            return UdpProtocol.PENDING
+        if packet is None and self.state == UdpProtocol.STATE_SYN_SENT:
+            # No response in connect, retry connection
+            self.state = UdpProtocol.STATE_CLOSED
+            self.had_traffic = False
+            self._start_handshake()
+            return None
 
-            if packet is True:
-                continue
-            if packet is None and not self.had_traffic:
-                continue
-            if packet is None and self.state == UdpProtocol.STATE_SYN_SENT:
-                # No response in connect, retry connection
-                self.state = UdpProtocol.STATE_CLOSED
-                self.had_traffic = False
-                self.connect()
-                return None
+        if packet is None:
+            # When None is in the receive queue the socket has disconnected
+            return None
 
-            if packet is None:
-                # When None is in the receive queue the socket has disconnected
-                return None
+        if self.mark_next_connected:
+            self.mark_next_connected = False
+            return ConnectionReady()
 
-            if self.mark_next_connected:
-                self.mark_next_connected = False
-                return ConnectionReady()
-
-            if self.enable_ack and self.queue_trigger():
-                return TransferQueueFlushed()
-
-            if self.state == UdpProtocol.STATE_SYN_SENT:
-                # Got response for the first handshake packet
-                self.had_traffic = True
-                self._handshake(packet)
-            elif self.state == UdpProtocol.STATE_ESTABLISHED:
-                if packet.length == 12:
-                    # This is a control packet, deal with it in the transport layer
-                    if not self.enable_ack:
-                        # This is the first ACK from the mixer, after this we should send ACKs bac
-                        self.enable_ack = True
-                        # self.local_sequence_number = 0
-                        ack = Packet()
-                        ack.flags = UdpProtocol.FLAG_ACK
-                        ack.acknowledgement_number = self.remote_sequence_number
-                        ack.remote_sequence_number = 0x61
-                        ack.label = 'initial ack after connection'
-                        self._send_packet(ack)
-                    # TODO: Implement other control packets, like request for retransmission
-
-                    # Send queued up bulk traffic after the ack
-                    if self.queue_trigger():
-                        return TransferQueueFlushed()
-                else:
-                    # Data packet for the upper layer
-                    return packet
+        if self.enable_ack and self.queue_trigger():
+            return TransferQueueFlushed()
+
+        if self.state == UdpProtocol.STATE_SYN_SENT:
+            # Got response for the first handshake packet
+            self.had_traffic = True
+            self._handshake(packet)
+        elif self.state == UdpProtocol.STATE_ESTABLISHED:
+            if packet.length == 12:
+                # This is a control packet, deal with it in the transport layer
+                if not self.enable_ack:
+                    # This is the first ACK from the mixer, after this we should send ACKs bac
+                    self.enable_ack = True
+                    # self.local_sequence_number = 0
+                    ack = Packet()
+                    ack.flags = UdpProtocol.FLAG_ACK
+                    ack.acknowledgement_number = self.remote_sequence_number
+                    ack.remote_sequence_number = 0x61
+                    ack.label = 'initial ack after connection'
+                    self._send_packet(ack)
+                # Retransmission requests are already answered in _receive_packet_low()
+
+                # Send queued up bulk traffic after the ack
+                if self.queue_trigger():
+                    return TransferQueueFlushed()
+            else:
+                # Data packet for the upper layer
+                return packet
+        return UdpProtocol.PENDING
 
     def send_packet(self, packet):
         self._send_packet(packet)
 
 
+class AsyncUdpProtocol(UdpProtocol, asyncio.DatagramProtocol):
+    """
+    Variant of the UDP transport that runs on an asyncio event loop instead of a dedicated thread. Datagrams are
+    processed in the datagram_received callback of the event loop and results are passed to the packet_callback
+    directly, which allows a single event loop to drive any number of switchers.
+    """
+
+    def __init__(self, ip, port=9910, packet_callback=None):
+        self.packet_callback = packet_callback
+        super().__init__(ip, port)
+
+    def _setup_io(self):
+        self.endpoint = None
+        self.event_loop = None
+        self.watchdog = None
+        self.last_receive = 0
+        self.sending = False
+        self.send_error = None
+
+    async def connect(self):
+        if self.state != UdpProtocol.STATE_CLOSED:
+            raise RuntimeError("Trying to open an connection that's already open")
+
+        if self.endpoint is None:
+            self.event_loop = asyncio.get_running_loop()
+            await self.event_loop.create_datagram_endpoint(lambda: self, remote_addr=(self.ip, self.port))
+
+        self.last_receive = self.event_loop.time()
+        if self.watchdog is None:
+            self.watchdog = self.event_loop.call_later(min(1, self.TIMEOUT), self._check_timeout)
+        self._start_handshake()
+
+    def close(self):
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+            self.watchdog = None
+        if self.endpoint is not None:
+            self.endpoint.close()
+            self.endpoint = None
+        self.state = UdpProtocol.STATE_CLOSED
+
+    def connection_made(self, transport):
+        self.endpoint = transport
+
+    def connection_lost(self, exc):
+        self.endpoint = None
+
+    def datagram_received(self, data, addr):
+        self.last_receive = self.event_loop.time()
+        self._dispatch(self._process_datagram(data))
+
+    def error_received(self, exc):
+        if self.sending:
+            self.send_error = exc
+            return
+        self.log.error(exc)
+        # Signal the upper layer the connection died
+        self._dispatch(None)
+
+    def _check_timeout(self):
+        self.watchdog = self.event_loop.call_later(min(1, self.TIMEOUT), self._check_timeout)
+        if self.event_loop.time() - self.last_receive < self.TIMEOUT:
+            return
+
+        # No longer receiving data from the hardware, reset the state of the connection and re-init
+        self.last_receive = self.event_loop.time()
+        self._dispatch(ConnectionLost())
+        self._start_handshake()
+
+    def _dispatch(self, packet):
+        result = self._handle_packet(packet)
+        if result is not UdpProtocol.PENDING and self.packet_callback is not None:
+            self.packet_callback(result)
+
+    def _send_packet(self, packet):
+        try:
+            self._send_packet_low(packet)
+        except OSError as e:
+            self.log.error(e)
+            self._dispatch(None)
+            return
+        self.packet_sucess += 1
+
+    def _sendto(self, raw):
+        if self.endpoint is None or self.endpoint.is_closing():
+            raise ConnectionError("UDP endpoint is not open")
+        # The endpoint reports send errors to error_received() instead of raising them
+        self.send_error = None
+        self.sending = True
+        try:
+            self.endpoint.sendto(raw)
+        finally:
+            self.sending = False
+        if self.send_error is not None:
+            raise self.send_error
+
+    def post(self, item):
+        if self.event_loop is None:
+            return False
+        self.event_loop.call_soon_threadsafe(self._dispatch, item)
+        return True
+
+    def receive_packet(self):
+        raise RuntimeError("The asyncio transport delivers packets through packet_callback")
+
+    def _queue_depths(self):
+        return {
+            'transfer': len(self.send_queue),
+            'send': self.endpoint.get_write_buffer_size() if self.endpoint is not None else 0,
+        }
+
+
 class UsbProtocol(BaseProtocol):
     STATE_INIT = 0
     STATE_CONNECTED = 1
@@ -490,6 +1017,8 @@ class UsbProtocol(BaseProtocol):
             raw = raw[4:]
             self.write(0x04, struct.pack('>6xH', len(raw)))
         self.handle.write(0x02, raw)
+        self.metrics.packets_out += 1
+        self.metrics.bytes_out += len(raw)
 
     def write(self, ptype, data, pid=1):
         raw = struct.pack('BBBB', 0, ptype, 0, 1) + data
@@ -582,6 +1111,8 @@ class UsbProtocol(BaseProtocol):
                     continue
 
             raw = bytes(packet)
+            self.metrics.packets_in += 1
+            self.metrics.bytes_in += len(raw)
             if self.rev == 8.6:
                 packet = Packet()
                 packet.data = raw
@@ -606,6 +1137,12 @@ class UsbProtocol(BaseProtocol):
         self._send_packet(packet)
         time.sleep(0.004)
 
+    def _queue_depths(self):
+        return {
+            'transfer': len(self.send_queue),
+            'receive': self.rx_queue.qsize(),
+        }
+
     def keep_alive(self):
         try:
             self.handle.write(0x02, b'')
@@ -644,6 +1181,8 @@ class TcpProtocol(BaseProtocol):
     def _send_packet(self, data):
         header = self.STRUCT_HEADER.pack(len(data))
         self.sock.sendall(header + data)
+        self.metrics.packets_out += 1
+        self.metrics.bytes_out += len(data) + 2
 
     def _receive_packet(self):
         try:
@@ -661,6 +1200,8 @@ class TcpProtocol(BaseProtocol):
         except:
             return None
 
+        self.metrics.packets_in += 1
+        self.metrics.bytes_in += datalength + 2
         packet = Packet()
         packet.data = data
         return packet
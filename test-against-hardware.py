@@ -1,6 +1,7 @@
 import argparse
 import os
 from datetime import datetime
+from functools import partial
 import itertools
 
 import yaml
@@ -10,83 +11,65 @@ import pyatem.field as fieldmodule
 import pyatem.command as commandmodule
 
 switcher = None
-current = None
-send_time = None
 in_prep = True
 prepqueue = []
 testqueue = []
-rejectbuffer = []
 
 stats_executed = 0
 stats_start = None
+stats_rtt = []
 
 
-def on_change(key, contents):
-    global switcher
-    global stats_executed
-    global rejectbuffer
-    delta = datetime.now() - send_time
+def print_sent(test):
+    print("Sent:")
+    print(f"  {test['send']['cmd']}:")
+    for arg in test['send']:
+        if arg == 'cmd':
+            continue
+        print(f"    {arg} = {test['send'][arg]}")
+
 
+def on_change(key, contents):
     if in_prep:
         send_next()
-        return
 
-    expect = current['expect']
 
-    if delta.total_seconds() > 2:
+def on_confirmed(test, future):
+    try:
+        rtt = future.result()
+    except TimeoutError:
+        expect = test['expect']
         print("\nTimeout while waiting for field response")
-        print("Sent:")
-        print(f"  {current['send']['cmd']}:")
-        for arg in current['send']:
-            if arg == 'cmd':
-                continue
-            print(f"    {arg} = {current['send'][arg]}")
+        print_sent(test)
         print(f"Expected: {expect['field']}")
+        for argname in expect:
+            if argname != 'field':
+                print(f"  {argname} = {expect[argname]}")
         print("Received:")
-        for k in rejectbuffer:
-            print(f"  {k}")
-        exit(2)
-
-    if key != expect['field']:
-        rejectbuffer.append(key)
-        return
-
-    rejectbuffer = []
-
-    for argname in expect:
-        if argname == 'field':
-            continue
-
-        if getattr(contents, argname) != expect[argname]:
-            print("Sent:")
-            print(f"  {current['send']['cmd']}:")
-            for arg in current['send']:
-                if arg == 'cmd':
-                    continue
-                print(f"    {arg} = {current['send'][arg]}")
-            print(f"\nMismatch on {argname}: expected {expect[argname]}, got {getattr(contents, argname)}")
-            exit(2)
+        print(f"  {switcher.mixerstate.get(expect['field'])}")
+        os._exit(2)
 
+    global stats_executed
     stats_executed += 1
-    print(".", end='')
+    stats_rtt.append(rtt)
+    print(".", end='', flush=True)
     send_next()
 
 
 def send_next():
-    global switcher
     global prepqueue
     global in_prep
     global testqueue
-    global current
-    global send_time
-
 
     if len(testqueue) == 0:
         print("\n")
         print(f"Executed tests: {stats_executed}")
         print(f"Test duration: {datetime.now() - stats_start}")
+        if len(stats_rtt) > 0:
+            print(f"Command round-trip time: avg {sum(stats_rtt) / len(stats_rtt) * 1000:.1f}ms "
+                  f"max {max(stats_rtt) * 1000:.1f}ms")
         print("Tests completed successfully")
-        exit(0)
+        os._exit(0)
 
     if len(prepqueue) > 0:
         test = prepqueue.pop(0)
@@ -95,7 +78,6 @@ def send_next():
             print("Running tests...")
             in_prep = False
         test = testqueue.pop(0)
-    current = test
 
     classname = test['send']['cmd'].title().replace('-', '') + "Command"
     arguments = test['send'].copy()
@@ -105,10 +87,16 @@ def send_next():
         cmd = getattr(commandmodule, classname)(**arguments)
     else:
         print(f"Unknown command: {classname}")
-        exit(2)
+        os._exit(2)
+
+    if in_prep:
+        switcher.send_commands([cmd])
+        return
 
-    send_time = datetime.now()
-    switcher.send_commands([cmd])
+    expect = test['expect'].copy()
+    field = expect.pop('field')
+    future = switcher.send_command_confirmed(cmd, field=field, match=expect)
+    future.add_done_callback(partial(on_confirmed, test))
 
 
 def on_connected():
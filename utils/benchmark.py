@@ -0,0 +1,592 @@
+"""
+Benchmarks for the pyatem protocol implementation. These run against a synthetic switcher state that is sized
+like a large Constellation mixer and an emulated switcher on localhost, so no hardware is needed.
+"""
+import argparse
+import select
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+
+import pyatem.transport as transportmodule
+from pyatem.protocol import AtemProtocol
+from pyatem.transport import Packet, UdpProtocol
+
+# Payload sizes of the fields in the synthetic state, the FIELDNAME_UNIQUE index is written at the start
+FIELD_SIZES = {
+    b'_ver': 4, b'_pin': 44, b'_top': 28, b'Time': 8, b'_MeC': 4, b'_mpl': 4, b'VidM': 4, b'InPr': 36,
+    b'PrgI': 4, b'PrvI': 8, b'TrSS': 8, b'TrPr': 4, b'TrPs': 8, b'TMxP': 4, b'TDpP': 4, b'TWpP': 20, b'TDvP': 20,
+    b'TStP': 20, b'KeOn': 4, b'KeBP': 20, b'KeLm': 12, b'KACk': 24, b'KeDV': 60, b'DskB': 8, b'DskP': 20,
+    b'DskS': 8, b'FtbP': 4, b'FtbS': 4, b'ColV': 8, b'AuxS': 4, b'MPfe': 24, b'MPCE': 4, b'FASP': 52, b'FAIP': 16,
+    b'AEBP': 36, b'MPrp': 8, b'MvPr': 4, b'MvIn': 8, b'VuMC': 4, b'SaMw': 4, b'SSBP': 24, b'FAMP': 20,
+    b'FMHP': 32, b'AMLv': 36, b'FMLv': 40, b'FDLv': 28,
+}
+
+
+def make_field(code, data):
+    return struct.pack('!H2x 4s', len(data) + 8, code) + data
+
+
+def synthetic_field(code, *index):
+    payload = bytearray(FIELD_SIZES[code])
+    key = AtemProtocol.FIELDNAME_PRETTY[code.decode()]
+    if index:
+        AtemProtocol.FIELDNAME_UNIQUE[key].pack_into(payload, 0, *index)
+    return make_field(code, bytes(payload))
+
+
+def synthetic_state(me=4, inputs=80, aux=24, strips=80, macros=100, stills=20, multiviewers=4):
+    """
+    Generate the fields of an initial state sync for a mixer of the specified size
+    """
+    fields = [synthetic_field(code) for code in (b'_ver', b'_pin', b'_top', b'Time', b'_mpl', b'VidM', b'FAMP',
+                                                 b'FMHP')]
+    for i in range(me):
+        fields.append(synthetic_field(b'_MeC', i))
+        for code in (b'PrgI', b'PrvI', b'TrPr', b'TrPs', b'TMxP', b'TDpP', b'TWpP', b'TDvP', b'TStP', b'DskB',
+                     b'DskP', b'DskS', b'FtbP', b'FtbS', b'MPCE', b'MvPr', b'SSBP'):
+            fields.append(synthetic_field(code, i))
+        fields.append(synthetic_field(b'TrSS'))
+        for keyer in range(4):
+            for code in (b'KeOn', b'KeBP', b'KeLm', b'KeDV'):
+                fields.append(synthetic_field(code, i, keyer))
+            fields.append(synthetic_field(b'KACk'))
+    for i in range(multiviewers):
+        for window in range(16):
+            for code in (b'MvIn', b'VuMC', b'SaMw'):
+                fields.append(synthetic_field(code, i, window))
+    for i in range(inputs):
+        fields.append(synthetic_field(b'InPr', i))
+    for i in range(aux):
+        fields.append(synthetic_field(b'AuxS', i))
+    for i in range(2):
+        fields.append(synthetic_field(b'ColV', i))
+    for i in range(stills):
+        fields.append(synthetic_field(b'MPfe', i))
+    for i in range(macros):
+        fields.append(synthetic_field(b'MPrp', i))
+    for i in range(strips):
+        fields.append(synthetic_field(b'FASP', i))
+        fields.append(synthetic_field(b'FAIP', i))
+        for band in range(6):
+            fields.append(synthetic_field(b'AEBP', i, band))
+    return fields
+
+
+def synthetic_meters(strips=80):
+    """
+    Generate the fields of a single meter update with levels enabled on a Fairlight mixer
+    """
+    fields = [synthetic_field(b'FDLv')]
+    for i in range(strips):
+        payload = bytearray(FIELD_SIZES[b'FMLv'])
+        struct.pack_into('>H', payload, 8, i)
+        struct.pack_into('>15h', payload, 10, *([-(i * 100) % 10000] * 15))
+        fields.append(make_field(b'FMLv', bytes(payload)))
+    return fields
+
+
+def pack_datagrams(fields, size=1300):
+    """
+    Group fields into datagram payloads like the hardware does
+    """
+    result = []
+    buffer = b''
+    for field in fields:
+        if len(buffer) + len(field) > size:
+            result.append(buffer)
+            buffer = b''
+        buffer += field
+    if buffer:
+        result.append(buffer)
+    return result
+
+
+class EmulatedSwitcher(threading.Thread):
+    """
+    Minimal switcher on localhost that does the UDP handshake, sends the initial state and then keeps sending
+    the update payloads until stopped.
+    """
+    SESSION = 0x8001
+
+    def __init__(self, initial, updates=None, update_count=0):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.initial = initial
+        self.updates = updates or []
+        self.update_count = update_count
+        self.sequence = 0
+        self.client = None
+        self.stop = False
+
+    def send(self, flags, data=b'', session=None, ack=0):
+        packet = Packet()
+        packet.flags = flags
+        packet.session = session or self.SESSION
+        packet.acknowledgement_number = ack
+        if not flags & (UdpProtocol.FLAG_SYN | UdpProtocol.FLAG_ACK) or data:
+            self.sequence = (self.sequence + 1) % 2 ** 16
+            packet.sequence_number = self.sequence
+        packet.data = data
+        self.sock.sendto(packet.to_bytes(), self.client)
+
+    def run(self):
+        established = False
+        while not self.stop:
+            readable, _, _ = select.select([self.sock], [], [], 0.1)
+            if not readable:
+                continue
+            data, self.client = self.sock.recvfrom(2048)
+            packet = Packet.from_bytes(data)
+            if packet.flags & UdpProtocol.FLAG_SYN:
+                self.send(UdpProtocol.FLAG_SYN, b'\x02\x00\x00\x00\x00\x00\x00\x00', session=packet.session)
+            elif not established and packet.flags & UdpProtocol.FLAG_ACK:
+                established = True
+                self.send(UdpProtocol.FLAG_ACK)
+                for payload in self.initial:
+                    self.send(UdpProtocol.FLAG_RELIABLE, payload)
+                self.send(UdpProtocol.FLAG_RELIABLE, make_field(b'InCm', b'\0\0\0\0'))
+                self.send(UdpProtocol.FLAG_ACK)
+                for i in range(self.update_count):
+                    for payload in self.updates:
+                        self.send(UdpProtocol.FLAG_RELIABLE, payload)
+                self.send(UdpProtocol.FLAG_ACK)
+            else:
+                self.handle(packet)
+
+    def handle(self, packet):
+        if packet.flags & UdpProtocol.FLAG_RELIABLE:
+            self.send(UdpProtocol.FLAG_ACK, ack=packet.sequence_number)
+
+
+class UploadSwitcher(EmulatedSwitcher):
+    """
+    Emulated switcher that accepts media pool uploads. It hands out transfer budgets of CHUNK_COUNT chunks of
+    CHUNK_SIZE bytes like the hardware does.
+    """
+    CHUNK_SIZE = 1396
+    CHUNK_COUNT = 20
+
+    def __init__(self):
+        super().__init__([])
+        self.budgets = {}
+        self.received = 0
+
+    def handle(self, packet):
+        super().handle(packet)
+        if not packet.flags & UdpProtocol.FLAG_RELIABLE:
+            return
+        data = bytes(packet.data)
+        offset = 0
+        while offset < len(data):
+            length, code = struct.unpack_from('!H2x 4s', data, offset)
+            self.command(code, data[offset + 8:offset + length])
+            offset += length
+
+    def command(self, code, data):
+        if code == b'PLCK':
+            store, = struct.unpack_from('>H', data)
+            self.send(UdpProtocol.FLAG_RELIABLE, make_field(b'LKOB', struct.pack('>H2x', store)))
+        elif code == b'FTSD':
+            tid, = struct.unpack_from('>H', data)
+            self.continue_transfer(tid)
+        elif code == b'FTDa':
+            tid, size = struct.unpack_from('>HH', data)
+            self.received += size
+            self.budgets[tid] -= 1
+            if self.budgets[tid] == 0:
+                self.continue_transfer(tid)
+        elif code == b'FTFD':
+            tid, = struct.unpack_from('>H', data)
+            self.send(UdpProtocol.FLAG_RELIABLE, make_field(b'FTDC', struct.pack('>HBB', tid, 0, 0)))
+
+    def continue_transfer(self, tid):
+        self.budgets[tid] = self.CHUNK_COUNT
+        ftcd = struct.pack('>H 4x HH 2x', tid, self.CHUNK_SIZE, self.CHUNK_COUNT)
+        self.send(UdpProtocol.FLAG_RELIABLE, make_field(b'FTCD', ftcd))
+
+
+class SyscallCounter:
+    def __init__(self):
+        self.counts = {}
+
+    def count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+class CountingSocket:
+    """
+    Proxy for a socket that counts the calls that result in a syscall
+    """
+    SYSCALLS = {'recv', 'recvfrom', 'recv_into', 'recvfrom_into', 'send', 'sendto', 'sendall'}
+
+    def __init__(self, sock, counter):
+        self._sock = sock
+        self._counter = counter
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def __getattr__(self, name):
+        attr = getattr(self._sock, name)
+        if name not in self.SYSCALLS:
+            return attr
+
+        def wrapper(*args, **kwargs):
+            self._counter.count(name)
+            return attr(*args, **kwargs)
+
+        return wrapper
+
+
+class CountingSelect:
+    def __init__(self, counter):
+        self._counter = counter
+
+    def select(self, *args, **kwargs):
+        self._counter.count('select')
+        return select.select(*args, **kwargs)
+
+
+def bench_io(args):
+    """
+    Count socket syscalls per decoded field for the initial sync and a stream of meter updates
+    """
+    initial = pack_datagrams(synthetic_state())
+    updates = pack_datagrams(synthetic_meters())
+
+    print(f'{"mode":<10} {"fields":>8} {"syscalls":>9} {"handoffs":>9} {"syscalls/field":>15} {"time":>8}')
+    for batch_io in (False, True):
+        emulator = EmulatedSwitcher(initial, updates, args.updates)
+        emulator.start()
+
+        counter = SyscallCounter()
+        transportmodule.select = CountingSelect(counter)
+        switcher = AtemProtocol('127.0.0.1', emulator.port)
+        transport = switcher.transport
+        transport.batch_io = batch_io
+        transport.sock = CountingSocket(transport.sock, counter)
+        transport.thread_queue._putsocket = CountingSocket(transport.thread_queue._putsocket, counter)
+        transport.thread_queue._getsocket = CountingSocket(transport.thread_queue._getsocket, counter)
+
+        handoffs = [0]
+        original_put = transport.thread_recv_queue.put
+
+        def counting_put(item, *a, **kw):
+            handoffs[0] += 1
+            return original_put(item, *a, **kw)
+
+        transport.thread_recv_queue.put = counting_put
+
+        fields = [0]
+
+        def on_change(key, contents):
+            fields[0] += 1
+
+        switcher.on('change', on_change)
+        expected = len(synthetic_state()) + 1 + args.updates * len(synthetic_meters())
+        start = time.perf_counter()
+        switcher.connect()
+        while fields[0] < expected:
+            switcher.loop()
+        duration = time.perf_counter() - start
+
+        emulator.stop = True
+        transportmodule.select = select
+        mode = 'batched' if batch_io else 'single'
+        print(f'{mode:<10} {fields[0]:>8} {counter.total():>9} {handoffs[0]:>9} '
+              f'{counter.total() / fields[0]:>15.3f} {duration:>7.2f}s')
+        for name in sorted(counter.counts):
+            print(f'    {name:<14} {counter.counts[name]:>8}')
+
+
+def load_sync(path):
+    """
+    Load a recorded initial sync, or generate a synthetic one if no recording was specified
+    """
+    if path is None:
+        return pack_datagrams(synthetic_state())
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    fields = []
+    offset = 0
+    while offset < len(data):
+        length, = struct.unpack_from('!H', data, offset)
+        fields.append(data[offset:offset + length])
+        offset += length
+    return pack_datagrams(fields)
+
+
+def bench_record(args):
+    """
+    Record the initial sync of a switcher to use with the other benchmarks
+    """
+    switcher = AtemProtocol(args.ip)
+    recording = []
+    switcher.connect()
+    while not switcher.connected or len(recording) == 0 or 'InCm' not in switcher.mixerstate:
+        packet = switcher.transport.receive_packet()
+        if isinstance(packet, Packet):
+            recording.append(bytes(packet.data))
+        switcher._process_packet(packet)
+    with open(args.output, 'wb') as handle:
+        handle.write(b''.join(recording))
+    print(f'Recorded {len(recording)} packets')
+
+
+def bench_decode(args):
+    """
+    Number of fields decoded and stored per second for a complete initial sync
+    """
+    datagrams = load_sync(args.input)
+    switcher = AtemProtocol('127.0.0.1')
+    switcher.lazy_decode = args.lazy
+    switcher.suppress_unchanged = args.suppress
+    fields = sum(1 for datagram in datagrams for _ in switcher.decode_packet(datagram))
+
+    best = None
+    for i in range(args.rounds):
+        if not args.updates:
+            switcher.mixerstate.clear()
+            switcher.raw_state.clear()
+        start = time.perf_counter()
+        for datagram in datagrams:
+            for fieldname, data in switcher.decode_packet(datagram):
+                switcher.save_field_data(fieldname, data)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+
+    print(f'{fields} fields in {len(datagrams)} packets, best of {args.rounds}: {best * 1000:.2f}ms, '
+          f'{fields / best:.0f} fields/s')
+
+
+def bench_memory(args):
+    """
+    Memory used by the state of a switcher after the initial sync
+    """
+    datagrams = load_sync(args.input)
+
+    switchers = []
+    tracemalloc.start()
+    for i in range(args.switchers):
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.lazy_decode = args.lazy
+        switcher.fast_reconnect = args.fast_reconnect
+        switchers.append(switcher)
+    baseline, _ = tracemalloc.get_traced_memory()
+
+    fields = 0
+    for switcher in switchers:
+        for datagram in datagrams:
+            # Copy the packet like the receive thread does so nothing is shared between switchers
+            for fieldname, data in switcher.decode_packet(bytes(datagram)):
+                switcher.save_field_data(fieldname, data)
+                fields += 1
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_switcher = (used - baseline) / args.switchers
+    print(f'{args.switchers} switchers, {fields // args.switchers} fields each: {per_switcher / 1024:.1f} KiB state '
+          f'per switcher, {per_switcher * args.switchers / fields:.0f} bytes per field')
+
+
+def synthetic_rows(width, height):
+    """
+    RGBA rows with a gradient in the top half and a solid color in the bottom half, so the compressed data has
+    both raw blocks and RLE sequences
+    """
+    gradient = b''.join(bytes((x % 256, (x // 4) % 256, 128, 255)) for x in range(width))
+    solid = b'\x20\x40\x80\xff' * width
+    for y in range(height):
+        yield gradient if y < height // 2 else solid
+
+
+def synthetic_frame(width, height):
+    """
+    The synthetic_rows frame in the ATEM pixel format
+    """
+    from pyatem.media import rgb_to_atem
+    return rgb_to_atem(b''.join(synthetic_rows(width, height)), width, height)
+
+
+def bench_upload(args):
+    """
+    Upload throughput to an emulated switcher for a single still, for the frames of a clip and for both at the same
+    time, which run concurrently because they use different stores
+    """
+    width, height = args.resolution
+    frame = None if args.stream else synthetic_frame(width, height)
+
+    emulator = UploadSwitcher()
+    emulator.start()
+    switcher = AtemProtocol('127.0.0.1', emulator.port)
+    pending = []
+    switcher.on('upload-done', lambda store, slot: pending.remove((store, slot)))
+    switcher.connect()
+    while not switcher.connected:
+        switcher.loop()
+
+    print(f'{"upload":<8} {"frames":>7} {"sent":>10} {"time":>8} {"throughput":>12} {"first data":>11}')
+    runs = (
+        ('still', [(0, 0)]),
+        ('clip', [(1, i) for i in range(args.frames)]),
+        ('both', [(0, 0)] + [(1, i) for i in range(args.frames)]),
+    )
+    for name, uploads in runs:
+        emulator.received = 0
+        start = time.perf_counter()
+        for store, slot in uploads:
+            pending.append((store, slot))
+            if args.stream:
+                switcher.upload_stream(store, slot, synthetic_rows(width, height), width, height,
+                                       name=f'{name} {slot}')
+            else:
+                switcher.upload(store, slot, frame, name=f'{name} {slot}')
+        first = None
+        frames = len(uploads)
+        while pending:
+            switcher.loop()
+            if first is None and emulator.received > 0:
+                first = time.perf_counter() - start
+        duration = time.perf_counter() - start
+        print(f'{name:<8} {frames:>7} {emulator.received / 1024 / 1024:>8.1f}MB {duration:>7.2f}s '
+              f'{emulator.received / 1024 / 1024 / duration:>8.1f}MB/s {first * 1000:>9.1f}ms')
+    emulator.stop = True
+
+
+def bench_rle(args):
+    """
+    RLE decode throughput of the Python and the native decoder for the ramps test fixture, which barely compresses,
+    and for frames with solid areas
+    """
+    import gzip
+    import os
+    from pyatem.media import rle_encode, rle_decode, rle_decode_slow
+
+    fixture = os.path.join(os.path.dirname(__file__), '..', 'pyatem', 'fixtures', 'ramps-atemsc.data.gz')
+    with gzip.open(fixture) as handle:
+        ramps = handle.read()
+    frames = [
+        ('ramps', ramps),
+        ('mixed', synthetic_frame(1920, 1080)),
+        ('solid', b'\x20\x40\x80\xff' * 1920 * 1080),
+    ]
+
+    output = bytearray(max(len(frame) for name, frame in frames))
+    decoders = [
+        ('python', rle_decode_slow),
+        ('native', rle_decode),
+        ('into', lambda data: rle_decode(data, output)),
+    ]
+    print(f'{"frame":<8} {"decoder":<8} {"ratio":>6} {"time":>9} {"speed":>11}')
+    for name, frame in frames:
+        compressed = rle_encode(frame)
+        for decoder_name, decoder in decoders:
+            rounds = max(1, args.rounds // 20) if decoder_name == 'python' else args.rounds
+            start = time.perf_counter()
+            for i in range(rounds):
+                decoder(compressed)
+            duration = (time.perf_counter() - start) / rounds
+            print(f'{name:<8} {decoder_name:<8} {len(compressed) / len(frame):>6.2f} {duration * 1000:>7.2f}ms '
+                  f'{len(frame) / 1024 / 1024 / duration:>6.0f}MB/s')
+
+
+def bench_meters(args):
+    """
+    Meter packets decoded per second with the per field decoders and with the bulk MeterMatrix
+    """
+    import pyatem.meters
+    from pyatem.meters import MeterMatrix
+
+    datagrams = pack_datagrams(synthetic_meters(args.strips))
+    modes = [('fields', False, False), ('array', True, False)]
+    if pyatem.meters.numpy is not None:
+        modes.append(('numpy', True, True))
+
+    for name, bulk, use_numpy in modes:
+        switcher = AtemProtocol('127.0.0.1')
+        switcher.bulk_meters = bulk
+        switcher.meters = MeterMatrix(use_numpy=use_numpy)
+        events = [0]
+
+        def on_event(*args):
+            events[0] += 1
+
+        switcher.on('change', on_event)
+        switcher.on('meters-updated', on_event)
+
+        packets = []
+        for datagram in datagrams:
+            packet = Packet()
+            packet.data = datagram
+            packets.append(packet)
+
+        start = time.perf_counter()
+        for i in range(args.updates):
+            for packet in packets:
+                switcher._process_packet(packet)
+        duration = time.perf_counter() - start
+        print(f'{name:<8} {args.updates / duration:>8.0f} updates/s, {events[0] / args.updates:>5.1f} events per '
+              f'update of {args.strips} strips')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pyatem benchmarks")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    io = sub.add_parser('io', help='Socket syscalls per decoded field in the UDP transport')
+    io.add_argument('--updates', type=int, default=200, help='Number of meter updates after the initial sync')
+    io.set_defaults(func=bench_io)
+
+    decode = sub.add_parser('decode', help='Fields decoded per second for an initial sync')
+    decode.add_argument('--input', help='Recorded initial sync to use instead of the synthetic state')
+    decode.add_argument('--rounds', type=int, default=20, help='Number of times to decode the sync')
+    decode.add_argument('--lazy', action='store_true', help='Enable lazy field decoding')
+    decode.add_argument('--updates', action='store_true',
+                        help='Keep the state between rounds so every field is an update of an existing field')
+    decode.add_argument('--suppress', action='store_true', help='Suppress fields that are sent again unchanged')
+    decode.set_defaults(func=bench_decode)
+
+    memory = sub.add_parser('memory', help='Memory used by the switcher state after the initial sync')
+    memory.add_argument('--input', help='Recorded initial sync to use instead of the synthetic state')
+    memory.add_argument('--switchers', type=int, default=10, help='Number of switchers to load the state into')
+    memory.add_argument('--lazy', action='store_true', help='Enable lazy field decoding')
+    memory.add_argument('--fast-reconnect', action='store_true', help='Keep the raw state for fast reconnects')
+    memory.set_defaults(func=bench_memory)
+
+    meters = sub.add_parser('meters', help='Audio meter updates decoded per second')
+    meters.add_argument('--strips', type=int, default=80, help='Number of Fairlight strips')
+    meters.add_argument('--updates', type=int, default=500, help='Number of meter updates to decode')
+    meters.set_defaults(func=bench_meters)
+
+    upload = sub.add_parser('upload', help='Upload throughput for a still and a clip to an emulated switcher')
+    upload.add_argument('--resolution', type=int, nargs=2, default=(3840, 2160), metavar=('WIDTH', 'HEIGHT'),
+                        help='Frame size, defaults to 4K')
+    upload.add_argument('--frames', type=int, default=10, help='Number of frames in the clip')
+    upload.add_argument('--stream', action='store_true',
+                        help='Convert and compress the RGBA rows while uploading with upload_stream()')
+    upload.set_defaults(func=bench_upload)
+
+    rle = sub.add_parser('rle', help='RLE decode throughput of the Python and native decoders')
+    rle.add_argument('--rounds', type=int, default=100, help='Number of times to decode every frame')
+    rle.set_defaults(func=bench_rle)
+
+    record = sub.add_parser('record', help='Record the initial sync of a switcher for the decode benchmark')
+    record.add_argument('ip', help='Switcher address')
+    record.add_argument('output', help='File to write the recording to')
+    record.set_defaults(func=bench_record)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()